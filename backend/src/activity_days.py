@@ -0,0 +1,240 @@
+# ==================== CALENDÁRIO DE ATIVIDADE (BITMAP DE DIAS) ====================
+# Um bit por dia com atividade, empacotado em bytes (activity_calendars).
+# É marcado na ingestão (via eventos da gamificação) e as consultas de
+# sequência atual, maior sequência e calendário são operações de bits sobre
+# um inteiro, sem varrer fitness_data nem participações. Dias em UTC.
+# Só dias dentro de [hoje - MAX_PAST_DAYS, hoje + 1] são marcados: um
+# start_time absurdo (1970, ano 9999) faria o bitmap crescer sem limite.
+# O preenchimento inicial e a reconstrução seguem a regra da ingestão
+# (gamification._active_day): só atividades confiáveis e com valor contam,
+# então não leem o rollup diário, que soma todas as amostras.
+
+import os
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, or_
+from models import (
+    ActivityCalendar, FitnessData, FitnessHourly, FitbitActivity, FitbitUser, insert_ignore
+)
+from antifraud import trusted_filter
+
+MAX_PAST_DAYS = int(os.getenv('ACTIVITY_MAX_PAST_DAYS', '3650'))
+MAX_FUTURE_DAYS = 1  # Fuso do dispositivo adiantado em relação ao UTC
+
+
+def _to_int(calendar):
+    return int.from_bytes(calendar.bits or b'', 'little')
+
+
+def _store(calendar, value):
+    calendar.bits = value.to_bytes((value.bit_length() + 7) // 8, 'little')
+
+
+def _as_day(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    return value
+
+
+def longest_run(value):
+    """Maior sequência de bits 1 (cada passo encurta todas as sequências em 1)"""
+    length = 0
+    while value:
+        value &= value >> 1
+        length += 1
+    return length
+
+
+def run_ending_at(value, position):
+    """Tamanho da sequência de bits 1 que termina em position (0 se o bit estiver apagado)"""
+    if position < 0:
+        return 0
+    mask = (1 << (position + 1)) - 1
+    holes = ~value & mask
+    return position + 1 if not holes else position + 1 - holes.bit_length()
+
+
+def run_containing(value, position):
+    """Tamanho da sequência de bits 1 que contém position"""
+    if position < 0 or not (value >> position) & 1:
+        return 0
+    above = ~(value >> position)
+    return run_ending_at(value, position) + ((above & -above).bit_length() - 1) - 1
+
+
+def history_days(session, user_id):
+    """
+    Dias com atividade que conta para sequências, a partir do histórico:
+    FitnessData confiável com valor > 0, FitbitActivity com alguma métrica > 0
+    e amostras já compactadas (fitness_hourly, só recebe amostras confiáveis)
+    """
+    queries = [
+        session.query(func.date(FitnessData.start_time)).filter(
+            FitnessData.user_id == user_id,
+            FitnessData.value > 0,
+            trusted_filter()
+        ),
+        session.query(func.date(FitbitActivity.start_time)).join(
+            FitbitUser, FitbitActivity.fitbit_user_id == FitbitUser.id
+        ).filter(
+            FitbitUser.user_id == user_id,
+            or_(FitbitActivity.distance > 0, FitbitActivity.steps > 0,
+                FitbitActivity.duration > 0, FitbitActivity.calories > 0)
+        ),
+        session.query(func.date(FitnessHourly.hour)).filter(
+            FitnessHourly.user_id == user_id,
+            FitnessHourly.total > 0
+        ),
+    ]
+    return {_as_day(day) for query in queries for (day,) in query.distinct() if day}
+
+
+def load_calendar(session, user_id, seed=True, for_update=False):
+    """
+    Calendário do usuário (criado e preenchido pelo histórico na primeira vez)
+
+    A linha é criada com INSERT ... ON CONFLICT DO NOTHING (se outra transação
+    criar ao mesmo tempo, vale a dela); for_update trava a linha até o commit
+    para que marcações concorrentes do mesmo usuário não percam dias.
+    """
+    cache = session.info.setdefault('activity_calendars', {})
+    calendar = cache.get(user_id)
+    if calendar is not None:
+        return calendar
+    lock = {'with_for_update': True, 'populate_existing': True} if for_update else {}
+    calendar = session.get(ActivityCalendar, user_id, **lock)
+    if calendar is None:
+        seeded = ActivityCalendar(user_id=user_id, bits=b'', longest_streak=0)
+        if seed:
+            # Primeira vez: dias do histórico que contam para sequências
+            _set_days(seeded, history_days(session, user_id))
+        insert_ignore(session, ActivityCalendar, [{
+            'user_id': user_id,
+            'start_day': seeded.start_day,
+            'bits': seeded.bits,
+            'last_active_day': seeded.last_active_day,
+            'longest_streak': seeded.longest_streak
+        }])
+        calendar = session.get(ActivityCalendar, user_id, **lock)
+    cache[user_id] = calendar
+    return calendar
+
+
+def _set_days(calendar, days):
+    """Liga os bits dos dias; retorna [(posição, dia)] dos que eram novos"""
+    today = datetime.utcnow().date()
+    oldest, newest = today - timedelta(days=MAX_PAST_DAYS), today + timedelta(days=MAX_FUTURE_DAYS)
+    days = sorted({day for day in (_as_day(d) for d in days if d) if oldest <= day <= newest})
+    if not days:
+        return []
+    value = _to_int(calendar)
+    if calendar.start_day is None:
+        calendar.start_day = days[0]
+    elif days[0] < calendar.start_day:
+        # Atividade anterior ao bit 0: desloca o bitmap
+        value <<= (calendar.start_day - days[0]).days
+        calendar.start_day = days[0]
+
+    added = []
+    for day in days:
+        position = (day - calendar.start_day).days
+        if not (value >> position) & 1:
+            value |= 1 << position
+            added.append((position, day))
+    if added:
+        _store(calendar, value)
+        last = max(day for _, day in added)
+        if calendar.last_active_day is None or last > calendar.last_active_day:
+            calendar.last_active_day = last
+        calendar.longest_streak = max(calendar.longest_streak or 0, longest_run(value))
+    return added
+
+
+def mark_active_days(session, user_id, days):
+    """
+    Marca dias com atividade (sem commit)
+
+    Returns:
+        Lista com (maior trecho antes, tamanho depois) de cada sequência que
+        recebeu dias novos, para detectar quando ela cruza 7/30 dias
+    """
+    calendar = load_calendar(session, user_id, for_update=True)
+    start_before = calendar.start_day
+    before = _to_int(calendar)
+    added = _set_days(calendar, days)
+    if not added:
+        return []
+    after = _to_int(calendar)
+    if start_before is not None:
+        before <<= (start_before - calendar.start_day).days  # Mesmas posições do bitmap novo
+
+    runs = {}
+    for position, _ in added:
+        length = run_containing(after, position)
+        end = position + length - run_ending_at(after, position)
+        if end not in runs:
+            low = end - length + 1
+            runs[end] = (longest_run((before >> low) & ((1 << length) - 1)), length)
+    return list(runs.values())
+
+
+def current_streak(calendar, today=None):
+    """Dias consecutivos até hoje (ou até ontem, se hoje ainda não teve atividade)"""
+    if calendar is None or calendar.start_day is None:
+        return 0
+    today = _as_day(today) or datetime.utcnow().date()
+    value = _to_int(calendar)
+    position = (today - calendar.start_day).days
+    streak = run_ending_at(value, position)
+    return streak or run_ending_at(value, position - 1)
+
+
+def get_activity_calendar(calendar, start, end):
+    """Dias ativos entre start e end (inclusive) e o total, recortando o bitmap"""
+    start, end = _as_day(start), _as_day(end)
+    if calendar is None or calendar.start_day is None or end < start:
+        return {'days': [], 'active_days': 0}
+    value = _to_int(calendar)
+    first = (start - calendar.start_day).days
+    last = (end - calendar.start_day).days
+    if first < 0:
+        value <<= -first
+        last -= first
+        first = 0
+    window = (value >> first) & ((1 << (last - first + 1)) - 1)
+    days = []
+    bits = window
+    while bits:
+        low = bits & -bits
+        days.append((start + timedelta(days=low.bit_length() - 1)).isoformat())
+        bits ^= low
+    return {'days': days, 'active_days': bin(window).count('1')}
+
+
+def get_streak_summary(session, user_id, today=None):
+    """Sequência atual, maior sequência e dias ativos nos últimos 7/30 dias"""
+    calendar = load_calendar(session, user_id)
+    today = _as_day(today) or datetime.utcnow().date()
+    return {
+        'current_streak': current_streak(calendar, today),
+        'longest_streak': calendar.longest_streak or 0,
+        'last_active_day': calendar.last_active_day.isoformat() if calendar.last_active_day else None,
+        'active_days_7': get_activity_calendar(calendar, today - timedelta(days=6), today)['active_days'],
+        'active_days_30': get_activity_calendar(calendar, today - timedelta(days=29), today)['active_days']
+    }
+
+
+def rebuild_activity_calendar(session, user_id):
+    """Reconstrói o bitmap do usuário a partir do histórico (sem commit)"""
+    session.info.get('activity_calendars', {}).pop(user_id, None)
+    calendar = session.get(ActivityCalendar, user_id)
+    if calendar is not None:
+        calendar.start_day = None
+        calendar.bits = b''
+        calendar.last_active_day = None
+        calendar.longest_streak = 0
+        _set_days(calendar, history_days(session, user_id))
+        session.info.setdefault('activity_calendars', {})[user_id] = calendar
+        return calendar
+    return load_calendar(session, user_id)
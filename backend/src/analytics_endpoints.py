@@ -4,30 +4,32 @@
 from flask import request, jsonify
 from sqlalchemy import func
 from datetime import datetime, timedelta
-from models import SessionLocal, User, ChallengeParticipation as Participation, Transaction, Challenge
+from models import SessionLocal, User, ChallengeParticipation as Participation, ChallengeWinner, Transaction, Challenge
+from fitness_rollup import get_metric_summary
+from activity_days import get_streak_summary, get_activity_calendar, load_calendar
+from auth_context import request_user
 
 def get_user_analytics(user_email):
     """GET /api/analytics/<user_email> - Estatísticas completas do usuário"""
     session = SessionLocal()
     try:
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'success': False, 'error': 'Usuário não encontrado'}), 404
 
         # Período de análise
         last_30_days = datetime.utcnow() - timedelta(days=30)
-        last_7_days = datetime.utcnow() - timedelta(days=7)
 
-        # Total ganho
-        total_earned = session.query(func.sum(Participation.prize_amount)).filter(
-            Participation.user_id == user.id,
-            Participation.status == 'winner'
+        # Total ganho (prêmios ficam em challenge_winners)
+        total_earned = session.query(func.sum(ChallengeWinner.prize_amount)).filter(
+            ChallengeWinner.user_id == user.id
         ).scalar() or 0
 
-        total_earned_30d = session.query(func.sum(Participation.prize_amount)).filter(
-            Participation.user_id == user.id,
-            Participation.status == 'winner',
-            Participation.completed_at >= last_30_days
+        total_earned_30d = session.query(func.sum(ChallengeWinner.prize_amount)).filter(
+            ChallengeWinner.user_id == user.id,
+            ChallengeWinner.completed_at >= last_30_days
         ).scalar() or 0
 
         # Desafios
@@ -40,61 +42,50 @@ def get_user_analytics(user_email):
             Participation.status.in_(['winner', 'completed'])
         ).scalar() or 0
 
-        challenges_won = session.query(func.count(Participation.id)).filter(
-            Participation.user_id == user.id,
-            Participation.status == 'winner'
+        challenges_won = session.query(func.count(ChallengeWinner.id)).filter(
+            ChallengeWinner.user_id == user.id
         ).scalar() or 0
 
         # Taxa de vitória
         win_rate = (challenges_won / challenges_completed * 100) if challenges_completed > 0 else 0
 
-        # Streak (sequência de dias)
-        # Simplificado: contar desafios nos últimos 7 dias
-        active_days_7 = session.query(
-            func.count(func.distinct(func.date(Participation.joined_at)))
-        ).filter(
-            Participation.user_id == user.id,
-            Participation.joined_at >= last_7_days
-        ).scalar() or 0
-
-        # Evolução mensal (dados para gráfico)
+        # Streak (sequência de dias) a partir do bitmap de dias com atividade
+        streaks = get_streak_summary(session, user.id)
+        session.commit()  # Grava o calendário se foi criado agora
+
+        # Evolução mensal (dados para gráfico), ganhos por dia numa única consulta
+        earned_by_day = {
+            str(day): float(total or 0) for day, total in session.query(
+                func.date(ChallengeWinner.completed_at), func.sum(ChallengeWinner.prize_amount)
+            ).filter(
+                ChallengeWinner.user_id == user.id,
+                ChallengeWinner.completed_at >= datetime.utcnow() - timedelta(days=31)
+            ).group_by(func.date(ChallengeWinner.completed_at))
+        }
         monthly_data = []
         for i in range(30, -1, -1):
-            date = datetime.utcnow() - timedelta(days=i)
-            daily_earned = session.query(func.sum(Participation.prize_amount)).filter(
-                Participation.user_id == user.id,
-                Participation.status == 'winner',
-                func.date(Participation.completed_at) == date.date()
-            ).scalar() or 0
-
-            monthly_data.append({
-                'date': date.strftime('%Y-%m-%d'),
-                'earned': float(daily_earned)
-            })
+            date = (datetime.utcnow() - timedelta(days=i)).strftime('%Y-%m-%d')
+            monthly_data.append({'date': date, 'earned': earned_by_day.get(date, 0.0)})
 
         # Posições conquistadas
+        by_position = dict(session.query(ChallengeWinner.position, func.count(ChallengeWinner.id)).filter(
+            ChallengeWinner.user_id == user.id,
+            ChallengeWinner.position.in_([1, 2, 3])
+        ).group_by(ChallengeWinner.position).all())
         positions = {
-            '1st': session.query(func.count(Participation.id)).filter(
-                Participation.user_id == user.id,
-                Participation.status == 'winner',
-                Participation.position == 1
-            ).scalar() or 0,
-            '2nd': session.query(func.count(Participation.id)).filter(
-                Participation.user_id == user.id,
-                Participation.status == 'winner',
-                Participation.position == 2
-            ).scalar() or 0,
-            '3rd': session.query(func.count(Participation.id)).filter(
-                Participation.user_id == user.id,
-                Participation.status == 'winner',
-                Participation.position == 3
-            ).scalar() or 0
+            '1st': by_position.get(1, 0),
+            '2nd': by_position.get(2, 0),
+            '3rd': by_position.get(3, 0)
         }
 
+        # Fitness dos últimos 30 dias (rollup diário, sem varrer fitness_data)
+        fitness_30d = get_metric_summary(session, user.id, since=last_30_days)
+
         # Média de usuários (para comparação)
-        avg_earned = session.query(func.avg(func.sum(Participation.prize_amount))).filter(
-            Participation.status == 'winner'
-        ).group_by(Participation.user_id).scalar() or 0
+        per_user = session.query(func.sum(ChallengeWinner.prize_amount).label('earned')).group_by(
+            ChallengeWinner.user_id
+        ).subquery()
+        avg_earned = session.query(func.avg(per_user.c.earned)).scalar() or 0
 
         session.close()
 
@@ -117,8 +108,14 @@ def get_user_analytics(user_email):
             },
             'positions': positions,
             'activity': {
-                'streak_days': active_days_7,
-                'last_7_days_active': active_days_7
+                'streak_days': streaks['current_streak'],
+                'longest_streak': streaks['longest_streak'],
+                'last_active_day': streaks['last_active_day'],
+                'last_7_days_active': streaks['active_days_7'],
+                'last_30_days_active': streaks['active_days_30']
+            },
+            'fitness': {
+                'last_30_days': fitness_30d
             },
             'monthly_evolution': monthly_data
         })
@@ -127,6 +124,47 @@ def get_user_analytics(user_email):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def get_user_activity_calendar(user_email):
+    """GET /api/analytics/<user_email>/calendar?start=YYYY-MM-DD&end=YYYY-MM-DD - Dias com atividade"""
+    session = SessionLocal()
+    try:
+        user, error = request_user(session, user_email)
+        if error:
+            return error
+        if not user:
+            return jsonify({'success': False, 'error': 'Usuário não encontrado'}), 404
+
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') \
+            else datetime.utcnow().date()
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') \
+            else end - timedelta(days=364)
+        if (end - start).days > 3660:
+            return jsonify({'success': False, 'error': 'Período máximo de 10 anos'}), 400
+
+        calendar = get_activity_calendar(load_calendar(session, user.id), start, end)
+        streaks = get_streak_summary(session, user.id)
+        session.commit()
+
+        return jsonify({
+            'success': True,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'days': calendar['days'],
+            'active_days': calendar['active_days'],
+            'current_streak': streaks['current_streak'],
+            'longest_streak': streaks['longest_streak']
+        })
+
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Datas devem estar no formato YYYY-MM-DD'}), 400
+    except Exception as e:
+        session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        session.close()
+
+
 def register_analytics_routes(app):
     """Registra rotas de analytics"""
     app.route('/api/analytics/<user_email>', methods=['GET'])(get_user_analytics)
+    app.route('/api/analytics/<user_email>/calendar', methods=['GET'])(get_user_activity_calendar)
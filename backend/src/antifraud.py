@@ -0,0 +1,242 @@
+# ==================== ANTI-FRAUDE EM LOTE ====================
+# Score de confiança de cada amostra de fitness calculado sobre o lote
+# inteiro com NumPy: velocidade/ritmo por tipo de atividade, cadência de
+# passos, intervalos sobrepostos, duplicatas entre fontes e saltos em
+# relação à linha de base do próprio usuário (fitness_daily).
+# O score e os motivos ficam gravados em FitnessData.trust_score/fraud_reasons.
+
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from sqlalchemy import or_
+from models import FitnessData, FitnessDaily
+from fitness_rollup import normalize_metric, DISTANCE_UNITS, GOAL_METRICS
+
+# Abaixo disso a amostra é descartada na ingestão
+REJECT_THRESHOLD = 0.2
+# Abaixo disso a amostra é gravada mas não conta para desafios
+REVIEW_THRESHOLD = 0.5
+
+# Velocidade máxima plausível (km/h) por tipo de atividade
+MAX_SPEED_KMH = {
+    'running': 25.0,
+    'walking': 10.0,
+    'hiking': 10.0,
+    'cycling': 80.0,
+    'swimming': 8.0
+}
+DEFAULT_MAX_SPEED_KMH = 30.0
+
+MAX_STEP_CADENCE = 250.0  # passos por minuto
+DUPLICATE_WINDOW_SECONDS = 60.0
+DUPLICATE_VALUE_TOLERANCE = 0.01  # 1%
+BASELINE_DAYS = 28
+BASELINE_MIN_DAYS = 5
+BASELINE_SIGMAS = 4.0
+BASELINE_MIN_RATIO = 3.0
+
+MANUAL_SOURCES = ('manual_entry', 'manual')
+
+# Penalidade de cada verificação (score = produto de (1 - penalidade))
+PENALTIES = {
+    'manual_entry': 0.8,
+    'implausible_speed': 0.6,
+    'step_cadence_outlier': 0.5,
+    'overlapping_interval': 0.3,
+    'duplicate_sample': 0.7,
+    'baseline_jump': 0.3,
+    'invalid_interval': 0.4
+}
+REASONS = tuple(PENALTIES)
+
+
+def _epoch(value):
+    if value is None:
+        return np.nan
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _canonical(record):
+    """(métrica canônica, valor na unidade canônica) de um registro"""
+    unit = (record.unit or '').lower()
+    value = float(record.value or 0.0)
+    if unit in DISTANCE_UNITS:
+        return 'distance', value * DISTANCE_UNITS[unit]
+    return normalize_metric(record.data_type) or normalize_metric(unit), value
+
+
+def _arrays(records):
+    """Extrai os campos usados pelas verificações em arrays paralelos"""
+    n = len(records)
+    metric = np.empty(n, dtype=object)
+    activity = np.empty(n, dtype=object)
+    source = np.empty(n, dtype=object)
+    value = np.zeros(n)
+    start = np.zeros(n)
+    end = np.zeros(n)
+
+    for i, record in enumerate(records):
+        metric[i], value[i] = _canonical(record)
+        activity[i] = (record.data_type or '').lower()
+        source[i] = (record.source_app or '').lower()
+        start[i] = _epoch(record.start_time)
+        end[i] = _epoch(record.end_time)
+
+    return {'metric': metric, 'activity': activity, 'source': source,
+            'value': value, 'start': start, 'end': end}
+
+
+def score_batch(records, existing=(), baseline=None):
+    """
+    Calcula o score de confiança de um lote de registros
+
+    Args:
+        records: Registros FitnessData a pontuar
+        existing: Registros já gravados no mesmo período (para sobreposição/duplicatas)
+        baseline: {métrica: (média diária, desvio padrão)} do usuário
+
+    Returns:
+        (scores: np.ndarray, reasons: lista de listas de motivos)
+    """
+    n = len(records)
+    if n == 0:
+        return np.ones(0), []
+
+    data = _arrays(list(records) + list(existing))
+    metric, value, start, end = data['metric'], data['value'], data['start'], data['end']
+    minutes = (end - start) / 60.0
+    flags = {reason: np.zeros(len(value), dtype=bool) for reason in REASONS}
+
+    # Fonte manual
+    flags['manual_entry'] = np.isin(data['source'], MANUAL_SOURCES)
+
+    # Intervalo inválido (fim antes do início)
+    flags['invalid_interval'] = minutes < 0
+
+    # Velocidade/ritmo por tipo de atividade
+    is_distance = (metric == 'distance') & (minutes > 0)
+    max_speed = np.array([MAX_SPEED_KMH.get(a, DEFAULT_MAX_SPEED_KMH) for a in data['activity']])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed_kmh = np.where(is_distance, value / (minutes / 60.0), 0.0)
+        cadence = np.where((metric == 'steps') & (minutes > 0), value / minutes, 0.0)
+    flags['implausible_speed'] = is_distance & (speed_kmh > max_speed)
+
+    # Cadência de passos
+    flags['step_cadence_outlier'] = cadence > MAX_STEP_CADENCE
+
+    # Sobreposição e duplicatas: ordenar por (métrica, início) e comparar vizinhos
+    metric_codes = np.unique(metric.astype(str), return_inverse=True)[1]
+    order = np.lexsort((start, metric_codes))
+    s_metric = metric_codes[order]
+    s_start = start[order]
+    s_end = np.where(np.isnan(end[order]), s_start, end[order])
+    s_value = value[order]
+    s_source = data['source'][order]
+
+    same_metric = s_metric[1:] == s_metric[:-1]
+
+    # Fim mais tardio visto até aqui dentro da mesma métrica
+    running_end = s_end.copy()
+    for code in np.unique(s_metric):
+        mask = s_metric == code
+        running_end[mask] = np.maximum.accumulate(s_end[mask])
+    overlaps = same_metric & (s_start[1:] < running_end[:-1])
+
+    close_start = np.abs(s_start[1:] - s_start[:-1]) <= DUPLICATE_WINDOW_SECONDS
+    scale = np.maximum(np.abs(s_value[1:]), 1e-9)
+    close_value = np.abs(s_value[1:] - s_value[:-1]) / scale <= DUPLICATE_VALUE_TOLERANCE
+    duplicates = same_metric & close_start & close_value & (s_source[1:] != s_source[:-1])
+
+    # Duplicata entre fontes não conta também como sobreposição
+    overlaps &= ~duplicates
+    # Sobreposição marca os dois lados do par; duplicata marca só a cópia
+    # (o segundo do par, ou o registro novo quando o par é novo + gravado)
+    prev_idx, next_idx = order[:-1], order[1:]
+    flags['overlapping_interval'][next_idx[overlaps]] = True
+    flags['overlapping_interval'][prev_idx[overlaps]] = True
+    flags['duplicate_sample'][next_idx[duplicates]] = True
+    flags['duplicate_sample'][prev_idx[duplicates & (prev_idx < n) & (next_idx >= n)]] = True
+
+    # Salto em relação à linha de base do usuário
+    if baseline:
+        mean = np.array([baseline.get(m, (np.nan, np.nan))[0] for m in metric], dtype=float)
+        std = np.array([baseline.get(m, (np.nan, np.nan))[1] for m in metric], dtype=float)
+        with np.errstate(invalid='ignore'):
+            flags['baseline_jump'] = (value > mean + BASELINE_SIGMAS * std) & (value > mean * BASELINE_MIN_RATIO)
+
+    # Score = produto das penalidades das verificações que dispararam
+    stacked = np.vstack([flags[reason][:n] for reason in REASONS])
+    penalties = np.array([PENALTIES[reason] for reason in REASONS])[:, None]
+    scores = np.prod(np.where(stacked, 1.0 - penalties, 1.0), axis=0)
+
+    reasons = [[] for _ in range(n)]
+    for row, idx in zip(*np.nonzero(stacked)):
+        reasons[idx].append(REASONS[row])
+
+    return np.round(scores, 4), reasons
+
+
+def load_baseline(session, user_id, days=BASELINE_DAYS):
+    """Média e desvio padrão diários das métricas de meta (fitness_daily)"""
+    since = datetime.utcnow().date() - timedelta(days=days)
+    rows = session.query(FitnessDaily.metric, FitnessDaily.total).filter(
+        FitnessDaily.user_id == user_id,
+        FitnessDaily.metric.in_(GOAL_METRICS),
+        FitnessDaily.day >= since
+    ).all()
+
+    by_metric = {}
+    for metric, total in rows:
+        by_metric.setdefault(metric, []).append(total or 0.0)
+
+    return {
+        metric: (float(np.mean(totals)), float(np.std(totals)))
+        for metric, totals in by_metric.items()
+        if len(totals) >= BASELINE_MIN_DAYS
+    }
+
+
+def score_fitness_records(session, user_id, records):
+    """
+    Pontua registros FitnessData de um usuário e grava trust_score/fraud_reasons
+    (sem commit). Compara com os registros já gravados no mesmo período.
+    """
+    records = list(records)
+    if not records:
+        return records
+
+    starts = [r.start_time.replace(tzinfo=None) for r in records if r.start_time]
+    existing = []
+    if starts:
+        batch_ids = {r.id for r in records if r.id}
+        with session.no_autoflush:
+            existing = [
+                r for r in session.query(FitnessData).filter(
+                    FitnessData.user_id == user_id,
+                    FitnessData.start_time >= min(starts) - timedelta(days=1),
+                    FitnessData.start_time <= max(starts) + timedelta(days=1)
+                ).all()
+                if r.id not in batch_ids
+            ]
+            baseline = load_baseline(session, user_id)
+    else:
+        baseline = None
+
+    scores, reasons = score_batch(records, existing, baseline)
+    for record, score, record_reasons in zip(records, scores, reasons):
+        record.trust_score = float(score)
+        record.fraud_reasons = ','.join(record_reasons) or None
+
+    return records
+
+
+def is_trusted(record):
+    """Se o registro pode contar para desafios"""
+    return record.trust_score is None or record.trust_score >= REVIEW_THRESHOLD
+
+
+def trusted_filter():
+    """Filtro SQL equivalente a is_trusted (para consultas em FitnessData)"""
+    return or_(FitnessData.trust_score.is_(None), FitnessData.trust_score >= REVIEW_THRESHOLD)
+
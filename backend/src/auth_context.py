@@ -0,0 +1,317 @@
+# ==================== CONTEXTO DE AUTENTICAÇÃO ====================
+# Tokens assinados (itsdangerous, com a SECRET_KEY do app) emitidos no login e
+# no registro. Um before_request valida a assinatura sem ir ao banco e resolve
+# o usuário uma única vez em g.user, a partir de um cache TTL/LRU indexado pelo
+# token. Os handlers usam g.user em vez de confiar no email enviado pelo
+# cliente; enquanto AUTH_REQUIRE_TOKEN estiver desligado, requisições sem
+# token ainda caem no email (modo legado, contado em /api/metrics).
+# Conexões Socket.IO resolvem o token uma única vez, no handshake (socket_user).
+# O token leva um carimbo derivado da senha (troca de senha revoga os tokens)
+# e alterações de senha/status/email de um usuário limpam o cache em todos os
+# nós (listener da sessão + canal interno do client manager).
+# A chave vem de AUTH_SECRET_KEY/SECRET_KEY: sem uma chave própria (ou com a
+# chave que já esteve no repositório) nenhum token é emitido nem aceito, e
+# com AUTH_REQUIRE_TOKEN ligado o servidor nem sobe.
+
+import os
+import sys
+import time
+import hmac
+import hashlib
+import secrets
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from flask import g, request, jsonify
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+import metrics
+from models import SessionLocal, User
+
+logger = logging.getLogger(__name__)
+
+TOKEN_MAX_AGE_SECONDS = int(os.getenv('AUTH_TOKEN_MAX_AGE', str(7 * 24 * 3600)))
+CACHE_TTL_SECONDS = int(os.getenv('AUTH_CACHE_TTL', '60'))
+CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+REQUIRE_TOKEN = os.getenv('AUTH_REQUIRE_TOKEN', 'false').lower() in ('1', 'true', 'yes')
+TOKEN_SALT = 'betfit-auth'
+MIN_SECRET_LENGTH = 16
+# Chaves publicadas (repositório / .env.example): qualquer um assinaria tokens com elas
+INSECURE_SECRET_KEYS = {'1657victOr@', 'sua_chave_secreta_aqui'}
+
+# Snapshot do usuário autenticado (desanexado da sessão, seguro para cache)
+AuthUser = namedtuple('AuthUser', ['id', 'email', 'name', 'status'])
+
+
+class UserCache:
+    """Cache TTL + LRU de token -> AuthUser"""
+
+    def __init__(self, ttl=CACHE_TTL_SECONDS, max_size=CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.manager = None
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if not item or item[0] <= time.monotonic():
+                self._items.pop(key, None)
+                return None
+            self._items.move_to_end(key)
+            return item[1]
+
+    def put(self, key, user):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, user)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def attach(self, manager):
+        """Liga o cache ao client manager do Socket.IO para invalidar em todos os nós"""
+        if manager is not None and manager is not self.manager and hasattr(manager, 'on_internal'):
+            self.manager = manager
+            manager.on_internal('auth_invalidate', self._on_remote)
+
+    def invalidate_user(self, user_id, publish=True):
+        """Remove todas as entradas do usuário (bloqueio, troca de email/senha)"""
+        with self._lock:
+            for key in [k for k, (_, u) in self._items.items() if u.id == user_id]:
+                del self._items[key]
+        if publish and self.manager is not None and hasattr(self.manager, 'publish_internal'):
+            try:
+                self.manager.publish_internal('auth_invalidate', {'user_ids': [user_id]})
+            except Exception as e:
+                logger.warning(f"[AUTH] Erro ao publicar invalidação do usuário {user_id}: {e}")
+
+    def _on_remote(self, payload, node_id):
+        for user_id in (payload or {}).get('user_ids', []):
+            self.invalidate_user(user_id, publish=False)
+
+
+user_cache = UserCache()
+_serializer = None
+
+
+def _secret_key():
+    """Chave dos tokens; None se ausente, curta ou conhecida"""
+    key = os.getenv('AUTH_SECRET_KEY') or os.getenv('SECRET_KEY')
+    if not key or key in INSECURE_SECRET_KEYS or len(key) < MIN_SECRET_LENGTH:
+        return None
+    return key
+
+
+def tokens_enabled():
+    return _serializer is not None
+
+
+def issue_token(user):
+    """
+    Gera o access_token assinado do usuário (id + email)
+
+    Sem chave segura devolve um token opaco que nunca é aceito (clientes
+    seguem no modo legado por email, como antes dos tokens assinados).
+    """
+    if _serializer is None:
+        return secrets.token_hex(16)
+    return _serializer.dumps({'uid': user.id, 'em': user.email, 'rv': revocation_stamp(user)})
+
+
+def revocation_stamp(user):
+    """Carimbo da senha atual (HMAC truncado do hash): muda quando a senha muda"""
+    return hmac.new(_secret_key().encode('utf-8'), (user.password or '').encode('utf-8'),
+                    hashlib.sha256).hexdigest()[:16]
+
+
+def _snapshot(user):
+    return AuthUser(user.id, user.email, user.name, user.status)
+
+
+def resolve_token(token):
+    """AuthUser do token (cache ou uma consulta por id); None se inválido/expirado"""
+    if not token or _serializer is None:
+        return None
+    user = user_cache.get(token)
+    if user is not None:
+        metrics.increment('auth_cache_hits')
+        return user
+
+    try:
+        payload = _serializer.loads(token, max_age=TOKEN_MAX_AGE_SECONDS)
+    except SignatureExpired:
+        metrics.increment('auth_tokens_rejected', labels={'reason': 'expired'})
+        return None
+    except BadSignature:
+        metrics.increment('auth_tokens_rejected', labels={'reason': 'signature'})
+        return None
+
+    metrics.increment('auth_cache_misses')
+    session = SessionLocal()
+    try:
+        record = session.get(User, payload.get('uid'))
+        # Token emitido para outro email (email trocado) ou usuário bloqueado não vale mais
+        if record is None or record.email != payload.get('em') or (record.status or 'active') != 'active':
+            metrics.increment('auth_tokens_rejected', labels={'reason': 'user'})
+            return None
+        # Senha trocada depois da emissão (ou token sem carimbo)
+        if not hmac.compare_digest(str(payload.get('rv', '')), revocation_stamp(record)):
+            metrics.increment('auth_tokens_rejected', labels={'reason': 'revoked'})
+            return None
+        user = _snapshot(record)
+    finally:
+        session.close()
+    user_cache.put(token, user)
+    return user
+
+
+def _bearer_token():
+    header = request.headers.get('Authorization', '')
+    if header.lower().startswith('bearer '):
+        return header[7:].strip()
+    return None
+
+
+def socket_user(auth=None):
+    """
+    Usuário de uma conexão Socket.IO, resolvido uma vez no 'connect'
+
+    O token vem em auth={'token': ...} do handshake, no header Authorization
+    ou em ?token=. Token inválido recusa a conexão; sem token (ou com os
+    tokens desativados), só o modo legado (AUTH_REQUIRE_TOKEN desligado) aceita.
+
+    Returns:
+        (AuthUser ou None no modo legado, conexão aceita?)
+    """
+    token = auth.get('token') if isinstance(auth, dict) else None
+    token = token or _bearer_token() or request.args.get('token')
+    if token and _serializer is not None:
+        user = resolve_token(token)
+        return user, user is not None
+    if REQUIRE_TOKEN:
+        return None, False
+    metrics.increment('auth_legacy_socket')
+    return None, True
+
+
+def load_request_user():
+    """before_request: resolve o chamador em g.user (None sem token válido)"""
+    g.user = None
+    token = _bearer_token()
+    if token:
+        g.user = resolve_token(token)
+
+
+def authenticated_user(email=None):
+    """
+    Usuário da requisição para handlers que antes recebiam o email do cliente
+
+    Com token válido, usa g.user; um email diferente do token é recusado.
+    Sem token, recusa se AUTH_REQUIRE_TOKEN, senão busca pelo email (legado).
+
+    Returns:
+        (AuthUser, None) ou (None, (resposta, status))
+    """
+    user, error = _token_user(email)
+    if user is not None or error is not None:
+        return user, error
+
+    session = SessionLocal()
+    try:
+        record = session.query(User).filter_by(email=email).first()
+        if record is None:
+            return None, (jsonify({'error': 'Usuário não encontrado'}), 404)
+        return _snapshot(record), None
+    finally:
+        session.close()
+
+
+def _token_user(email):
+    """
+    (g.user, None) com token; (None, erro) se o token não bate com o email ou se
+    o token é obrigatório; (None, None) quando o handler pode buscar pelo email
+    """
+    user = getattr(g, 'user', None)
+    if user is not None:
+        if email and email.strip().lower() != (user.email or '').lower():
+            return None, (jsonify({'error': 'Token não pertence a este usuário'}), 403)
+        return user, None
+
+    if REQUIRE_TOKEN or not email:
+        return None, (jsonify({'error': 'Autenticação necessária'}), 401)
+
+    metrics.increment('auth_legacy_email')
+    return None, None
+
+
+def uses_token_auth():
+    """Requisição com token válido, ou token obrigatório: o usuário vem do token"""
+    return getattr(g, 'user', None) is not None or REQUIRE_TOKEN
+
+
+def request_user(session, email=None):
+    """
+    User (ORM, na sessão do handler) da requisição, no lugar de
+    session.query(User).filter_by(email=...) com o email do cliente
+
+    Returns:
+        (User ou None se não existir, None) ou (None, (resposta, status)) se a
+        autenticação falhar — o handler mantém a própria resposta 404
+    """
+    user, error = _token_user(email)
+    if error is not None:
+        return None, error
+    if user is not None:
+        return session.get(User, user.id), None
+    return session.query(User).filter_by(email=email).first(), None
+
+
+# ==================== INVALIDAÇÃO ====================
+# Qualquer alteração de senha, status ou email (endpoint, job, script) tira o
+# usuário do cache depois do commit.
+
+_REVOKING_ATTRS = ('password', 'status', 'email')
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_revoked_users(session, flush_context):
+    changed = session.info.setdefault('auth_revoked_users', set())
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in _REVOKING_ATTRS):
+                changed.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_revoked_users(session):
+    for user_id in session.info.pop('auth_revoked_users', ()):
+        user_cache.invalidate_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_revoked_users(session):
+    session.info.pop('auth_revoked_users', None)
+
+
+def init_auth_context(app):
+    """Configura o serializer com a chave do ambiente e registra o before_request"""
+    global _serializer
+    key = _secret_key()
+    if key is None:
+        if REQUIRE_TOKEN:
+            print("[ERROR] [AUTH] AUTH_REQUIRE_TOKEN ligado sem SECRET_KEY segura "
+                  f"(mínimo {MIN_SECRET_LENGTH} caracteres, diferente da chave do repositório)")
+            sys.exit(1)
+        _serializer = None
+        app.before_request(load_request_user)
+        print("[WARNING] [AUTH] SECRET_KEY ausente ou insegura: tokens assinados desativados (modo legado por email)")
+        return
+    _serializer = URLSafeTimedSerializer(key, salt=TOKEN_SALT)
+    app.before_request(load_request_user)
+    print(f"[OK] [AUTH] Tokens assinados ativos (token obrigatório: {'sim' if REQUIRE_TOKEN else 'não'})")
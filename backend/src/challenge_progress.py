@@ -0,0 +1,281 @@
+# ==================== PROGRESSO INCREMENTAL DE DESAFIOS ====================
+# Total acumulado por participação mantido por delta no momento da ingestão
+# (Strava, Fitbit, HealthKit, mock). Cada atividade vira uma contribuição
+# (participação, fonte, id da atividade): reenvios não somam duas vezes e
+# correções do provedor recalculam apenas a participação afetada.
+
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import func
+from models import Challenge, ChallengeParticipation, ParticipationProgress, ProgressContribution
+from fitness_rollup import fitness_data_metrics, fitbit_activity_metrics, normalize_metric, GOAL_METRICS
+
+logger = logging.getLogger(__name__)
+
+SOURCE_FITNESS_DATA = 'fitness_data'
+SOURCE_FITBIT = 'fitbit'
+
+# Participações que continuam acumulando progresso enquanto o desafio está ativo
+TRACKED_STATUSES = ('active', 'completed')
+
+_listeners = []
+
+
+def on_progress(callback):
+    """Registra um callback chamado com cada evento de progresso (após o commit)"""
+    _listeners.append(callback)
+    return callback
+
+
+def dispatch_progress_events(events):
+    """Entrega os eventos aos listeners registrados (socket, leaderboard, notificações)"""
+    for event in events or []:
+        for callback in _listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"[PROGRESS] Erro no listener {getattr(callback, '__name__', callback)}: {e}")
+
+
+def _naive_utc(value):
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def challenge_metric(challenge):
+    """Métrica canônica usada como meta do desafio (ou None se não for cumulativo)"""
+    return normalize_metric(challenge.target_metric) or normalize_metric(challenge.category)
+
+
+def _goal_metrics(metrics):
+    totals = {}
+    for metric, value in metrics:
+        if metric in GOAL_METRICS:
+            totals[metric] = totals.get(metric, 0.0) + value
+    return totals
+
+
+# ==================== APLICAÇÃO DE ATIVIDADES ====================
+
+def apply_activities(session, user_id, activities):
+    """
+    Aplica atividades às participações ativas do usuário (sem commit)
+
+    Args:
+        session: Sessão SQLAlchemy da ingestão (mesma transação)
+        user_id: ID do usuário
+        activities: Lista de dicts {source, source_id, occurred_at, metrics: {métrica: valor}}
+
+    Returns:
+        Lista de eventos de progresso para dispatch_progress_events() após o commit
+    """
+    activities = [a for a in activities if a.get('metrics')]
+    if not activities:
+        return []
+
+    rows = session.query(ChallengeParticipation, Challenge).join(
+        Challenge, Challenge.id == ChallengeParticipation.challenge_id
+    ).filter(
+        ChallengeParticipation.user_id == user_id,
+        ChallengeParticipation.status.in_(TRACKED_STATUSES),
+        Challenge.status == 'active'
+    ).all()
+
+    # (participação, desafio, métrica) apenas para desafios cumulativos
+    tracked = []
+    for participation, challenge in rows:
+        metric = challenge_metric(challenge)
+        if metric:
+            tracked.append((participation, challenge, metric))
+
+    if not tracked:
+        return []
+
+    participation_ids = [p.id for p, _, _ in tracked]
+    source_ids = {str(a['source_id']) for a in activities}
+
+    contributions = {
+        (c.participation_id, c.source, c.source_id): c
+        for c in session.query(ProgressContribution).filter(
+            ProgressContribution.participation_id.in_(participation_ids),
+            ProgressContribution.source_id.in_(source_ids)
+        ).all()
+    }
+    progress_rows = {
+        p.participation_id: p
+        for p in session.query(ParticipationProgress).filter(
+            ParticipationProgress.participation_id.in_(participation_ids)
+        ).all()
+    }
+
+    events = []
+    for participation, challenge, metric in tracked:
+        start = _naive_utc(challenge.start_date)
+        end = _naive_utc(challenge.end_date)
+        delta = 0.0
+        added = 0
+        corrected = False
+        last_activity_at = None
+
+        for activity in activities:
+            value = activity['metrics'].get(metric)
+            if value is None:
+                continue
+            occurred_at = _naive_utc(activity.get('occurred_at')) or datetime.utcnow()
+            if (start and occurred_at < start) or (end and occurred_at > end):
+                continue
+
+            key = (participation.id, activity['source'], str(activity['source_id']))
+            contribution = contributions.get(key)
+            if contribution is None:
+                contribution = ProgressContribution(
+                    participation_id=participation.id,
+                    source=activity['source'],
+                    source_id=str(activity['source_id']),
+                    value=value,
+                    occurred_at=occurred_at
+                )
+                session.add(contribution)
+                contributions[key] = contribution
+                delta += value
+                added += 1
+            elif abs((contribution.value or 0.0) - value) > 1e-9:
+                contribution.value = value
+                corrected = True
+            else:
+                continue
+
+            if last_activity_at is None or occurred_at > last_activity_at:
+                last_activity_at = occurred_at
+
+        if not added and not corrected:
+            continue
+
+        progress = progress_rows.get(participation.id)
+        if progress is None:
+            progress = ParticipationProgress(
+                participation_id=participation.id,
+                challenge_id=challenge.id,
+                user_id=user_id,
+                metric=metric,
+                current_value=0.0,
+                contributions_count=0
+            )
+            session.add(progress)
+            progress_rows[participation.id] = progress
+
+        previous = progress.current_value or 0.0
+        progress.target_value = challenge.target_value
+        progress.contributions_count = (progress.contributions_count or 0) + added
+        if last_activity_at and (not progress.last_activity_at or last_activity_at > progress.last_activity_at):
+            progress.last_activity_at = last_activity_at
+
+        if corrected:
+            # Correção: recalcular somente esta participação a partir das contribuições
+            session.flush()
+            progress.current_value = _sum_contributions(session, participation.id)
+        else:
+            progress.current_value = previous + delta
+
+        events.extend(_progress_events(participation, challenge, progress, previous))
+
+    return events
+
+
+def _sum_contributions(session, participation_id):
+    total = session.query(func.sum(ProgressContribution.value)).filter(
+        ProgressContribution.participation_id == participation_id
+    ).scalar()
+    return float(total or 0.0)
+
+
+def _progress_events(participation, challenge, progress, previous):
+    """Atualiza a participação e monta os eventos de progresso/conclusão"""
+    current = progress.current_value or 0.0
+    participation.result_value = current
+
+    base = {
+        'challenge_id': challenge.id,
+        'challenge_title': challenge.title,
+        'participation_id': participation.id,
+        'user_id': participation.user_id,
+        'metric': progress.metric,
+        'value': round(current, 4),
+        'delta': round(current - previous, 4),
+        'target': challenge.target_value,
+        'timestamp': datetime.utcnow().isoformat()
+    }
+    events = [dict(base, type='progress')]
+
+    if challenge.target_value and current >= challenge.target_value and participation.status == 'active':
+        participation.status = 'completed'
+        participation.completed_at = datetime.utcnow()
+        events.append(dict(base, type='completed'))
+        print(f"[TROPHY] [PROGRESS] Desafio {challenge.id} completado por {participation.user_id}!")
+
+    return events
+
+
+# ==================== ENTRADAS POR FONTE ====================
+
+def track_fitness_data(session, fitness_records):
+    """Aplica registros FitnessData recém-criados (Strava, HealthKit, mock) ao progresso"""
+    if any(record.id is None for record in fitness_records):
+        session.flush()  # garantir IDs para as contribuições
+
+    by_user = {}
+    for record in fitness_records:
+        by_user.setdefault(record.user_id, []).append({
+            'source': SOURCE_FITNESS_DATA,
+            'source_id': record.id,
+            'occurred_at': record.start_time,
+            'metrics': _goal_metrics(fitness_data_metrics(record))
+        })
+
+    events = []
+    for user_id, activities in by_user.items():
+        events.extend(apply_activities(session, user_id, activities))
+    return events
+
+
+def track_fitbit_activities(session, user_id, activities):
+    """Aplica atividades Fitbit novas ou corrigidas ao progresso do usuário"""
+    return apply_activities(session, user_id, [
+        {
+            'source': SOURCE_FITBIT,
+            'source_id': activity.activity_id,
+            'occurred_at': activity.start_time,
+            'metrics': _goal_metrics(fitbit_activity_metrics(activity))
+        }
+        for activity in activities
+    ])
+
+
+# ==================== CONSULTAS / MANUTENÇÃO ====================
+
+def get_participation_progress(session, participation_id):
+    progress = session.query(ParticipationProgress).filter_by(participation_id=participation_id).first()
+    return progress.to_dict() if progress else None
+
+
+def get_challenge_progress(session, challenge_id):
+    """Progresso de todas as participações de um desafio (maior primeiro)"""
+    rows = session.query(ParticipationProgress).filter_by(
+        challenge_id=challenge_id
+    ).order_by(ParticipationProgress.current_value.desc()).all()
+    return [row.to_dict() for row in rows]
+
+
+def recompute_participation(session, participation_id):
+    """Recalcula o total de uma participação a partir das contribuições (sem commit)"""
+    progress = session.query(ParticipationProgress).filter_by(participation_id=participation_id).first()
+    if not progress:
+        return 0.0
+    progress.current_value = _sum_contributions(session, participation_id)
+    progress.contributions_count = session.query(func.count(ProgressContribution.id)).filter(
+        ProgressContribution.participation_id == participation_id
+    ).scalar() or 0
+    return progress.current_value
@@ -0,0 +1,206 @@
+# ==================== RESUMO DAS CONVERSAS (CAIXA DE ENTRADA) ====================
+# Uma linha por (usuário, conversa) com a última mensagem e o contador de não
+# lidas. É atualizada na mesma transação que grava a mensagem ou marca como
+# lida, então a caixa de entrada é uma leitura indexada e paginada em vez de
+# varrer todo o histórico do usuário. A linha é criada com INSERT ... ON
+# CONFLICT DO NOTHING e atualizada com um UPDATE que soma as não lidas no
+# SQL, então mensagens simultâneas na mesma conversa não colidem.
+
+from datetime import datetime
+from sqlalchemy import func
+from models import Conversation, Message, User, insert_ignore
+
+PREVIEW_LENGTH = 200
+DEFAULT_PAGE_SIZE = 30
+MAX_PAGE_SIZE = 100
+
+
+def conversation_key(peer_id=None, challenge_id=None):
+    """Chave da conversa: desafio tem prioridade sobre 1-on-1"""
+    if challenge_id:
+        return f"challenge_{challenge_id}"
+    return f"user_{peer_id}"
+
+
+def _preview(content):
+    content = content or ''
+    return content if len(content) <= PREVIEW_LENGTH else content[:PREVIEW_LENGTH - 1] + '…'
+
+
+def _last_message_values(message):
+    return {
+        'last_message_id': message.id,
+        'last_sender_id': message.sender_id,
+        'last_preview': _preview(message.content),
+        'last_message_type': message.message_type or 'text',
+        'last_message_at': message.created_at
+    }
+
+
+def _upsert(session, user_id, key, values, unread_increment=0, peer_id=None, challenge_id=None):
+    """Cria a linha se faltar (sem corrida na chave única) e grava a última mensagem"""
+    insert_ignore(session, Conversation, [{
+        'user_id': user_id, 'conversation_key': key, 'peer_id': peer_id,
+        'challenge_id': challenge_id, 'unread_count': 0
+    }])
+    session.query(Conversation).filter(
+        Conversation.user_id == user_id,
+        Conversation.conversation_key == key
+    ).update(
+        dict(values, unread_count=func.coalesce(Conversation.unread_count, 0) + unread_increment),
+        synchronize_session=False
+    )
+
+
+def record_message(session, message):
+    """
+    Atualiza os resumos das conversas com uma mensagem nova (sem commit)
+
+    1-on-1: linha do remetente e do destinatário (+1 não lida para ele).
+    Desafio: linha do remetente e, num único UPDATE, as linhas dos demais
+    membros que já têm a conversa na caixa de entrada.
+    """
+    if message.id is None or message.created_at is None:
+        # Defaults da coluna só são aplicados no flush; precisamos deles agora
+        session.flush([message])
+
+    values = _last_message_values(message)
+
+    if message.challenge_id:
+        key = conversation_key(challenge_id=message.challenge_id)
+        _upsert(session, message.sender_id, key, values, challenge_id=message.challenge_id)
+        session.query(Conversation).filter(
+            Conversation.conversation_key == key,
+            Conversation.user_id != message.sender_id
+        ).update(
+            dict(values, unread_count=Conversation.unread_count + 1, updated_at=datetime.utcnow()),
+            synchronize_session=False
+        )
+        return
+
+    if not message.receiver_id:
+        return
+
+    _upsert(session, message.sender_id, conversation_key(peer_id=message.receiver_id), values,
+            peer_id=message.receiver_id)
+    if message.receiver_id != message.sender_id:
+        _upsert(session, message.receiver_id, conversation_key(peer_id=message.sender_id), values,
+                unread_increment=1, peer_id=message.sender_id)
+
+
+def mark_conversation_read(session, user_id, peer_id=None, challenge_id=None):
+    """Zera o contador de não lidas (sem commit); sem peer/desafio zera todas"""
+    query = session.query(Conversation).filter(Conversation.user_id == user_id)
+    if challenge_id or peer_id:
+        query = query.filter(Conversation.conversation_key == conversation_key(peer_id, challenge_id))
+    return query.update({'unread_count': 0}, synchronize_session=False)
+
+
+def _parse_cursor(cursor):
+    """Cursor 'timestamp_iso|conversation_id' da última linha da página anterior"""
+    if not cursor:
+        return None
+    timestamp, _, conversation_id = cursor.partition('|')
+    return datetime.fromisoformat(timestamp), conversation_id
+
+
+def list_conversations(session, user_id, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """
+    Página da caixa de entrada, mais recentes primeiro (keyset em last_message_at, id)
+
+    Returns:
+        (lista de dicts, next_cursor ou None)
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = session.query(Conversation).filter(
+        Conversation.user_id == user_id,
+        Conversation.last_message_at.isnot(None)
+    )
+
+    position = _parse_cursor(cursor)
+    if position:
+        last_at, last_id = position
+        query = query.filter(
+            (Conversation.last_message_at < last_at)
+            | ((Conversation.last_message_at == last_at) & (Conversation.id < last_id))
+        )
+
+    rows = query.order_by(Conversation.last_message_at.desc(), Conversation.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Nomes/avatares da página numa única consulta
+    user_ids = {row.last_sender_id for row in rows} | {row.peer_id for row in rows if row.peer_id}
+    users = {}
+    if user_ids:
+        users = {
+            u.id: u for u in session.query(User.id, User.name, User.profile_picture).filter(User.id.in_(user_ids))
+        }
+
+    result = []
+    for row in rows:
+        sender = users.get(row.last_sender_id)
+        receiver_id = None if row.challenge_id else (row.peer_id if row.last_sender_id == user_id else user_id)
+        receiver = users.get(receiver_id) if receiver_id != user_id else None
+        item = row.to_dict()
+        # Campos da mensagem mantidos para compatibilidade com a resposta antiga
+        item.update({
+            'id': row.last_message_id,
+            'sender_id': row.last_sender_id,
+            'sender_name': sender.name if sender else None,
+            'sender_avatar': sender.profile_picture if sender else None,
+            'receiver_id': receiver_id,
+            'receiver_name': receiver.name if receiver else None,
+            'peer_name': users[row.peer_id].name if row.peer_id in users else None,
+            'content': row.last_preview,
+            'message_type': row.last_message_type,
+            'is_read': not row.unread_count,
+            'created_at': item['last_message_at']
+        })
+        result.append(item)
+
+    next_cursor = None
+    if has_more and rows:
+        next_cursor = f"{rows[-1].last_message_at.isoformat()}|{rows[-1].id}"
+    return result, next_cursor
+
+
+def rebuild_conversations(session):
+    """
+    Reconstrói todos os resumos a partir da tabela messages (backfill, sem commit)
+
+    Mensagens de desafio não têm estado de leitura por membro, então o
+    backfill começa essas conversas com zero não lidas.
+    """
+    session.query(Conversation).delete(synchronize_session=False)
+
+    summaries = {}  # (user_id, key) -> Conversation
+    members = {}  # chave do desafio -> usuários com a conversa na caixa de entrada
+    for message in session.query(Message).order_by(Message.created_at, Message.id).yield_per(1000):
+        if message.challenge_id:
+            key = conversation_key(challenge_id=message.challenge_id)
+            owners = members.setdefault(key, set())
+            owners.add(message.sender_id)
+            targets = [(owner, None, 0) for owner in owners]
+        elif message.receiver_id:
+            targets = [(message.sender_id, message.receiver_id, 0)]
+            if message.receiver_id != message.sender_id:
+                targets.append((message.receiver_id, message.sender_id, 0 if message.is_read else 1))
+        else:
+            continue
+
+        values = _last_message_values(message)
+        for owner, peer_id, unread in targets:
+            key = conversation_key(peer_id, message.challenge_id)
+            row = summaries.get((owner, key))
+            if row is None:
+                row = summaries[(owner, key)] = Conversation(
+                    user_id=owner, conversation_key=key, peer_id=peer_id,
+                    challenge_id=message.challenge_id, unread_count=0
+                )
+            for field, value in values.items():
+                setattr(row, field, value)
+            row.unread_count += unread
+
+    session.add_all(summaries.values())
+    return len(summaries)
@@ -4,8 +4,18 @@
 from flask import request, jsonify
 from flask_socketio import emit, join_room, leave_room
 from sqlalchemy import or_, and_
+from sqlalchemy.orm import joinedload
+import uuid
 from datetime import datetime
 from models import SessionLocal, User, Message, Challenge
+from chat_conversations import record_message, mark_conversation_read, list_conversations, DEFAULT_PAGE_SIZE
+from chat_write_buffer import stored_copy, QUEUED, RESENT, CONFLICT
+from serializers import message_serializer, requested_fields
+from auth_context import request_user, socket_user
+from room_history import room_for, can_access
+
+# Histórico recente das salas (room_history), definido em register_chat_routes
+_history = None
 
 # ==================== REST ENDPOINTS ====================
 
@@ -26,26 +36,35 @@ def send_message():
             return jsonify({'success': False, 'message': 'Especifique receiver_id ou challenge_id'}), 400
 
         session = SessionLocal()
+        try:
+            # Buscar sender
+            sender, error = request_user(session, sender_email)
+            if error:
+                return error
+            if not sender:
+                return jsonify({'success': False, 'message': 'Usuário não encontrado'}), 404
+
+            # Criar mensagem
+            message = Message(
+                sender_id=sender.id,
+                receiver_id=receiver_id,
+                challenge_id=challenge_id,
+                content=content,
+                message_type=message_type
+            )
 
-        # Buscar sender
-        sender = session.query(User).filter_by(email=sender_email).first()
-        if not sender:
-            return jsonify({'success': False, 'message': 'Usuário não encontrado'}), 404
-
-        # Criar mensagem
-        message = Message(
-            sender_id=sender.id,
-            receiver_id=receiver_id,
-            challenge_id=challenge_id,
-            content=content,
-            message_type=message_type
-        )
+            session.add(message)
+            record_message(session, message)  # Resumo da caixa de entrada na mesma transação
+            session.commit()
 
-        session.add(message)
-        session.commit()
+            message_dict = message.to_dict()
+        finally:
+            session.close()
 
-        message_dict = message.to_dict()
-        session.close()
+        # Mesmo histórico do envio pelo WebSocket: quem entrar na sala já recebe esta mensagem
+        room = room_for(message_dict['sender_id'], receiver_id, challenge_id)
+        if _history is not None and room:
+            _history.append(room, message_dict)
 
         return jsonify({
             'success': True,
@@ -65,54 +84,85 @@ def get_conversations():
         if not user_email:
             return jsonify({'success': False, 'message': 'user_email é obrigatório'}), 400
 
-        session = SessionLocal()
-
-        # Buscar usuário
-        user = session.query(User).filter_by(email=user_email).first()
-        if not user:
-            return jsonify({'success': False, 'message': 'Usuário não encontrado'}), 404
-
-        # Buscar últimas mensagens de cada conversa
-        conversations = session.query(Message).filter(
-            or_(
-                Message.sender_id == user.id,
-                Message.receiver_id == user.id
-            )
-        ).order_by(Message.created_at.desc()).all()
-
-        # Agrupar por usuário ou desafio
-        grouped = {}
-        for msg in conversations:
-            if msg.challenge_id:
-                key = f"challenge_{msg.challenge_id}"
-            else:
-                other_id = msg.receiver_id if msg.sender_id == user.id else msg.sender_id
-                key = f"user_{other_id}"
-
-            if key not in grouped:
-                grouped[key] = msg.to_dict()
+        try:
+            limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        except ValueError:
+            return jsonify({'success': False, 'message': 'limit deve ser um número inteiro'}), 400
 
-        result = list(grouped.values())
-        session.close()
+        session = SessionLocal()
+        try:
+            # Buscar usuário
+            user, error = request_user(session, user_email)
+            if error:
+                return error
+            if not user:
+                return jsonify({'success': False, 'message': 'Usuário não encontrado'}), 404
+
+            # Uma leitura indexada na tabela de resumos (paginada por cursor)
+            try:
+                result, next_cursor = list_conversations(session, user.id, limit=limit, cursor=request.args.get('cursor'))
+            except ValueError:
+                return jsonify({'success': False, 'message': 'cursor inválido'}), 400
+        finally:
+            session.close()
 
         return jsonify({
             'success': True,
             'conversations': result,
-            'count': len(result)
+            'count': len(result),
+            'next_cursor': next_cursor
         }), 200
 
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+MAX_MESSAGES_PAGE = 200
+
+
+def _apply_cursor(session, query, before_id, after_id):
+    """
+    Paginação por keyset em (created_at, id): custo igual em qualquer página
+
+    before_id: mensagens anteriores a essa (rolar para trás)
+    after_id: mensagens posteriores a essa (buscar novas)
+    Retorna (query ordenada, ordem crescente?) ou (None, None) se o cursor não existe
+    """
+    cursor_id = before_id or after_id
+    if not cursor_id:
+        return query.order_by(Message.created_at.desc(), Message.id.desc()), False
+
+    cursor = session.query(Message.created_at, Message.id).filter(Message.id == cursor_id).first()
+    if not cursor:
+        return None, None
+
+    if before_id:
+        query = query.filter(or_(
+            Message.created_at < cursor.created_at,
+            and_(Message.created_at == cursor.created_at, Message.id < cursor.id)
+        ))
+        return query.order_by(Message.created_at.desc(), Message.id.desc()), False
+
+    query = query.filter(or_(
+        Message.created_at > cursor.created_at,
+        and_(Message.created_at == cursor.created_at, Message.id > cursor.id)
+    ))
+    return query.order_by(Message.created_at.asc(), Message.id.asc()), True
+
+
 def get_messages():
-    """GET /api/chat/messages - Buscar mensagens de uma conversa"""
+    """GET /api/chat/messages?before=<id>|after=<id> - Buscar mensagens de uma conversa"""
     try:
         user_email = request.args.get('user_email')
         other_user_id = request.args.get('other_user_id')
         challenge_id = request.args.get('challenge_id')
-        limit = int(request.args.get('limit', 50))
-        offset = int(request.args.get('offset', 0))
+        try:
+            limit = max(1, min(int(request.args.get('limit', 50)), MAX_MESSAGES_PAGE))
+            offset = int(request.args.get('offset', 0))  # Legado: preferir before/after
+        except ValueError:
+            return jsonify({'success': False, 'message': 'limit e offset devem ser números inteiros'}), 400
+        before_id = request.args.get('before')
+        after_id = request.args.get('after')
 
         if not user_email:
             return jsonify({'success': False, 'message': 'user_email é obrigatório'}), 400
@@ -121,37 +171,56 @@ def get_messages():
             return jsonify({'success': False, 'message': 'Especifique other_user_id ou challenge_id'}), 400
 
         session = SessionLocal()
-
-        # Buscar usuário
-        user = session.query(User).filter_by(email=user_email).first()
-        if not user:
-            return jsonify({'success': False, 'message': 'Usuário não encontrado'}), 404
-
-        # Buscar mensagens
-        query = session.query(Message)
-
-        if challenge_id:
-            # Chat do desafio
-            query = query.filter(Message.challenge_id == challenge_id)
-        else:
-            # Chat 1-on-1
-            query = query.filter(
-                or_(
-                    and_(Message.sender_id == user.id, Message.receiver_id == other_user_id),
-                    and_(Message.sender_id == other_user_id, Message.receiver_id == user.id)
+        try:
+            # Buscar usuário
+            user, error = request_user(session, user_email)
+            if error:
+                return error
+            if not user:
+                return jsonify({'success': False, 'message': 'Usuário não encontrado'}), 404
+
+            # Buscar mensagens (remetente/destinatário no mesmo SELECT, sem lazy load por mensagem)
+            query = session.query(Message).options(joinedload(Message.sender), joinedload(Message.receiver))
+
+            if challenge_id:
+                # Chat do desafio
+                query = query.filter(Message.challenge_id == challenge_id)
+            else:
+                # Chat 1-on-1
+                query = query.filter(
+                    or_(
+                        and_(Message.sender_id == user.id, Message.receiver_id == other_user_id),
+                        and_(Message.sender_id == other_user_id, Message.receiver_id == user.id)
+                    )
                 )
-            )
 
-        messages = query.order_by(Message.created_at.desc()).limit(limit).offset(offset).all()
-        messages.reverse()  # Ordem cronológica
+            query, ascending = _apply_cursor(session, query, before_id, after_id)
+            if query is None:
+                return jsonify({'success': False, 'message': 'Mensagem do cursor não encontrada'}), 404
+
+            if offset and not (before_id or after_id):
+                query = query.offset(offset)
 
-        result = [msg.to_dict() for msg in messages]
-        session.close()
+            messages = query.limit(limit + 1).all()
+            has_more = len(messages) > limit
+            messages = messages[:limit]
+            if not ascending:
+                messages.reverse()  # Ordem cronológica
+
+            # ?fields= limita os campos de cada mensagem ('id' sempre vai, pelos cursores)
+            fields = requested_fields()
+            result = message_serializer.dump_many(messages, fields | {'id'} if fields else None)
+        finally:
+            session.close()
 
         return jsonify({
             'success': True,
             'messages': result,
-            'count': len(result)
+            'count': len(result),
+            'has_more': has_more,
+            # Cursores para a próxima página (mais antigas / mais novas)
+            'before': result[0]['id'] if result else before_id,
+            'after': result[-1]['id'] if result else after_id
         }), 200
 
     except Exception as e:
@@ -170,26 +239,30 @@ def mark_as_read():
             return jsonify({'success': False, 'message': 'user_email é obrigatório'}), 400
 
         session = SessionLocal()
+        try:
+            # Buscar usuário
+            user, error = request_user(session, user_email)
+            if error:
+                return error
+            if not user:
+                return jsonify({'success': False, 'message': 'Usuário não encontrado'}), 404
+
+            # Marcar mensagens como lidas
+            query = session.query(Message).filter(
+                Message.receiver_id == user.id,
+                Message.is_read == False
+            )
 
-        # Buscar usuário
-        user = session.query(User).filter_by(email=user_email).first()
-        if not user:
-            return jsonify({'success': False, 'message': 'Usuário não encontrado'}), 404
-
-        # Marcar mensagens como lidas
-        query = session.query(Message).filter(
-            Message.receiver_id == user.id,
-            Message.is_read == False
-        )
-
-        if challenge_id:
-            query = query.filter(Message.challenge_id == challenge_id)
-        elif other_user_id:
-            query = query.filter(Message.sender_id == other_user_id)
+            if challenge_id:
+                query = query.filter(Message.challenge_id == challenge_id)
+            elif other_user_id:
+                query = query.filter(Message.sender_id == other_user_id)
 
-        count = query.update({'is_read': True, 'updated_at': datetime.utcnow()})
-        session.commit()
-        session.close()
+            count = query.update({'is_read': True, 'updated_at': datetime.utcnow()})
+            mark_conversation_read(session, user.id, peer_id=other_user_id, challenge_id=challenge_id)
+            session.commit()
+        finally:
+            session.close()
 
         return jsonify({
             'success': True,
@@ -202,12 +275,42 @@ def mark_as_read():
 
 # ==================== WEBSOCKET EVENTS ====================
 
-def setup_socketio_events(socketio):
-    """Configurar eventos do WebSocket"""
+def setup_socketio_events(socketio, write_buffer=None, presence=None, typing=None, history=None):
+    """
+    Configurar eventos do WebSocket
+
+    Com write_buffer (chat_write_buffer), send_message faz broadcast na hora e
+    a gravação acontece em lote; sem ele a mensagem é gravada antes do broadcast.
+    Com presence (presence_service), join/leave/disconnect mantêm a contagem
+    online das salas e qualquer evento do cliente conta como heartbeat.
+    Com typing (typing_service), 'typing' é agregado por sala e enviado em
+    intervalos em vez de repassado a cada tecla.
+    Com history (room_history), o 'join' é confirmado com as mensagens
+    recentes da sala ('joined' e retorno do ack), sem o cliente ir ao banco.
+
+    O usuário da conexão vem do token do handshake (auth_context.socket_user):
+    ele é o remetente das mensagens e só entra nas conversas privadas de que
+    participa. No modo legado (sem token) vale o user_id/sender_id do cliente.
+    """
+    socket_users = {}  # sid -> AuthUser (None no modo legado)
+
+    def caller_id(claimed_id):
+        """(id do usuário da conexão, erro): o id enviado pelo cliente só vale sem token"""
+        user = socket_users.get(request.sid)
+        if user is None:
+            return claimed_id, None
+        if claimed_id and claimed_id != user.id:
+            return None, 'Token não pertence a este usuário'
+        return user.id, None
 
     @socketio.on('connect')
-    def handle_connect():
-        """Cliente conectado"""
+    def handle_connect(auth=None):
+        """Cliente conectado (recusado com token inválido, ou sem token quando obrigatório)"""
+        user, accepted = socket_user(auth)
+        if not accepted:
+            print(f'[CHAT] Conexão recusada (token inválido ou ausente): {request.sid}')
+            return False
+        socket_users[request.sid] = user
         print(f'[CHAT] Cliente conectado: {request.sid}')
         emit('connected', {'message': 'Conectado ao chat'})
 
@@ -216,6 +319,16 @@ def setup_socketio_events(socketio):
     def handle_disconnect():
         """Cliente desconectado"""
         print(f'[CHAT] Cliente desconectado: {request.sid}')
+        socket_users.pop(request.sid, None)
+        if typing is not None:
+            typing.clear(request.sid)
+        if presence is None:
+            return
+        for room, session in presence.disconnect(request.sid):
+            emit('user_left', {
+                'message': f"{session.get('username') or 'Anônimo'} saiu do chat",
+                'room': room
+            }, room=room)
 
 
     @socketio.on('join')
@@ -228,12 +341,24 @@ def setup_socketio_events(socketio):
             emit('error', {'message': 'room é obrigatório'})
             return
 
+        user_id, error = caller_id(data.get('user_id'))
+        if error or not can_access(room, user_id):
+            emit('error', {'message': error or 'Sem acesso a esta sala', 'room': room})
+            return
+
         join_room(room)
+        joined = None
+        if history is not None:
+            joined = {'room': room, 'messages': history.recent(room)}
+            emit('joined', joined)
+        if presence is not None and not presence.join(request.sid, room, user_id, username):
+            return joined  # Reentrada da mesma conexão: não repete o aviso
         print(f'[CHAT] {username} entrou na sala {room}')
         emit('user_joined', {
             'message': f'{username} entrou no chat',
             'room': room
         }, room=room)
+        return joined
 
 
     @socketio.on('leave')
@@ -247,6 +372,10 @@ def setup_socketio_events(socketio):
             return
 
         leave_room(room)
+        if typing is not None:
+            typing.clear(request.sid, room)
+        if presence is not None:
+            presence.leave(request.sid, room)
         print(f'[CHAT] {username} saiu da sala {room}')
         emit('user_left', {
             'message': f'{username} saiu do chat',
@@ -258,61 +387,113 @@ def setup_socketio_events(socketio):
     def handle_send_message(data):
         """Enviar mensagem em tempo real"""
         room = data.get('room')
-        sender_id = data.get('sender_id')
+        sender_id, error = caller_id(data.get('sender_id'))
         sender_name = data.get('sender_name')
         sender_avatar = data.get('sender_avatar')
         content = data.get('content')
         message_type = data.get('message_type', 'text')
 
+        if error:
+            emit('error', {'message': error})
+            return
+
         if not room or not sender_id or not content:
             emit('error', {'message': 'room, sender_id e content são obrigatórios'})
             return
 
-        # Salvar no banco
+        if not can_access(room, sender_id):
+            emit('error', {'message': 'Sem acesso a esta sala', 'room': room})
+            return
+
+        user = socket_users.get(request.sid)
+        if user is not None:
+            sender_name = user.name  # Nome do token, não o enviado pelo cliente
+
+        if presence is not None:
+            presence.touch(request.sid)
+        if typing is not None:
+            typing.clear(request.sid, room)
+
+        # Id gerado pelo cliente (UUID): confirma a gravação (message_ack) e torna o reenvio idempotente
         try:
-            session = SessionLocal()
+            message_id = str(uuid.UUID(str(data['client_id']))) if data.get('client_id') else str(uuid.uuid4())
+        except ValueError:
+            emit('error', {'message': 'client_id inválido (esperado UUID)'})
+            return
 
-            # Determinar se é chat 1-on-1 ou desafio
-            receiver_id = None
-            challenge_id = None
+        # Determinar se é chat 1-on-1 ou desafio
+        receiver_id = None
+        challenge_id = None
+
+        if room.startswith('challenge_'):
+            challenge_id = room.replace('challenge_', '')
+        elif room.startswith('user_'):
+            # Room format: user_{user1_id}_{user2_id}
+            parts = room.split('_')
+            if len(parts) == 3:
+                receiver_id = parts[2] if parts[1] == sender_id else parts[1]
+
+        fields = {
+            'id': message_id,
+            'sender_id': sender_id,
+            'receiver_id': receiver_id,
+            'challenge_id': challenge_id,
+            'content': content,
+            'message_type': message_type,
+            'created_at': datetime.utcnow()
+        }
+        new_message = {
+            'id': message_id,
+            'client_id': message_id,
+            'sender_id': sender_id,
+            'sender_name': sender_name,
+            'sender_avatar': sender_avatar,
+            'content': content,
+            'message_type': message_type,
+            'created_at': fields['created_at'].isoformat(),
+            'room': room
+        }
 
-            if room.startswith('challenge_'):
-                challenge_id = room.replace('challenge_', '')
-            elif room.startswith('user_'):
-                # Room format: user_{user1_id}_{user2_id}
-                parts = room.split('_')
-                if len(parts) == 3:
-                    receiver_id = parts[2] if parts[1] == sender_id else parts[1]
+        history_entry = dict(new_message, receiver_id=receiver_id, challenge_id=challenge_id, is_read=False)
 
-            message = Message(
-                sender_id=sender_id,
-                receiver_id=receiver_id,
-                challenge_id=challenge_id,
-                content=content,
-                message_type=message_type
-            )
+        # Write-behind: broadcast imediato, gravação em lote pelo worker
+        queued = write_buffer.enqueue(fields, sid=request.sid, room=room) if write_buffer is not None else None
+        if queued == QUEUED:
+            emit('new_message', new_message, room=room)
+            if history is not None:
+                history.append(room, history_entry)
+            return
+        if queued == RESENT:
+            return  # Reenvio: já está na sala e no histórico; o buffer confirma (message_ack)
+        if queued == CONFLICT:
+            emit('error', {'message': 'client_id já pertence a outra mensagem'})
+            return
+
+        # Sem buffer (ou fila cheia): salvar no banco antes do broadcast
+        try:
+            session = SessionLocal()
 
+            message = Message(**fields)
             session.add(message)
+            record_message(session, message)
             session.commit()
-
-            message_dict = message.to_dict()
             session.close()
 
             # Emitir para todos na sala
-            emit('new_message', {
-                'id': message_dict['id'],
-                'sender_id': sender_id,
-                'sender_name': sender_name,
-                'sender_avatar': sender_avatar,
-                'content': content,
-                'message_type': message_type,
-                'created_at': message_dict['created_at'],
-                'room': room
-            }, room=room)
+            emit('new_message', new_message, room=room)
+            emit('message_ack', {'client_ids': [message_id], 'room': room})
+            if history is not None:
+                history.append(room, history_entry)
 
             print(f'[CHAT] Mensagem enviada na sala {room} por {sender_name}')
 
         except Exception as e:
+            session.rollback()
+            session.close()
+            # Reenvio de uma mensagem já gravada: só confirma (sem novo broadcast)
+            if stored_copy(fields) is True:
+                emit('message_ack', {'client_ids': [message_id], 'room': room})
+                return
             print(f'[CHAT] Erro ao salvar mensagem: {str(e)}')
             emit('error', {'message': f'Erro ao enviar mensagem: {str(e)}'})
 
@@ -328,6 +509,13 @@ def setup_socketio_events(socketio):
             emit('error', {'message': 'room é obrigatório'})
             return
 
+        if presence is not None:
+            presence.touch(request.sid)
+
+        if typing is not None:
+            typing.update(request.sid, room, username, bool(is_typing))
+            return
+
         # Emitir para todos na sala exceto o sender
         emit('user_typing', {
             'username': username,
@@ -336,13 +524,22 @@ def setup_socketio_events(socketio):
         }, room=room, include_self=False)
 
 
+    @socketio.on('presence_heartbeat')
+    def handle_presence_heartbeat(data=None):
+        """Mantém a conexão como online (o cliente envia a cada ~30s)"""
+        if presence is not None:
+            presence.touch(request.sid)
+
+
     print('[CHAT] WebSocket events configurados')
 
 
 # ==================== FUNÇÕES DE REGISTRO ====================
 
-def register_chat_routes(app):
-    """Registrar rotas REST do chat"""
+def register_chat_routes(app, history=None):
+    """Registrar rotas REST do chat (history: RoomHistory mantido também pelo envio REST)"""
+    global _history
+    _history = history
     app.add_url_rule('/api/chat/send', 'send_message', send_message, methods=['POST'])
     app.add_url_rule('/api/chat/conversations', 'get_conversations', get_conversations, methods=['GET'])
     app.add_url_rule('/api/chat/messages', 'get_messages', get_messages, methods=['GET'])
@@ -0,0 +1,272 @@
+# ==================== WRITE-BEHIND DAS MENSAGENS DO CHAT ====================
+# O handler do Socket.IO faz broadcast na hora (com o id gerado pelo cliente)
+# e só enfileira a mensagem; um worker grava em lotes pequenos a cada
+# CHAT_FLUSH_MS ou CHAT_BATCH_SIZE mensagens. Depois do commit o remetente
+# recebe 'message_ack'; falhas são retentadas com backoff e, esgotadas as
+# tentativas, viram 'message_failed' para o cliente reenviar. A fila é
+# limitada (CHAT_MAX_PENDING) e é esvaziada no encerramento do processo.
+# Mensagens descartadas também saem do histórico recente da sala (room_history).
+# Um id que já existe só é confirmado se a linha gravada for a mesma mensagem
+# (mesmo remetente e conteúdo); um id de outra mensagem é recusado na hora.
+# Os ids pendentes e os gravados há pouco (CHAT_RECENT_IDS) ficam em memória:
+# o reenvio de uma mensagem conhecida só é confirmado, sem novo broadcast nem
+# nova entrada no histórico da sala.
+
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict, deque
+import metrics
+from models import SessionLocal, Message
+from chat_conversations import record_message
+
+logger = logging.getLogger(__name__)
+
+FLUSH_MS = int(os.getenv('CHAT_FLUSH_MS', '20'))
+BATCH_SIZE = int(os.getenv('CHAT_BATCH_SIZE', '100'))
+MAX_PENDING = int(os.getenv('CHAT_MAX_PENDING', '5000'))
+MAX_RETRIES = int(os.getenv('CHAT_WRITE_MAX_RETRIES', '5'))
+RETRY_BASE_SECONDS = 0.2
+RECENT_IDS = int(os.getenv('CHAT_RECENT_IDS', '10000'))
+
+# Resultado de enqueue()
+QUEUED = 'queued'      # Mensagem nova: fazer o broadcast
+RESENT = 'resent'      # Reenvio de mensagem pendente/gravada: nada a repetir (o ack vem do buffer)
+CONFLICT = 'conflict'  # Id já usado por outra mensagem
+FULL = 'full'          # Fila cheia: gravar de forma síncrona
+
+MESSAGE_FIELDS = ('id', 'sender_id', 'receiver_id', 'challenge_id', 'content', 'message_type', 'created_at')
+
+
+def stored_copy(fields):
+    """
+    Compara com a mensagem já gravada com o mesmo id
+
+    Returns:
+        None se o id não existe, True se é a mesma mensagem (reenvio),
+        False se o id pertence a outra mensagem
+    """
+    session = SessionLocal()
+    try:
+        row = session.query(Message.sender_id, Message.content).filter(Message.id == fields['id']).first()
+        if row is None:
+            return None
+        return row.sender_id == fields.get('sender_id') and row.content == fields.get('content')
+    finally:
+        session.close()
+
+
+class PendingMessage:
+    __slots__ = ('fields', 'sid', 'room', 'attempts', 'not_before')
+
+    def __init__(self, fields, sid, room):
+        self.fields = fields
+        self.sid = sid
+        self.room = room
+        self.attempts = 0
+        self.not_before = 0.0
+
+
+class ChatWriteBuffer:
+    def __init__(self, socketio=None, history=None):
+        self.socketio = socketio
+        self.history = history
+        self._queue = deque()
+        self._pending_ids = {}  # id -> PendingMessage ainda não gravada
+        self._stored_ids = OrderedDict()  # id -> (remetente, conteúdo) gravados há pouco (LRU)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    # ==================== API DO HANDLER ====================
+
+    def enqueue(self, fields, sid=None, room=None):
+        """
+        Enfileira uma mensagem para gravação (campos de Message, com id e created_at)
+
+        Returns:
+            QUEUED (nova), RESENT (reenvio de uma mensagem pendente ou gravada
+            há pouco: confirmada sem novo broadcast), CONFLICT (id de outra
+            mensagem) ou FULL (fila cheia: o chamador deve gravar de forma síncrona)
+        """
+        message_id = fields['id']
+        signature = (fields.get('sender_id'), fields.get('content'))
+        with self._lock:
+            pending = self._pending_ids.get(message_id)
+            stored = self._stored_ids.get(message_id)
+            if pending is not None or stored is not None:
+                known = (pending.fields.get('sender_id'), pending.fields.get('content')) if pending else stored
+                if known != signature:
+                    metrics.increment('chat_client_id_conflicts')
+                    return CONFLICT
+                metrics.increment('chat_messages_resent')
+                if pending is not None:
+                    pending.sid = sid or pending.sid  # O ack vai para a conexão do reenvio
+                    return RESENT
+            elif len(self._queue) >= MAX_PENDING:
+                metrics.increment('chat_buffer_rejected')
+                return FULL
+            else:
+                item = PendingMessage(fields, sid, room)
+                self._queue.append(item)
+                self._pending_ids[message_id] = item
+                size = len(self._queue)
+
+        if stored is not None:
+            self._emit('message_ack', sid, {'client_ids': [message_id], 'room': room})
+            return RESENT
+        metrics.set_gauge('chat_buffer_pending', size)
+        if size >= BATCH_SIZE:
+            self._wakeup.set()
+        return QUEUED
+
+    def pending(self):
+        return len(self._queue)
+
+    # ==================== GRAVAÇÃO EM LOTE ====================
+
+    def _take_batch(self, ignore_backoff=False):
+        now = time.monotonic()
+        batch, deferred = [], []
+        with self._lock:
+            while self._queue and len(batch) < BATCH_SIZE:
+                item = self._queue.popleft()
+                if not ignore_backoff and item.not_before > now:
+                    deferred.append(item)
+                else:
+                    batch.append(item)
+            self._queue.extendleft(reversed(deferred))
+        return batch
+
+    def flush(self, ignore_backoff=False):
+        """Grava um lote; retorna quantas mensagens foram confirmadas"""
+        batch = self._take_batch(ignore_backoff)
+        if not batch:
+            return 0
+        with metrics.timed('chat_batch_latency'):
+            persisted = self._persist(batch)
+        metrics.set_gauge('chat_buffer_pending', len(self._queue))
+        return persisted
+
+    def _insert(self, batch):
+        session = SessionLocal()
+        try:
+            for item in batch:
+                message = Message(**{k: item.fields.get(k) for k in MESSAGE_FIELDS})
+                session.add(message)
+                record_message(session, message)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+    def _persist(self, batch):
+        try:
+            self._insert(batch)
+            self._ack(batch)
+            metrics.increment('chat_messages_persisted', len(batch))
+            return len(batch)
+        except Exception as e:
+            if len(batch) > 1:
+                # Isola a mensagem problemática gravando uma a uma
+                logger.warning(f"[CHAT] Lote de {len(batch)} falhou ({e}); gravando individualmente")
+                return sum(self._persist([item]) for item in batch)
+
+        item = batch[0]
+        try:
+            saved = stored_copy(item.fields)
+        except Exception:
+            saved = None
+        if saved is True:
+            # Reenvio do cliente com o mesmo id: já está gravada
+            self._ack(batch)
+            return 1
+        if saved is False:
+            # Id já usado por outra mensagem (replay ou id alheio): nunca será gravada
+            logger.warning(f"[CHAT] client_id {item.fields['id']} já pertence a outra mensagem")
+            metrics.increment('chat_client_id_conflicts')
+            self._fail(item)
+            return 0
+
+        item.attempts += 1
+        metrics.increment('chat_write_retries')
+        if item.attempts > MAX_RETRIES:
+            logger.error(f"[CHAT] Mensagem {item.fields['id']} descartada após {MAX_RETRIES} tentativas")
+            self._fail(item)
+            return 0
+
+        item.not_before = time.monotonic() + RETRY_BASE_SECONDS * (2 ** (item.attempts - 1))
+        with self._lock:
+            self._queue.append(item)  # Retentativa não respeita MAX_PENDING: nada se perde
+        return 0
+
+    def _fail(self, item):
+        metrics.increment('chat_messages_failed')
+        with self._lock:
+            self._pending_ids.pop(item.fields['id'], None)
+        if self.history is not None and item.room:
+            self.history.discard(item.room, item.fields['id'])
+        self._emit('message_failed', item.sid, {'client_ids': [item.fields['id']], 'room': item.room})
+
+    def _ack(self, batch):
+        with self._lock:
+            for item in batch:
+                message_id = item.fields['id']
+                self._pending_ids.pop(message_id, None)
+                self._stored_ids[message_id] = (item.fields.get('sender_id'), item.fields.get('content'))
+                self._stored_ids.move_to_end(message_id)
+            while len(self._stored_ids) > RECENT_IDS:
+                self._stored_ids.popitem(last=False)
+
+        by_sid = {}
+        for item in batch:
+            if item.sid:
+                by_sid.setdefault((item.sid, item.room), []).append(item.fields['id'])
+        for (sid, room), ids in by_sid.items():
+            self._emit('message_ack', sid, {'client_ids': ids, 'room': room})
+
+    def _emit(self, event, sid, payload):
+        if self.socketio and sid:
+            try:
+                self.socketio.emit(event, payload, to=sid)
+            except Exception as e:
+                logger.warning(f"[CHAT] Erro ao emitir {event}: {e}")
+
+    # ==================== WORKER E ENCERRAMENTO ====================
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(FLUSH_MS / 1000.0)
+            self._wakeup.clear()
+            try:
+                while self.flush():
+                    pass
+            except Exception as e:
+                logger.error(f"[CHAT] Erro no worker de gravação: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def drain(self, timeout=10.0):
+        """Grava tudo o que estiver pendente (encerramento do processo)"""
+        deadline = time.monotonic() + timeout
+        while self._queue and time.monotonic() < deadline:
+            self.flush(ignore_backoff=True)
+        if self._queue:
+            logger.error(f"[CHAT] {len(self._queue)} mensagem(ns) não gravada(s) no encerramento")
+
+
+def init_chat_write_buffer(socketio, start_worker=True, history=None):
+    """Cria o buffer de gravação do chat, inicia o worker e registra o flush no encerramento"""
+    buffer = ChatWriteBuffer(socketio, history)
+    if start_worker:
+        buffer.start()
+    atexit.register(buffer.drain)
+    return buffer
@@ -0,0 +1,241 @@
+# ==================== FILA DE NOTIFICAÇÕES DO FITBIT ====================
+# O webhook só enfileira e responde 204. As notificações são agrupadas por
+# (ownerId, data) durante uma janela de debounce: rajadas para o mesmo dia
+# viram uma única busca na API. Cada usuário do lote é gravado na própria
+# transação (dedupe com uma consulta IN em activity_id e desafios avaliados
+# uma vez): se a API ou a gravação falhar, só os grupos daquele usuário voltam
+# para a fila, com backoff exponencial — o Fitbit não reenvia após o 204.
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime
+import metrics
+from models import SessionLocal, FitbitUser, FitbitActivity
+from fitness_rollup import record_fitbit_activities, record_fitbit_correction, fitbit_activity_metrics
+from challenge_progress import track_fitbit_activities, dispatch_progress_events
+
+logger = logging.getLogger(__name__)
+
+DEBOUNCE_SECONDS = float(os.getenv('FITBIT_DEBOUNCE_SECONDS', '5'))
+MAX_WAIT_SECONDS = float(os.getenv('FITBIT_DEBOUNCE_MAX_WAIT_SECONDS', '30'))
+POLL_SECONDS = 0.5
+RETRY_BASE_SECONDS = float(os.getenv('FITBIT_RETRY_BASE_SECONDS', '30'))
+RETRY_MAX_SECONDS = float(os.getenv('FITBIT_RETRY_MAX_SECONDS', '1800'))
+MAX_RETRIES = int(os.getenv('FITBIT_MAX_RETRIES', '8'))
+
+ACTIVITIES_URL = 'https://api.fitbit.com/1/user/-/activities/date/{date}.json'
+
+
+class FitbitFetchError(Exception):
+    pass
+
+
+class FitbitNotificationQueue:
+    def __init__(self, token_manager):
+        self.token_manager = token_manager
+        self._pending = {}  # (owner_id, data) -> [primeira, última notificação, não antes de]
+        self._attempts = {}  # (owner_id, data) -> falhas seguidas
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def enqueue(self, notifications):
+        """Agrupa notificações de atividades; retorna quantas foram aceitas"""
+        now = time.monotonic()
+        accepted = 0
+        with self._lock:
+            for notification in notifications:
+                if notification.get('collectionType') != 'activities':
+                    continue
+                key = (notification['ownerId'], notification['date'])
+                window = self._pending.get(key)
+                if window:
+                    window[1] = now
+                    metrics.increment('fitbit_notifications_coalesced')
+                else:
+                    self._pending[key] = [now, now, 0.0]
+                accepted += 1
+            metrics.set_gauge('fitbit_pending_groups', len(self._pending))
+        metrics.increment('fitbit_notifications_received', len(notifications))
+        return accepted
+
+    def _due(self, force=False):
+        """Remove e retorna os grupos cuja janela de debounce terminou"""
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                key for key, (first, last, not_before) in self._pending.items()
+                if force or (now >= not_before and (now - last >= DEBOUNCE_SECONDS or now - first >= MAX_WAIT_SECONDS))
+            ]
+            for key in due:
+                del self._pending[key]
+            metrics.set_gauge('fitbit_pending_groups', len(self._pending))
+        return due
+
+    def _retry(self, groups, error):
+        """Devolve grupos que falharam para a fila, com backoff (descarta após MAX_RETRIES)"""
+        now = time.monotonic()
+        with self._lock:
+            for key in groups:
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts > MAX_RETRIES:
+                    self._attempts.pop(key, None)
+                    metrics.increment('fitbit_groups_dropped')
+                    logger.error(f"[FITBIT] Desistindo de {key} após {MAX_RETRIES} tentativas: {error}")
+                    continue
+                self._attempts[key] = attempts
+                not_before = now + min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+                window = self._pending.get(key)
+                if window:
+                    window[2] = max(window[2], not_before)  # Chegaram notificações novas enquanto processava
+                else:
+                    self._pending[key] = [now, now, not_before]
+                metrics.increment('fitbit_groups_retried')
+            metrics.set_gauge('fitbit_pending_groups', len(self._pending))
+
+    # ==================== PROCESSAMENTO DO LOTE ====================
+
+    def flush(self, force=False):
+        groups = self._due(force)
+        if groups:
+            with metrics.timed('fitbit_batch_latency'):
+                self.process_batch(groups)
+        return len(groups)
+
+    def process_batch(self, groups):
+        """Busca cada (owner, data) uma vez e grava cada usuário na própria transação"""
+        by_owner = {}
+        for owner, date in groups:
+            by_owner.setdefault(owner, []).append(date)
+
+        session = SessionLocal()
+        try:
+            fitbit_users = {
+                fu.fitbit_user_id: fu
+                for fu in session.query(FitbitUser).filter(FitbitUser.fitbit_user_id.in_(list(by_owner))).all()
+            }
+            for owner, dates in by_owner.items():
+                fitbit_user = fitbit_users.get(owner)
+                if not fitbit_user:
+                    print(f"[WARNING] [FITBIT] Usuário Fitbit não encontrado: {owner}")
+                    continue
+                owner_groups = [(owner, date) for date in dates]
+                try:
+                    progress_events = self._process_owner(session, fitbit_user, dates)
+                except Exception as e:
+                    session.rollback()
+                    metrics.increment('fitbit_batch_errors')
+                    logger.error(f"[FITBIT] Erro ao processar notificações de {owner}: {e}")
+                    self._retry(owner_groups, e)
+                    continue
+                with self._lock:
+                    for key in owner_groups:
+                        self._attempts.pop(key, None)
+                dispatch_progress_events(progress_events)
+        finally:
+            session.close()
+
+    def _process_owner(self, session, fitbit_user, dates):
+        """Um usuário: busca os dias, grava/corrige, avalia desafios e faz commit; retorna os eventos de progresso"""
+        # 1) Uma chamada à API por dia
+        fetched = [(date, self._fetch_day(fitbit_user, date)) for date in dates]
+        metrics.increment('fitbit_api_fetches', len(dates))
+
+        # 2) Dedupe com uma consulta
+        log_ids = {str(a['logId']) for _, activities in fetched for a in activities}
+        existing = {}
+        if log_ids:
+            existing = {
+                row.activity_id: row
+                for row in session.query(FitbitActivity).filter(FitbitActivity.activity_id.in_(log_ids)).all()
+            }
+
+        # 3) Gravar/corrigir atividades
+        new_activities, changed = [], []
+        for date, activities in fetched:
+            for activity in activities:
+                self._upsert(session, fitbit_user, date, activity, existing, new_activities, changed)
+
+        # 4) Rollup e avaliação dos desafios uma vez
+        user_id = fitbit_user.user_id
+        record_fitbit_activities(session, user_id, new_activities)
+        progress_events = track_fitbit_activities(session, user_id, new_activities + changed)
+        session.commit()
+        if new_activities or changed:
+            print(f"[OK] [FITBIT] {len(new_activities)} novas / {len(changed)} corrigidas para {user_id}")
+        return progress_events
+
+    def _fetch_day(self, fitbit_user, date):
+        """Atividades do dia; erro da API levanta FitbitFetchError (o grupo volta para a fila)"""
+        try:
+            response = self.token_manager.authorized_get(fitbit_user, ACTIVITIES_URL.format(date=date))
+        except Exception as e:
+            raise FitbitFetchError(f"Erro ao buscar atividades de {date}: {e}") from e
+        if response.status_code != 200:
+            raise FitbitFetchError(f"Erro ao buscar atividades de {date}: HTTP {response.status_code}")
+        return response.json().get('activities', [])
+
+    @staticmethod
+    def _upsert(session, fitbit_user, date, activity, existing, new_activities, changed):
+        log_id = str(activity['logId'])
+        current = existing.get(log_id)
+
+        if current is None:
+            current = FitbitActivity(
+                id=str(uuid.uuid4()),
+                fitbit_user_id=fitbit_user.id,
+                activity_id=log_id,
+                activity_type=activity.get('activityName'),
+                start_time=datetime.strptime(f"{date} {activity['startTime']}", '%Y-%m-%d %H:%M:%S'),
+                duration=activity.get('duration'),
+                distance=activity.get('distance', 0),
+                calories=activity.get('calories', 0),
+                steps=activity.get('steps', 0),
+                raw_data=json.dumps(activity)
+            )
+            session.add(current)
+            existing[log_id] = current
+            new_activities.append(current)
+            return
+
+        if current in new_activities:
+            return
+
+        # Atividade já salva: o Fitbit reenvia o dia inteiro e pode ter corrigido valores
+        old_metrics = fitbit_activity_metrics(current)
+        current.duration = activity.get('duration')
+        current.distance = activity.get('distance', 0)
+        current.calories = activity.get('calories', 0)
+        current.steps = activity.get('steps', 0)
+
+        if fitbit_activity_metrics(current) != old_metrics:
+            current.raw_data = json.dumps(activity)
+            record_fitbit_correction(session, fitbit_user.user_id, current, old_metrics)
+            if current not in changed:
+                changed.append(current)
+
+    # ==================== WORKER ====================
+
+    def _run(self):
+        while True:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[FITBIT] Erro no worker de notificações: {e}")
+            time.sleep(POLL_SECONDS)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+
+def init_fitbit_webhook_queue(token_manager, start_worker=True):
+    """Cria a fila de notificações e inicia o worker de debounce"""
+    queue = FitbitNotificationQueue(token_manager)
+    if start_worker:
+        queue.start()
+    return queue
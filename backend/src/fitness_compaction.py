@@ -0,0 +1,174 @@
+# ==================== RETENÇÃO E COMPACTAÇÃO DE FITNESS_DATA ====================
+# Amostras brutas mais antigas que o horizonte de retenção viram agregados por
+# hora (fitness_hourly) e são apagadas em lotes curtos (um commit por lote,
+# sem locks longos). O rollup diário (fitness_daily) já foi atualizado na
+# ingestão e não muda. Ficam preservadas as linhas citadas por uma
+# ChallengeValidation, as que têm external_id (dedupe do Strava/webhooks) e as
+# retidas pelo anti-fraude (o agregado não guarda o score; o calendário de
+# atividade conta as amostras compactadas como confiáveis).
+
+import os
+import json
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from antifraud import trusted_filter
+from models import (
+    FitnessData, FitnessHourly, ChallengeValidation, StravaStreamMetrics, RawPayload,
+    delete_payloads
+)
+
+RETENTION_DAYS = int(os.getenv('FITNESS_RETENTION_DAYS', '90'))
+BATCH_SIZE = int(os.getenv('FITNESS_COMPACTION_BATCH', '1000'))
+BATCH_PAUSE_SECONDS = float(os.getenv('FITNESS_COMPACTION_PAUSE_SECONDS', '0.05'))
+ROW_OVERHEAD_BYTES = 160  # Estimativa das colunas fixas + overhead da linha/índices
+
+
+def referenced_fitness_ids(session):
+    """IDs de FitnessData usados como evidência em alguma ChallengeValidation"""
+    referenced = set()
+    for (raw_ids,) in session.query(ChallengeValidation.fitness_data_ids).filter(
+        ChallengeValidation.fitness_data_ids.isnot(None)
+    ).yield_per(1000):
+        try:
+            referenced.update(str(i) for i in json.loads(raw_ids))
+        except (TypeError, ValueError):
+            continue
+    return referenced
+
+
+def _hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _bucket_rows(rows):
+    """Agrupa as amostras por (usuário, hora, tipo, unidade, app)"""
+    buckets = {}
+    for row in rows:
+        key = (row.user_id, _hour(row.start_time), row.data_type, row.unit or '', row.source_app or '')
+        value = float(row.value or 0.0)
+        minutes = 0.0
+        if row.end_time and row.end_time > row.start_time:
+            minutes = (row.end_time - row.start_time).total_seconds() / 60
+        acc = buckets.get(key)
+        if acc is None:
+            buckets[key] = [value, 1, value, value, minutes]
+        else:
+            acc[0] += value
+            acc[1] += 1
+            acc[2] = min(acc[2], value)
+            acc[3] = max(acc[3], value)
+            acc[4] += minutes
+    return buckets
+
+
+def _merge_buckets(session, buckets):
+    user_ids = {key[0] for key in buckets}
+    hours = {key[1] for key in buckets}
+    existing = {
+        (b.user_id, b.hour, b.data_type, b.unit, b.source_app): b
+        for b in session.query(FitnessHourly).filter(
+            FitnessHourly.user_id.in_(user_ids),
+            FitnessHourly.hour.in_(hours)
+        ).all()
+    }
+
+    for key, (total, count, min_value, max_value, minutes) in buckets.items():
+        bucket = existing.get(key)
+        if bucket is None:
+            user_id, hour, data_type, unit, source_app = key
+            session.add(FitnessHourly(
+                user_id=user_id, hour=hour, data_type=data_type, unit=unit, source_app=source_app,
+                total=total, count=count, min_value=min_value, max_value=max_value,
+                duration_minutes=minutes
+            ))
+        else:
+            bucket.total = (bucket.total or 0.0) + total
+            bucket.count = (bucket.count or 0) + count
+            bucket.min_value = min(bucket.min_value, min_value) if bucket.min_value is not None else min_value
+            bucket.max_value = max(bucket.max_value, max_value) if bucket.max_value is not None else max_value
+            bucket.duration_minutes = (bucket.duration_minutes or 0.0) + minutes
+            bucket.compacted_at = datetime.utcnow()
+
+
+def _reclaimed_bytes(session, ids):
+    """Estimativa dos bytes liberados ao apagar as linhas (e seus payloads)"""
+    table = FitnessData.__table__
+    text_bytes = session.query(
+        func.coalesce(func.sum(
+            func.coalesce(func.length(table.c.raw_data), 0)
+            + func.coalesce(func.length(table.c.device_info), 0)
+            + func.coalesce(func.length(table.c.fraud_reasons), 0)
+        ), 0)
+    ).filter(table.c.id.in_(ids)).scalar()
+    payload_bytes = session.query(func.coalesce(func.sum(RawPayload.stored_size), 0)).filter(
+        RawPayload.owner_table == FitnessData.__tablename__,
+        RawPayload.owner_id.in_(ids)
+    ).scalar()
+    return int(text_bytes or 0) + int(payload_bytes or 0) + ROW_OVERHEAD_BYTES * len(ids)
+
+
+def compact_fitness_data(session, retention_days=RETENTION_DAYS, batch_size=BATCH_SIZE,
+                         user_id=None, dry_run=False):
+    """
+    Compacta as amostras anteriores a hoje - retention_days
+
+    Cada lote (ordenado por id, paginação por keyset) é agregado em
+    fitness_hourly e apagado na mesma transação.
+
+    Returns:
+        Dict com rows_compacted, rows_kept_referenced, buckets, batches,
+        bytes_reclaimed e cutoff
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    referenced = referenced_fitness_ids(session)
+    stats = {
+        'cutoff': cutoff.isoformat(), 'rows_compacted': 0, 'rows_kept_referenced': 0,
+        'buckets': 0, 'batches': 0, 'bytes_reclaimed': 0
+    }
+
+    columns = (FitnessData.id, FitnessData.user_id, FitnessData.data_type, FitnessData.value,
+               FitnessData.unit, FitnessData.source_app, FitnessData.start_time, FitnessData.end_time)
+    touched = set()
+    last_id = ''
+    while True:
+        query = session.query(*columns).filter(
+            FitnessData.start_time < cutoff,
+            FitnessData.external_id.is_(None),
+            trusted_filter(),
+            FitnessData.id > last_id
+        )
+        if user_id:
+            query = query.filter(FitnessData.user_id == user_id)
+        rows = query.order_by(FitnessData.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        compactable = [row for row in rows if row.id not in referenced]
+        stats['rows_kept_referenced'] += len(rows) - len(compactable)
+        if not compactable:
+            continue
+
+        ids = [row.id for row in compactable]
+        buckets = _bucket_rows(compactable)
+        stats['bytes_reclaimed'] += _reclaimed_bytes(session, ids)
+        stats['rows_compacted'] += len(ids)
+        touched.update(buckets)
+        stats['buckets'] = len(touched)
+        stats['batches'] += 1
+        if dry_run:
+            continue
+
+        _merge_buckets(session, buckets)
+        session.query(StravaStreamMetrics).filter(
+            StravaStreamMetrics.fitness_data_id.in_(ids)
+        ).delete(synchronize_session=False)
+        delete_payloads(session, FitnessData.__tablename__, ids)
+        session.query(FitnessData).filter(FitnessData.id.in_(ids)).delete(synchronize_session=False)
+        session.commit()
+
+        if BATCH_PAUSE_SECONDS:
+            time.sleep(BATCH_PAUSE_SECONDS)  # Deixa a ingestão respirar entre lotes
+
+    return stats
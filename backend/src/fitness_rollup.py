@@ -0,0 +1,292 @@
+# ==================== ROLLUP DIÁRIO DE FITNESS ====================
+# Agregados (usuário, dia, métrica) mantidos na ingestão de todas as fontes
+# (Strava, Fitbit, HealthKit, mock). Estatísticas, progresso de desafios
+# cumulativos e analytics leem daqui: custo O(dias) em vez de O(amostras).
+# As linhas são criadas com INSERT ... ON CONFLICT DO NOTHING e somadas no
+# próprio UPDATE (col = col + delta): ingestões simultâneas do mesmo usuário e
+# dia não colidem na constraint única nem perdem incrementos.
+
+import uuid
+from datetime import datetime, date
+from sqlalchemy import func, update, case
+from models import FitnessDaily, insert_ignore
+
+# Métricas usadas como meta de desafio (unidades canônicas)
+GOAL_METRICS = ('steps', 'distance', 'calories', 'duration')  # passos, km, kcal, minutos
+
+# Prefixo das linhas por tipo de atividade (breakdown das estatísticas)
+ACTIVITY_PREFIX = 'activity:'
+
+METRIC_ALIASES = {
+    'steps': 'steps', 'step': 'steps', 'passos': 'steps',
+    'distance': 'distance', 'km': 'distance', 'running': 'distance', 'cycling': 'distance', 'walking': 'distance',
+    'swimming': 'distance', 'corrida': 'distance', 'ciclismo': 'distance',
+    'calories': 'calories', 'calorie': 'calories', 'kcal': 'calories', 'energy': 'calories',
+    'duration': 'duration', 'minutes': 'duration', 'min': 'duration', 'workout': 'duration',
+    'fitness': 'duration'
+}
+
+# Fatores para converter distâncias para km
+DISTANCE_UNITS = {'km': 1.0, 'm': 0.001, 'meters': 0.001, 'metros': 0.001, 'mi': 1.609344}
+
+
+def normalize_metric(name):
+    """Converte tipo de dado, unidade ou métrica de desafio para a métrica canônica"""
+    if not name:
+        return None
+    return METRIC_ALIASES.get(str(name).strip().lower())
+
+
+def _to_day(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.utcnow().date()
+
+
+def _sample_metrics(data_type, unit, value, minutes):
+    data_type = (data_type or 'unknown').lower()
+    unit = (unit or '').lower()
+
+    metrics = [(ACTIVITY_PREFIX + data_type, value)]
+
+    if unit in DISTANCE_UNITS:
+        goal = 'distance'
+        metrics.append(('distance', value * DISTANCE_UNITS[unit]))
+    else:
+        goal = normalize_metric(data_type) or normalize_metric(unit)
+        if goal:
+            metrics.append((goal, value))
+
+    # Atividades com distância (corrida, pedal...) também somam a duração do intervalo
+    if goal == 'distance' and minutes > 0:
+        metrics.append(('duration', minutes))
+
+    return metrics
+
+
+def fitness_data_metrics(fitness_data):
+    """Retorna [(métrica, valor)] que um registro FitnessData contribui ao rollup"""
+    minutes = 0.0
+    if fitness_data.start_time and fitness_data.end_time:
+        minutes = (fitness_data.end_time - fitness_data.start_time).total_seconds() / 60
+    return _sample_metrics(fitness_data.data_type, fitness_data.unit, float(fitness_data.value or 0.0), minutes)
+
+
+def fitness_hourly_metrics(bucket):
+    """Retorna [(métrica, valor)] de um agregado FitnessHourly (amostras já compactadas)"""
+    return _sample_metrics(bucket.data_type, bucket.unit, float(bucket.total or 0.0),
+                           float(bucket.duration_minutes or 0.0))
+
+
+def fitbit_activity_metrics(activity):
+    """Retorna [(métrica, valor)] de uma FitbitActivity"""
+    activity_type = (activity.activity_type or 'unknown').lower()
+    metrics = [(ACTIVITY_PREFIX + activity_type, float(activity.distance or 0.0))]
+    if activity.steps:
+        metrics.append(('steps', float(activity.steps)))
+    if activity.distance:
+        metrics.append(('distance', float(activity.distance)))
+    if activity.calories:
+        metrics.append(('calories', float(activity.calories)))
+    if activity.duration:
+        metrics.append(('duration', activity.duration / 60000.0))  # ms -> minutos
+    return metrics
+
+
+def _accumulate(session, user_id, pending, seed_count=0):
+    """
+    Soma no rollup {(dia, métrica): (total, amostras, maior valor)} sem ler as linhas
+
+    seed_count: amostras de uma linha que ainda não existia (as linhas novas
+    nascem zeradas e recebem os deltas como as existentes)
+    """
+    keys = sorted(pending)  # Mesma ordem de locks em ingestões concorrentes
+    insert_ignore(session, FitnessDaily, [
+        {'id': str(uuid.uuid4()), 'user_id': user_id, 'day': day, 'metric': metric,
+         'total': 0.0, 'count': seed_count, 'max_value': 0.0}
+        for day, metric in keys
+    ])
+    current_max = func.coalesce(FitnessDaily.max_value, 0.0)
+    for day, metric in keys:
+        total, count, max_value = pending[(day, metric)]
+        session.execute(update(FitnessDaily).where(
+            FitnessDaily.user_id == user_id,
+            FitnessDaily.day == day,
+            FitnessDaily.metric == metric
+        ).values(
+            total=func.coalesce(FitnessDaily.total, 0.0) + total,
+            count=func.coalesce(FitnessDaily.count, 0) + count,
+            max_value=case((current_max < max_value, max_value), else_=current_max)
+        ), execution_options={'synchronize_session': False})
+
+
+def apply_samples(session, user_id, samples):
+    """
+    Acumula amostras no rollup diário do usuário (sem commit)
+
+    Args:
+        session: Sessão SQLAlchemy da ingestão (mesma transação)
+        user_id: ID do usuário
+        samples: Iterável de (quando, métrica, valor) ou (quando, métrica, valor, amostras)
+    """
+    pending = {}
+    for sample in samples:
+        when, metric, value = sample[:3]
+        key = (_to_day(when), metric)
+        acc = pending.setdefault(key, [0.0, 0, 0.0])
+        acc[0] += value
+        acc[1] += sample[3] if len(sample) > 3 else 1
+        acc[2] = max(acc[2], value)
+
+    if not pending:
+        return 0
+
+    _accumulate(session, user_id, pending)
+    return len(pending)
+
+
+def record_fitness_data(session, fitness_records):
+    """Atualiza o rollup com registros FitnessData recém-criados (qualquer fonte)"""
+    by_user = {}
+    for record in fitness_records:
+        when = record.start_time or datetime.utcnow()
+        samples = by_user.setdefault(record.user_id, [])
+        for metric, value in fitness_data_metrics(record):
+            samples.append((when, metric, value))
+
+    for user_id, samples in by_user.items():
+        apply_samples(session, user_id, samples)
+
+
+def record_fitbit_activities(session, user_id, activities):
+    """Atualiza o rollup com atividades Fitbit recém-salvas"""
+    samples = []
+    for activity in activities:
+        for metric, value in fitbit_activity_metrics(activity):
+            samples.append((activity.start_time, metric, value))
+    apply_samples(session, user_id, samples)
+
+
+def record_fitbit_correction(session, user_id, activity, old_metrics):
+    """
+    Ajusta o rollup quando o Fitbit reenvia uma atividade já contabilizada com
+    valores diferentes: aplica apenas a diferença, sem contar uma nova amostra
+    """
+    new_metrics = dict(fitbit_activity_metrics(activity))
+    old_metrics = dict(old_metrics)
+    day = _to_day(activity.start_time)
+
+    deltas = {}
+    for metric in set(new_metrics) | set(old_metrics):
+        delta = new_metrics.get(metric, 0.0) - old_metrics.get(metric, 0.0)
+        if delta:
+            deltas[metric] = delta
+
+    if not deltas:
+        return 0
+
+    # Só a diferença: nenhuma amostra nova (uma linha que faltava conta a atividade uma vez)
+    _accumulate(session, user_id, {
+        (day, metric): (delta, 0, new_metrics.get(metric, 0.0))
+        for metric, delta in deltas.items()
+    }, seed_count=1)
+    return len(deltas)
+
+
+# ==================== CONSULTAS ====================
+
+def get_metric_total(session, user_id, metric, start=None, end=None):
+    """Soma de uma métrica no período [start, end] (granularidade diária)"""
+    query = session.query(func.sum(FitnessDaily.total)).filter(
+        FitnessDaily.user_id == user_id,
+        FitnessDaily.metric == metric
+    )
+    if start:
+        query = query.filter(FitnessDaily.day >= _to_day(start))
+    if end:
+        query = query.filter(FitnessDaily.day <= _to_day(end))
+    return float(query.scalar() or 0.0)
+
+
+def get_activity_breakdown(session, user_id):
+    """Quantidade e soma de valores por tipo de atividade"""
+    rows = session.query(
+        FitnessDaily.metric,
+        func.sum(FitnessDaily.count).label('count'),
+        func.sum(FitnessDaily.total).label('total')
+    ).filter(
+        FitnessDaily.user_id == user_id,
+        FitnessDaily.metric.like(ACTIVITY_PREFIX + '%')
+    ).group_by(FitnessDaily.metric).all()
+
+    return [
+        {
+            'activity_type': row.metric[len(ACTIVITY_PREFIX):],
+            'count': int(row.count or 0),
+            'total_distance': float(row.total or 0.0)
+        }
+        for row in rows
+    ]
+
+
+def get_metric_summary(session, user_id, since=None):
+    """Totais, dias ativos e melhor dia por métrica de meta"""
+    query = session.query(
+        FitnessDaily.metric,
+        func.sum(FitnessDaily.total).label('total'),
+        func.sum(FitnessDaily.count).label('count'),
+        func.count(FitnessDaily.day).label('active_days'),
+        func.max(FitnessDaily.total).label('best_day')
+    ).filter(
+        FitnessDaily.user_id == user_id,
+        FitnessDaily.metric.in_(GOAL_METRICS)
+    )
+    if since:
+        query = query.filter(FitnessDaily.day >= _to_day(since))
+
+    summary = {metric: {'total': 0.0, 'count': 0, 'active_days': 0, 'best_day': 0.0} for metric in GOAL_METRICS}
+    for row in query.group_by(FitnessDaily.metric).all():
+        summary[row.metric] = {
+            'total': round(float(row.total or 0.0), 2),
+            'count': int(row.count or 0),
+            'active_days': int(row.active_days or 0),
+            'best_day': round(float(row.best_day or 0.0), 2)
+        }
+    return summary
+
+
+def get_daily_series(session, user_id, metric, start, end):
+    """Série diária de uma métrica (apenas dias com dados)"""
+    rows = session.query(FitnessDaily).filter(
+        FitnessDaily.user_id == user_id,
+        FitnessDaily.metric == metric,
+        FitnessDaily.day >= _to_day(start),
+        FitnessDaily.day <= _to_day(end)
+    ).order_by(FitnessDaily.day).all()
+    return [row.to_dict() for row in rows]
+
+
+# ==================== RECONSTRUÇÃO ====================
+
+def rebuild_user_rollup(session, user_id):
+    """Recalcula o rollup de um usuário a partir das amostras brutas e compactadas (backfill)"""
+    from models import FitnessData, FitnessHourly, FitbitUser, FitbitActivity
+
+    session.query(FitnessDaily).filter(FitnessDaily.user_id == user_id).delete(synchronize_session=False)
+
+    records = session.query(FitnessData).filter(FitnessData.user_id == user_id).yield_per(1000)
+    record_fitness_data(session, records)
+
+    buckets = session.query(FitnessHourly).filter(FitnessHourly.user_id == user_id).yield_per(1000)
+    apply_samples(session, user_id, (
+        (bucket.hour, metric, value, bucket.count or 0)
+        for bucket in buckets
+        for metric, value in fitness_hourly_metrics(bucket)
+    ))
+
+    activities = session.query(FitbitActivity).join(
+        FitbitUser, FitbitActivity.fitbit_user_id == FitbitUser.id
+    ).filter(FitbitUser.user_id == user_id).all()
+    record_fitbit_activities(session, user_id, activities)
@@ -1,11 +1,41 @@
 # ==================== SISTEMA DE GAMIFICAÇÃO ====================
 # Níveis, XP, Badges e Recompensas
-
-from sqlalchemy import func
+#
+# Dirigido por eventos de domínio: participação completada, prêmio pago e
+# atividade ingerida. Os eventos saem das próprias mudanças nos modelos (um
+# listener before_flush observa ChallengeParticipation, ChallengeWinner,
+# FitnessData e FitbitActivity), então todo caminho que grava essas linhas
+# alimenta a gamificação na mesma transação. Cada evento atualiza contadores
+# em user_game_stats; badges são limiares sobre esses contadores e só as
+# regras do contador alterado são avaliadas. O XP do flush inteiro é somado
+# por usuário e gravado junto. Contadores e XP são somados no próprio UPDATE
+# (col = col + delta ... RETURNING), então fluxos concorrentes não perdem
+# incrementos e os limiares são avaliados sobre o valor realmente gravado. Level-ups e badges novos vão para os
+# listeners de on_gamification() após o commit. Atividades confiáveis e com
+# valor também marcam o dia no bitmap de activity_days, que alimenta as
+# sequências (streaks).
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy import func, case, event, inspect, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime, timedelta
-from models import SessionLocal, User, ChallengeParticipation as Participation, Challenge
+from models import (
+    SessionLocal, User, ChallengeParticipation as Participation, Challenge,
+    ChallengeWinner, FitnessData, FitbitActivity, FitbitUser, UserGameStats, ActivityCalendar,
+    insert_ignore
+)
+from activity_days import mark_active_days, get_streak_summary, rebuild_activity_calendar, current_streak
+from auth_context import authenticated_user
+from antifraud import is_trusted
 import json
 
+logger = logging.getLogger(__name__)
+
 # ==================== CONSTANTES ====================
 
 LEVELS = {
@@ -40,6 +70,43 @@ BADGES = {
 }
 
 
+# Badge -> (contador de user_game_stats, limiar)
+BADGE_RULES = {
+    'first_run': ('challenges_completed', 1),
+    'challenges_10': ('challenges_completed', 10),
+    'challenges_50': ('challenges_completed', 50),
+    'challenges_100': ('challenges_completed', 100),
+    'first_place': ('first_places', 1),
+    'earnings_1000': ('total_earned', 1000),
+    'earnings_5000': ('total_earned', 5000),
+    'streak_7': ('longest_streak', 7),  # activity_calendars
+    'streak_30': ('longest_streak', 30)
+}
+
+# XP ao cruzar o tamanho de sequência (cada nova sequência pode render de novo)
+STREAK_XP = ((7, 'streak_7_days'), (30, 'streak_30_days'))
+
+_RULES_BY_COUNTER = {}
+for _badge, (_counter, _threshold) in BADGE_RULES.items():
+    _RULES_BY_COUNTER.setdefault(_counter, []).append((_threshold, _badge))
+
+COMPLETED_STATUSES = ('completed', 'winner')
+PODIUM_XP = {1: 'challenge_won_1st', 2: 'challenge_won_2nd', 3: 'challenge_won_3rd'}
+
+EVENT_PARTICIPATION_COMPLETED = 'participation_completed'
+EVENT_PRIZE_PAID = 'prize_paid'
+EVENT_ACTIVITY_INGESTED = 'activity_ingested'
+EVENT_XP = 'xp'
+
+_listeners = []
+
+
+def on_gamification(callback):
+    """Registra um callback chamado com cada level-up/badge novo (após o commit)"""
+    _listeners.append(callback)
+    return callback
+
+
 # ==================== FUNÇÕES DE GAMIFICAÇÃO ====================
 
 def get_user_level(xp):
@@ -54,6 +121,450 @@ def get_user_level(xp):
     return LEVELS['diamond']
 
 
+# ==================== EVENTOS DE DOMÍNIO ====================
+
+def participation_completed(user_id, count=1):
+    return {'type': EVENT_PARTICIPATION_COMPLETED, 'user_id': user_id, 'count': count}
+
+
+def prize_paid(user_id, position, amount):
+    return {'type': EVENT_PRIZE_PAID, 'user_id': user_id, 'position': position, 'amount': float(amount or 0.0)}
+
+
+def activity_ingested(user_id, count=1, days=None):
+    return {'type': EVENT_ACTIVITY_INGESTED, 'user_id': user_id, 'count': count, 'days': [d for d in days or () if d]}
+
+
+def xp_awarded(user_id, xp_type, amount=None):
+    return {'type': EVENT_XP, 'user_id': user_id, 'xp_type': xp_type, 'amount': amount}
+
+
+def _history_counters(session, user_ids):
+    """Contadores calculados do histórico (só para usuários ainda sem linha em user_game_stats)"""
+    counters = {uid: {} for uid in user_ids}
+    rows = session.query(Participation.user_id, func.count(Participation.id)).filter(
+        Participation.user_id.in_(user_ids),
+        Participation.status.in_(COMPLETED_STATUSES)
+    ).group_by(Participation.user_id)
+    for user_id, total in rows:
+        counters[user_id]['challenges_completed'] = total
+
+    rows = session.query(
+        ChallengeWinner.user_id,
+        func.count(ChallengeWinner.id),
+        func.sum(case((ChallengeWinner.position == 1, 1), else_=0)),
+        func.sum(ChallengeWinner.prize_amount)
+    ).filter(ChallengeWinner.user_id.in_(user_ids)).group_by(ChallengeWinner.user_id)
+    for user_id, won, first, earned in rows:
+        counters[user_id].update(challenges_won=won, first_places=first or 0, total_earned=float(earned or 0.0))
+
+    rows = session.query(FitnessData.user_id, func.count(FitnessData.id)).filter(
+        FitnessData.user_id.in_(user_ids)
+    ).group_by(FitnessData.user_id)
+    for user_id, total in rows:
+        counters[user_id]['activities_ingested'] = total
+
+    rows = session.query(FitbitUser.user_id, func.count(FitbitActivity.id)).join(
+        FitbitActivity, FitbitActivity.fitbit_user_id == FitbitUser.id
+    ).filter(FitbitUser.user_id.in_(user_ids)).group_by(FitbitUser.user_id)
+    for user_id, total in rows:
+        counters[user_id]['activities_ingested'] = counters[user_id].get('activities_ingested', 0) + total
+    return counters
+
+
+def _load_stats(session, user_ids):
+    """Linhas de user_game_stats dos usuários, criando (a partir do histórico) as que faltam"""
+    cache = session.info.setdefault('game_stats', {})
+    missing = [uid for uid in user_ids if uid not in cache]
+    if missing:
+        for stats in session.query(UserGameStats).filter(UserGameStats.user_id.in_(missing)):
+            cache[stats.user_id] = stats
+        new_ids = [uid for uid in missing if uid not in cache]
+        if new_ids:
+            # ON CONFLICT DO NOTHING: se outra transação criou a linha ao mesmo
+            # tempo, vale a dela (os eventos são somados por cima com UPDATE)
+            insert_ignore(session, UserGameStats, [
+                {
+                    'user_id': user_id,
+                    'challenges_completed': values.get('challenges_completed', 0),
+                    'challenges_won': values.get('challenges_won', 0),
+                    'first_places': values.get('first_places', 0),
+                    'total_earned': values.get('total_earned', 0.0),
+                    'activities_ingested': values.get('activities_ingested', 0)
+                }
+                for user_id, values in _history_counters(session, new_ids).items()
+            ])
+            for stats in session.query(UserGameStats).filter(
+                UserGameStats.user_id.in_(new_ids)
+            ).populate_existing():
+                cache[stats.user_id] = stats
+    return {uid: cache[uid] for uid in user_ids}
+
+
+def _crossed(counter, old, new, badges):
+    """Badges do contador cujo limiar fica entre old (exclusivo) e new"""
+    return [badge for threshold, badge in _RULES_BY_COUNTER.get(counter, ())
+            if old < threshold <= new and badge not in badges]
+
+
+def _increment(session, model, key, row, deltas):
+    """
+    Soma os deltas no próprio UPDATE (col = col + delta ... RETURNING), sem
+    ler-modificar-gravar, e atualiza o objeto com o valor gravado
+
+    Returns:
+        Dict coluna -> (valor antes, valor depois)
+    """
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return {}
+
+    columns = [getattr(model, name) for name in deltas]
+    stmt = update(model).where(key == inspect(row).identity[0]).values({
+        name: func.coalesce(column, 0) + deltas[name] for name, column in zip(deltas, columns)
+    }).returning(*columns)
+    values = session.execute(stmt, execution_options={'synchronize_session': False}).one()
+    changes = {}
+    for name, new in zip(deltas, values):
+        set_committed_value(row, name, new)
+        changes[name] = (new - deltas[name], new)
+    return changes
+
+
+def record_events(session, events):
+    """
+    Aplica eventos de domínio aos contadores, XP e badges (sem commit)
+
+    Args:
+        session: Sessão SQLAlchemy da transação que gerou os eventos
+        events: Lista de dicts criados por participation_completed(), prize_paid(),
+                activity_ingested() ou xp_awarded()
+
+    Returns:
+        Dict user_id -> {xp_awarded, total_xp, level, level_up, new_badges}
+    """
+    events = [e for e in events or [] if e.get('user_id')]
+    if not events:
+        return {}
+
+    with session.no_autoflush:
+        user_ids = list({e['user_id'] for e in events})
+        users = {u.id: u for u in session.query(User).filter(User.id.in_(user_ids))}
+        stats = _load_stats(session, [uid for uid in user_ids if uid in users])
+
+        xp = {uid: 0 for uid in users}
+        deltas = {uid: {} for uid in users}
+        active_days = {}
+        badges = {uid: json.loads(users[uid].badges) if users[uid].badges else [] for uid in users}
+        new_badges = {uid: [] for uid in users}
+
+        for e in events:
+            user_id = e['user_id']
+            if user_id not in users:
+                continue
+            counters = deltas[user_id]
+            if e['type'] == EVENT_PARTICIPATION_COMPLETED:
+                counters['challenges_completed'] = counters.get('challenges_completed', 0) + e['count']
+                if e['count'] > 0:
+                    xp[user_id] += XP_REWARDS['challenge_completed'] * e['count']
+            elif e['type'] == EVENT_PRIZE_PAID:
+                counters['challenges_won'] = counters.get('challenges_won', 0) + 1
+                if e['position'] == 1:
+                    counters['first_places'] = counters.get('first_places', 0) + 1
+                counters['total_earned'] = counters.get('total_earned', 0) + e['amount']
+                xp[user_id] += XP_REWARDS.get(PODIUM_XP.get(e['position']), 0)
+            elif e['type'] == EVENT_ACTIVITY_INGESTED:
+                counters['activities_ingested'] = counters.get('activities_ingested', 0) + e['count']
+                active_days.setdefault(user_id, []).extend(e.get('days') or [])
+            elif e['type'] == EVENT_XP:
+                xp[user_id] += e['amount'] or XP_REWARDS.get(e['xp_type'], 0)
+
+        # Contadores: um UPDATE por usuário; badges pelos limiares entre o valor antes e depois
+        for user_id, counters in deltas.items():
+            changes = _increment(session, UserGameStats, UserGameStats.user_id, stats[user_id], counters)
+            for counter, (old, new) in changes.items():
+                earned = _crossed(counter, old, new, badges[user_id])
+                badges[user_id].extend(earned)
+                new_badges[user_id].extend(earned)
+            old_completed, new_completed = changes.get('challenges_completed', (0, 0))
+            if old_completed == 0 and new_completed > 0:
+                xp[user_id] += XP_REWARDS['first_challenge']
+
+        # Sequências: marca os dias no bitmap e premia as que cruzaram 7/30 dias
+        for user_id, days in active_days.items():
+            if not days:
+                continue
+            for old_run, new_run in mark_active_days(session, user_id, days):
+                xp[user_id] += sum(XP_REWARDS[xp_type] for length, xp_type in STREAK_XP
+                                   if old_run < length <= new_run)
+                earned = _crossed('longest_streak', old_run, new_run, badges[user_id])
+                badges[user_id].extend(earned)
+                new_badges[user_id].extend(earned)
+
+        # XP e badges do lote inteiro numa única escrita por usuário
+        results = {}
+        notifications = session.info.setdefault('gamification_events', [])
+        for user_id, user in users.items():
+            old_xp, new_xp = _increment(session, User, User.id, user, {'xp': xp[user_id]}).get(
+                'xp', (user.xp or 0, user.xp or 0))
+            if new_badges[user_id]:
+                user.badges = json.dumps(badges[user_id])
+            old_level = get_user_level(old_xp)
+            new_level = get_user_level(new_xp)
+            result = {
+                'xp_awarded': xp[user_id],
+                'total_xp': new_xp,
+                'level': new_level,
+                'level_up': old_level['key'] != new_level['key'],
+                'new_badges': [dict(BADGES[b], key=b) for b in new_badges[user_id]]
+            }
+            results[user_id] = result
+            if result['level_up'] or result['new_badges']:
+                notifications.append(dict(result, user_id=user_id))
+        session.info.setdefault('gamification_changed', set()).update(users)
+    return results
+
+
+def _active_day(obj):
+    """start_time da atividade se ela conta para sequências (confiável e com valor), senão None"""
+    if isinstance(obj, FitnessData):
+        counts = is_trusted(obj) and (obj.value or 0) > 0
+    else:
+        counts = any((value or 0) > 0 for value in (obj.distance, obj.steps, obj.duration, obj.calories))
+    return obj.start_time if counts else None
+
+
+def _collect_domain_events(session):
+    """Eventos de domínio a partir das mudanças pendentes na sessão"""
+    events = []
+    fitbit_owners = {}
+    for obj in session.new:
+        if isinstance(obj, FitnessData):
+            events.append(activity_ingested(obj.user_id, days=[_active_day(obj)]))
+        elif isinstance(obj, FitbitActivity):
+            fitbit_owners.setdefault(obj.fitbit_user_id, []).append(_active_day(obj))
+        elif isinstance(obj, ChallengeWinner):
+            events.append(prize_paid(obj.user_id, obj.position, obj.prize_amount))
+        elif isinstance(obj, Participation) and obj.status in COMPLETED_STATUSES:
+            events.append(participation_completed(obj.user_id))
+
+    for obj in session.dirty:
+        if not isinstance(obj, Participation):
+            continue
+        history = inspect(obj).attrs.status.history
+        if not history.has_changes():
+            continue
+        was_completed = bool(history.deleted) and history.deleted[0] in COMPLETED_STATUSES
+        is_completed = obj.status in COMPLETED_STATUSES
+        if is_completed != was_completed:
+            events.append(participation_completed(obj.user_id, 1 if is_completed else -1))
+
+    if fitbit_owners:
+        with session.no_autoflush:
+            owners = dict(session.query(FitbitUser.id, FitbitUser.user_id).filter(
+                FitbitUser.id.in_(list(fitbit_owners))
+            ))
+        events.extend(activity_ingested(owners[fid], len(days), days)
+                      for fid, days in fitbit_owners.items() if fid in owners)
+    return events
+
+
+@event.listens_for(Session, 'before_flush')
+def _apply_domain_events(session, flush_context, instances):
+    events = _collect_domain_events(session)
+    if not events:
+        return
+    # Savepoint: um erro aqui (já com INSERT/UPDATE executados) não aborta a
+    # transação do evento de negócio, que segue para o flush normalmente
+    notifications = list(session.info.get('gamification_events', ()))
+    changed = set(session.info.get('gamification_changed', ()))
+    savepoint = session.connection().begin_nested()
+    try:
+        record_events(session, events)
+        savepoint.commit()
+    except Exception as e:
+        savepoint.rollback()
+        user_ids = {item['user_id'] for item in events if item.get('user_id')}
+        _discard_partial_events(session, user_ids, notifications, changed)
+        # Gamificação nunca deve impedir a gravação do evento de negócio
+        logger.error(f"[GAMIFICATION] Erro ao aplicar {len(events)} evento(s): {e}")
+
+
+def _discard_partial_events(session, user_ids, notifications, changed):
+    """
+    Desfaz na sessão o que o savepoint desfez no banco: caches de linhas cujo
+    INSERT voltou, valores gravados com set_committed_value (xp, contadores,
+    bitmap) e badges atribuídos antes do erro, que o flush externo gravaria
+    sem os contadores correspondentes
+    """
+    session.info.pop('game_stats', None)
+    session.info.pop('activity_calendars', None)
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, (UserGameStats, ActivityCalendar)) and obj.user_id in user_ids:
+            session.expire(obj)  # Recarregada (ou recriada) no próximo evento
+        elif isinstance(obj, User) and obj.id in user_ids:
+            session.expire(obj, ['xp', 'badges'])  # Colunas escritas só pela gamificação
+    session.info['gamification_events'] = notifications
+    session.info['gamification_changed'] = changed
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_after_commit(session):
+    session.info.pop('game_stats', None)
+    session.info.pop('activity_calendars', None)
+    profile_cache.invalidate(session.info.pop('gamification_changed', None) or ())
+    for notification in session.info.pop('gamification_events', None) or []:
+        for callback in _listeners:
+            try:
+                callback(notification)
+            except Exception as e:
+                logger.error(f"[GAMIFICATION] Erro no listener {getattr(callback, '__name__', callback)}: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_rollback(session):
+    session.info.pop('game_stats', None)
+    session.info.pop('activity_calendars', None)
+    session.info.pop('gamification_events', None)
+    session.info.pop('gamification_changed', None)
+
+
+# ==================== PERFIS EM CACHE ====================
+# Perfil = nível, badges, contadores e sequências de um usuário. Fica em cache
+# por processo (TTL + LRU) e é invalidado após o commit que muda XP, badges
+# ou contadores, em todos os nós (canal interno do client manager). Misses
+# de uma lista inteira são resolvidos numa única consulta, sem gravar nada:
+# usuário ainda sem linha em user_game_stats tem os contadores calculados do
+# histórico só para leitura (a linha é criada no primeiro evento ou pelo job
+# jobs/rebuild_game_stats.py).
+
+PROFILE_TTL_SECONDS = int(os.getenv('GAMIFICATION_PROFILE_TTL', '300'))
+PROFILE_CACHE_SIZE = int(os.getenv('GAMIFICATION_PROFILE_CACHE_SIZE', '10000'))
+MAX_BATCH_PROFILES = 200
+EMPTY_COUNTERS = {
+    'challenges_completed': 0, 'challenges_won': 0, 'first_places': 0,
+    'total_earned': 0.0, 'activities_ingested': 0
+}
+
+
+class ProfileCache:
+    def __init__(self, ttl=PROFILE_TTL_SECONDS, max_size=PROFILE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()  # user_id -> (expira_em, perfil)
+        self._lock = threading.Lock()
+        self.manager = None
+
+    def get_many(self, user_ids):
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for user_id in user_ids:
+                item = self._items.get(user_id)
+                if item and item[0] > now:
+                    self._items.move_to_end(user_id)
+                    found[user_id] = item[1]
+        return found
+
+    def put_many(self, profiles):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for user_id, profile in profiles.items():
+                self._items[user_id] = (expires_at, profile)
+                self._items.move_to_end(user_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def attach(self, manager):
+        """Liga o cache ao client manager do Socket.IO para invalidar em todos os nós"""
+        if manager is not None and manager is not self.manager and hasattr(manager, 'on_internal'):
+            self.manager = manager
+            manager.on_internal('profile_invalidate', self._on_remote)
+
+    def invalidate(self, user_ids, publish=True):
+        user_ids = list(user_ids)
+        with self._lock:
+            for user_id in user_ids:
+                self._items.pop(user_id, None)
+        if publish and user_ids and self.manager is not None and hasattr(self.manager, 'publish_internal'):
+            try:
+                self.manager.publish_internal('profile_invalidate', {'user_ids': user_ids})
+            except Exception as e:
+                logger.warning(f"[GAMIFICATION] Erro ao publicar invalidação de perfis: {e}")
+
+    def _on_remote(self, payload, node_id):
+        self.invalidate((payload or {}).get('user_ids') or [], publish=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+profile_cache = ProfileCache()
+
+
+def _build_profile(user, counters, calendar):
+    xp = user.xp or 0
+    level = get_user_level(xp)
+    badges = json.loads(user.badges) if user.badges else []
+    completed = counters['challenges_completed']
+    return {
+        'user_id': user.id,
+        'name': user.name,
+        'avatar': user.profile_picture,
+        'xp': xp,
+        'level': level,
+        'next_level_xp': level['max_xp'] if level['max_xp'] != float('inf') else None,
+        'badges': [dict(BADGES[b], key=b) for b in badges if b in BADGES],
+        'total_badges': len(badges),
+        'stats': {
+            'challenges_completed': completed,
+            'challenges_won': counters['challenges_won'],
+            'total_earned': counters['total_earned'],
+            'activities_ingested': counters['activities_ingested'],
+            'current_streak': current_streak(calendar),
+            'longest_streak': calendar.longest_streak if calendar else 0,
+            'win_rate': (counters['challenges_won'] / completed * 100) if completed > 0 else 0
+        }
+    }
+
+
+def get_gamification_profiles(session, user_ids):
+    """
+    Perfis de gamificação de vários usuários (cache + uma consulta para os misses)
+
+    Returns:
+        Dict user_id -> perfil (usuários inexistentes ficam de fora)
+    """
+    user_ids = list(dict.fromkeys(uid for uid in user_ids if uid))
+    profiles = profile_cache.get_many(user_ids)
+    missing = [uid for uid in user_ids if uid not in profiles]
+    if not missing:
+        return profiles
+
+    rows = session.query(User, UserGameStats, ActivityCalendar).outerjoin(
+        UserGameStats, UserGameStats.user_id == User.id
+    ).outerjoin(
+        ActivityCalendar, ActivityCalendar.user_id == User.id
+    ).filter(User.id.in_(missing)).all()
+
+    # Usuários que ainda não tiveram evento: contadores do histórico, só leitura (GET não grava)
+    unseeded = [user.id for user, stats, _ in rows if stats is None]
+    history = _history_counters(session, unseeded) if unseeded else {}
+
+    fetched = {
+        user.id: _build_profile(
+            user, stats.to_dict() if stats else dict(EMPTY_COUNTERS, **history.get(user.id, {})), calendar
+        )
+        for user, stats, calendar in rows
+    }
+    profile_cache.put_many(fetched)
+    profiles.update(fetched)
+    return profiles
+
+
+# ==================== API (ENDPOINTS E SCRIPTS) ====================
+
 def award_xp(user_email, xp_type, amount=None):
     """Adiciona XP ao usuário"""
     session = SessionLocal()
@@ -62,28 +573,15 @@ def award_xp(user_email, xp_type, amount=None):
         if not user:
             return {'success': False, 'error': 'Usuário não encontrado'}
 
-        # Determinar quantidade de XP
-        xp_amount = amount or XP_REWARDS.get(xp_type, 0)
-
-        # Inicializar XP se não existir
-        if not hasattr(user, 'xp') or user.xp is None:
-            user.xp = 0
-
-        old_level = get_user_level(user.xp)
-        user.xp += xp_amount
-        new_level = get_user_level(user.xp)
-
+        result = record_events(session, [xp_awarded(user.id, xp_type, amount)])[user.id]
         session.commit()
 
-        # Verificar se subiu de nível
-        level_up = old_level['key'] != new_level['key']
-
         return {
             'success': True,
-            'xp_awarded': xp_amount,
-            'total_xp': user.xp,
-            'level': new_level,
-            'level_up': level_up
+            'xp_awarded': result['xp_awarded'],
+            'total_xp': result['total_xp'],
+            'level': result['level'],
+            'level_up': result['level_up']
         }
 
     except Exception as e:
@@ -94,72 +592,26 @@ def award_xp(user_email, xp_type, amount=None):
 
 
 def check_and_award_badges(user_email):
-    """Verifica e concede badges ao usuário"""
+    """Reavalia todas as regras de badge sobre os contadores do usuário (ex.: após backfill)"""
     session = SessionLocal()
     try:
         user = session.query(User).filter_by(email=user_email).first()
         if not user:
             return {'success': False, 'error': 'Usuário não encontrado'}
 
-        # Carregar badges atuais
-        current_badges = json.loads(user.badges) if hasattr(user, 'badges') and user.badges else []
+        counters = _load_stats(session, [user.id])[user.id].to_dict()
+        counters['longest_streak'] = get_streak_summary(session, user.id)['longest_streak']
+        current_badges = json.loads(user.badges) if user.badges else []
         new_badges = []
+        for badge, (counter, threshold) in BADGE_RULES.items():
+            if badge not in current_badges and counters.get(counter, 0) >= threshold:
+                current_badges.append(badge)
+                new_badges.append(BADGES[badge])
 
-        # Contar desafios completados
-        challenges_completed = session.query(func.count(Participation.id)).filter(
-            Participation.user_id == user.id,
-            Participation.status.in_(['winner', 'completed'])
-        ).scalar() or 0
-
-        # Badge: Primeira corrida
-        if challenges_completed >= 1 and 'first_run' not in current_badges:
-            current_badges.append('first_run')
-            new_badges.append(BADGES['first_run'])
-
-        # Badge: 10 desafios
-        if challenges_completed >= 10 and 'challenges_10' not in current_badges:
-            current_badges.append('challenges_10')
-            new_badges.append(BADGES['challenges_10'])
-
-        # Badge: 50 desafios
-        if challenges_completed >= 50 and 'challenges_50' not in current_badges:
-            current_badges.append('challenges_50')
-            new_badges.append(BADGES['challenges_50'])
-
-        # Badge: 100 desafios
-        if challenges_completed >= 100 and 'challenges_100' not in current_badges:
-            current_badges.append('challenges_100')
-            new_badges.append(BADGES['challenges_100'])
-
-        # Badge: Primeiro lugar
-        first_place_count = session.query(func.count(Participation.id)).filter(
-            Participation.user_id == user.id,
-            Participation.status == 'winner',
-            Participation.position == 1
-        ).scalar() or 0
-
-        if first_place_count >= 1 and 'first_place' not in current_badges:
-            current_badges.append('first_place')
-            new_badges.append(BADGES['first_place'])
-
-        # Badge: Ganhos
-        total_earnings = session.query(func.sum(Participation.prize_amount)).filter(
-            Participation.user_id == user.id,
-            Participation.status == 'winner'
-        ).scalar() or 0
-
-        if total_earnings >= 1000 and 'earnings_1000' not in current_badges:
-            current_badges.append('earnings_1000')
-            new_badges.append(BADGES['earnings_1000'])
-
-        if total_earnings >= 5000 and 'earnings_5000' not in current_badges:
-            current_badges.append('earnings_5000')
-            new_badges.append(BADGES['earnings_5000'])
-
-        # Salvar badges
-        if hasattr(user, 'badges'):
+        if new_badges:
             user.badges = json.dumps(current_badges)
-            session.commit()
+        session.commit()
+        profile_cache.invalidate([user.id])
 
         return {
             'success': True,
@@ -168,67 +620,45 @@ def check_and_award_badges(user_email):
         }
 
     except Exception as e:
+        session.rollback()
         return {'success': False, 'error': str(e)}
     finally:
         session.close()
 
 
 def get_user_gamification_stats(user_email):
-    """Retorna estatísticas completas de gamificação do usuário"""
+    """Retorna estatísticas completas de gamificação do usuário (perfil em cache)"""
     session = SessionLocal()
     try:
-        user = session.query(User).filter_by(email=user_email).first()
-        if not user:
+        user_id = session.query(User.id).filter_by(email=user_email).scalar()
+        profile = get_gamification_profiles(session, [user_id]).get(user_id) if user_id else None
+        if not profile:
             return {'success': False, 'error': 'Usuário não encontrado'}
 
-        # XP e Nível
-        xp = user.xp if hasattr(user, 'xp') and user.xp else 0
-        level = get_user_level(xp)
-
-        # Badges
-        badges = json.loads(user.badges) if hasattr(user, 'badges') and user.badges else []
-        badge_details = [BADGES[badge_key] for badge_key in badges if badge_key in BADGES]
-
-        # Estatísticas
-        challenges_completed = session.query(func.count(Participation.id)).filter(
-            Participation.user_id == user.id,
-            Participation.status.in_(['winner', 'completed'])
-        ).scalar() or 0
-
-        challenges_won = session.query(func.count(Participation.id)).filter(
-            Participation.user_id == user.id,
-            Participation.status == 'winner'
-        ).scalar() or 0
-
-        total_earned = session.query(func.sum(Participation.prize_amount)).filter(
-            Participation.user_id == user.id,
-            Participation.status == 'winner'
-        ).scalar() or 0
-
-        # Próximo nível
-        next_level_xp = level['max_xp'] if level['max_xp'] != float('inf') else None
-
-        return {
-            'success': True,
-            'xp': xp,
-            'level': level,
-            'next_level_xp': next_level_xp,
-            'badges': badge_details,
-            'total_badges': len(badges),
-            'stats': {
-                'challenges_completed': challenges_completed,
-                'challenges_won': challenges_won,
-                'total_earned': float(total_earned),
-                'win_rate': (challenges_won / challenges_completed * 100) if challenges_completed > 0 else 0
-            }
-        }
+        return dict(profile, success=True)
 
     except Exception as e:
+        session.rollback()
         return {'success': False, 'error': str(e)}
     finally:
         session.close()
 
 
+def rebuild_game_stats(session, user_ids=None):
+    """Recalcula user_game_stats e os calendários de atividade a partir do histórico (backfill, sem commit)"""
+    if user_ids is None:
+        user_ids = [uid for (uid,) in session.query(User.id)]
+    session.query(UserGameStats).filter(UserGameStats.user_id.in_(user_ids)).delete(synchronize_session=False)
+    session.info.pop('game_stats', None)
+    total = 0
+    for i in range(0, len(user_ids), 500):
+        total += len(_load_stats(session, user_ids[i:i + 500]))
+    for user_id in user_ids:
+        rebuild_activity_calendar(session, user_id)
+    profile_cache.clear()
+    return total
+
+
 # ==================== ENDPOINTS ====================
 
 def register_gamification_routes(app):
@@ -243,6 +673,34 @@ def register_gamification_routes(app):
             return jsonify(result)
         return jsonify(result), 404
 
+    @app.route('/api/gamification/profiles', methods=['GET', 'POST'])
+    def get_gamification_profiles_batch():
+        """
+        GET /api/gamification/profiles?user_ids=a,b,c
+        POST /api/gamification/profiles {"user_ids": [...]}
+
+        Perfis de vários usuários numa chamada (ranking, chat), até MAX_BATCH_PROFILES
+        """
+        if request.method == 'POST':
+            user_ids = (request.get_json(silent=True) or {}).get('user_ids') or []
+        else:
+            user_ids = [uid for uid in request.args.get('user_ids', '').split(',') if uid]
+
+        if not isinstance(user_ids, list) or not user_ids:
+            return jsonify({'success': False, 'error': 'user_ids é obrigatório'}), 400
+        if len(user_ids) > MAX_BATCH_PROFILES:
+            return jsonify({'success': False, 'error': f'Máximo de {MAX_BATCH_PROFILES} usuários por chamada'}), 400
+
+        session = SessionLocal()
+        try:
+            profiles = get_gamification_profiles(session, [str(uid) for uid in user_ids])
+            return jsonify({'success': True, 'profiles': profiles, 'count': len(profiles)})
+        except Exception as e:
+            session.rollback()
+            return jsonify({'success': False, 'error': str(e)}), 500
+        finally:
+            session.close()
+
     @app.route('/api/gamification/award-xp', methods=['POST'])
     def award_xp_endpoint():
         """POST /api/gamification/award-xp - Adicionar XP ao usuário"""
@@ -254,7 +712,11 @@ def register_gamification_routes(app):
         if not user_email or not xp_type:
             return jsonify({'success': False, 'error': 'user_email e xp_type são obrigatórios'}), 400
 
-        result = award_xp(user_email, xp_type, amount)
+        user, error = authenticated_user(user_email)
+        if error:
+            return error
+
+        result = award_xp(user.email, xp_type, amount)
         return jsonify(result)
 
     @app.route('/api/gamification/check-badges', methods=['POST'])
@@ -266,7 +728,11 @@ def register_gamification_routes(app):
         if not user_email:
             return jsonify({'success': False, 'error': 'user_email é obrigatório'}), 400
 
-        result = check_and_award_badges(user_email)
+        user, error = authenticated_user(user_email)
+        if error:
+            return error
+
+        result = check_and_award_badges(user.email)
         return jsonify(result)
 
     @app.route('/api/gamification/levels', methods=['GET'])
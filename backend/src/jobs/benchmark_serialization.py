@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark da serialização de desafios: to_dict() + json do Flask vs
+challenge_serializer + orjson (lista completa e com ?fields=)
+Usa objetos em memória, sem banco. Confere antes se as duas saídas são iguais.
+Executar: python benchmark_serialization.py [linhas] [repetições]
+"""
+import sys
+import os
+import time
+import json
+import random
+import datetime
+
+# Adicionar path do backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import Challenge
+from serializers import challenge_serializer, OrjsonProvider, orjson
+
+
+def build_challenges(count):
+    start = datetime.datetime(2025, 1, 1, 8, 30, 15, 123456)
+    return [
+        Challenge(
+            id=f"challenge-{i}", title=f"Desafio {i}", description='Corra todos os dias ' * 5,
+            category=random.choice(['running', 'cycling', 'steps']), difficulty='medium',
+            entry_fee=random.choice([0.0, 10.0, 25.5]), total_pool=i * 10.0,
+            max_participants=100, current_participants=i % 100,
+            start_date=start, end_date=start + datetime.timedelta(days=30),
+            status='active', rules='Regras', prize_distribution='equal',
+            created_at=start, updated_at=start, created_by='admin', auto_validation=True,
+            target_metric='distance', target_value=42.195, target_unit='km',
+            validation_rules='{"min_pace": 3.5, "sources": ["strava", "fitbit"]}',
+            required_app_category='running', max_winners=i % 5 + 1,
+            winner_selection_type='first_to_complete', prize_distribution_type='equal'
+        )
+        for i in range(count)
+    ]
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(count=10000, repeat=5):
+    print(f"[BENCH] Serializando {count} desafios (melhor de {repeat})")
+    if orjson is None:
+        print("[BENCH] ❌ orjson não instalado (pip install -r requirements.txt)")
+        return
+
+    challenges = build_challenges(count)
+    app = Flask(__name__)
+    stdlib = app.json  # Provider padrão do Flask (json da stdlib)
+    fast = OrjsonProvider(app)
+    fields = {'id', 'title', 'category', 'entry_fee', 'end_date', 'current_participants'}
+
+    def legacy():
+        return stdlib.dumps({'challenges': [c.to_dict() for c in challenges]})
+
+    def serializer():
+        return fast.dumps({'challenges': challenge_serializer.dump_many(challenges)})
+
+    def sparse():
+        return fast.dumps({'challenges': challenge_serializer.dump_many(challenges, fields)})
+
+    if json.loads(legacy()) != json.loads(serializer()):
+        print("[BENCH] ❌ Saída do serializer difere do to_dict()")
+        return
+    print("[BENCH] ✅ Saída idêntica ao to_dict()")
+
+    baseline = best_of(legacy, repeat)
+    print(f"[BENCH] to_dict + json:          {baseline * 1000:8.1f} ms")
+    for label, fn in (('serializer + orjson:', serializer), ('?fields= (6 campos):', sparse)):
+        elapsed = best_of(fn, repeat)
+        print(f"[BENCH] {label:<24} {elapsed * 1000:8.1f} ms  ({baseline / elapsed:.1f}x)")
+
+
+if __name__ == '__main__':
+    run(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Compactação de fitness_data: amostras mais antigas que o horizonte de retenção
+viram agregados por hora (fitness_hourly) e são apagadas em lotes
+Executar diariamente: python compact_fitness_data.py [--days N] [--batch N] [--user ID] [--dry-run]
+"""
+import sys
+import os
+import argparse
+from datetime import datetime
+
+# Adicionar path do backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import SessionLocal
+from fitness_compaction import compact_fitness_data, RETENTION_DAYS, BATCH_SIZE
+
+
+def compact(days=RETENTION_DAYS, batch_size=BATCH_SIZE, user_id=None, dry_run=False):
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [COMPACT] Compactando fitness_data "
+          f"(retenção {days} dias{', simulação' if dry_run else ''})...")
+
+    session = SessionLocal()
+    try:
+        stats = compact_fitness_data(session, days, batch_size, user_id=user_id, dry_run=dry_run)
+        print(f"[COMPACT] ✅ {stats['rows_compacted']} linha(s) compactada(s) em {stats['batches']} lote(s) "
+              f"→ {stats['buckets']} agregado(s) por hora (antes de {stats['cutoff']})")
+        print(f"[COMPACT] {stats['rows_kept_referenced']} linha(s) mantida(s) por ChallengeValidation")
+        print(f"[COMPACT] ~{stats['bytes_reclaimed'] / 1024:.1f} KB liberados")
+        return stats
+    except Exception as e:
+        session.rollback()
+        print(f"[COMPACT] ❌ Erro na compactação: {e}")
+        raise
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compacta amostras antigas de fitness_data')
+    parser.add_argument('--days', type=int, default=RETENTION_DAYS)
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE)
+    parser.add_argument('--user')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    compact(args.days, args.batch, args.user, args.dry_run)
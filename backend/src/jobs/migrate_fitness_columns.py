@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Adiciona às tabelas já existentes as colunas e índices novos (create_all só cria tabelas)
+Executar uma vez após o deploy, antes de subir o app: python migrate_fitness_columns.py [tamanho_do_lote]
+Pode ser executado de novo: só altera o que ainda falta.
+
+1. ALTER TABLE: fitness_data.external_id/trust_score/fraud_reasons e
+   fitness_connections.sync_cursor
+2. Backfill de fitness_data.external_id das atividades do Strava (id do JSON bruto)
+3. Índice único (connection_id, external_id) e índices de paginação do chat
+4. Backfill de fitness_connections.sync_cursor (início da última atividade importada)
+
+trust_score/fraud_reasons ficam NULL nas linhas antigas (NULL = confiável, ver antifraud.is_trusted).
+"""
+import sys
+import os
+import json
+from datetime import datetime, timezone
+
+# Adicionar path do backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import inspect, text, func
+from models import engine, SessionLocal, FitnessData, FitnessConnection, Message
+
+BATCH_SIZE = 500
+
+# (modelo, coluna) adicionadas a tabelas que já existiam
+NEW_COLUMNS = [
+    (FitnessData, 'external_id'),
+    (FitnessData, 'trust_score'),
+    (FitnessData, 'fraud_reasons'),
+    (FitnessConnection, 'sync_cursor'),
+]
+
+NEW_INDEXES = [
+    (FitnessData, 'ix_fitness_data_connection_external'),
+    (Message, 'ix_messages_challenge_created'),
+    (Message, 'ix_messages_pair_created'),
+]
+
+
+def add_columns():
+    """ALTER TABLE ... ADD COLUMN para as colunas que ainda não existem"""
+    added = 0
+    existing = {}
+    with engine.begin() as conn:
+        for model, name in NEW_COLUMNS:
+            table = model.__table__
+            if table.name not in existing:
+                existing[table.name] = {c['name'] for c in inspect(conn).get_columns(table.name)}
+            if name in existing[table.name]:
+                continue
+            column_type = table.c[name].type.compile(dialect=engine.dialect)
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {name} {column_type}'))
+            existing[table.name].add(name)
+            added += 1
+            print(f"[SCHEMA] {table.name}.{name} ({column_type}) adicionada")
+    return added
+
+
+def backfill_external_ids(session, batch_size=BATCH_SIZE):
+    """external_id das atividades do Strava a partir do JSON bruto (id da atividade)"""
+    filled = duplicates = 0
+    last_id = ''
+    while True:
+        rows = session.query(FitnessData).filter(
+            FitnessData.source_app == 'strava',
+            FitnessData.external_id.is_(None),
+            FitnessData.id > last_id
+        ).order_by(FitnessData.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        candidates = {}
+        for record in rows:
+            try:
+                activity_id = (json.loads(record.raw_data) if record.raw_data else {}).get('id')
+            except ValueError:
+                activity_id = None
+            if activity_id is not None:
+                candidates.setdefault((record.connection_id, str(activity_id)), []).append(record)
+
+        taken = set(session.query(FitnessData.connection_id, FitnessData.external_id).filter(
+            FitnessData.connection_id.in_({key[0] for key in candidates}),
+            FitnessData.external_id.in_({key[1] for key in candidates})
+        )) if candidates else set()
+        for key, records in candidates.items():
+            # Atividade importada mais de uma vez: só a primeira recebe o id; as
+            # outras ficam NULL (não violam o índice) e são listadas para revisão
+            if key not in taken:
+                records[0].external_id = key[1]
+                filled += 1
+                records = records[1:]
+            for record in records:
+                duplicates += 1
+                print(f"[SCHEMA] ⚠️ Atividade {key[1]} duplicada na conexão {key[0]}: fitness_data {record.id}")
+
+        session.commit()
+        session.expunge_all()
+        print(f"[SCHEMA] fitness_data.external_id: {filled} preenchido(s)...")
+    return filled, duplicates
+
+
+def create_indexes():
+    """Cria os índices novos que ainda não existem"""
+    created = 0
+    for model, name in NEW_INDEXES:
+        index = next(i for i in model.__table__.indexes if i.name == name)
+        existing = {i['name'] for i in inspect(engine).get_indexes(model.__tablename__)}
+        if name in existing:
+            continue
+        index.create(bind=engine)
+        created += 1
+        print(f"[SCHEMA] Índice {name} criado")
+    return created
+
+
+def backfill_sync_cursors(session):
+    """sync_cursor das conexões do Strava: sem ele a próxima sincronização relê todo o histórico"""
+    latest = dict(session.query(FitnessData.connection_id, func.max(FitnessData.start_time)).join(
+        FitnessConnection, FitnessConnection.id == FitnessData.connection_id
+    ).filter(
+        FitnessConnection.platform == 'strava',
+        FitnessConnection.sync_cursor.is_(None),
+        FitnessData.source_app == 'strava'
+    ).group_by(FitnessData.connection_id))
+
+    for connection in session.query(FitnessConnection).filter(FitnessConnection.id.in_(list(latest))):
+        connection.sync_cursor = int(latest[connection.id].replace(tzinfo=timezone.utc).timestamp())
+    session.commit()
+    return len(latest)
+
+
+def migrate(batch_size=BATCH_SIZE):
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [SCHEMA] Migrando colunas de fitness...")
+
+    try:
+        added = add_columns()
+        print(f"[SCHEMA] ✅ {added} coluna(s) adicionada(s)")
+    except Exception as e:
+        print(f"[SCHEMA] ❌ Erro ao adicionar colunas: {e}")
+        return
+
+    session = SessionLocal()
+    try:
+        filled, duplicates = backfill_external_ids(session, batch_size)
+        print(f"[SCHEMA] ✅ external_id: {filled} preenchido(s), {duplicates} duplicada(s)")
+        cursors = backfill_sync_cursors(session)
+        print(f"[SCHEMA] ✅ sync_cursor: {cursors} conexão(ões) do Strava")
+    except Exception as e:
+        session.rollback()
+        print(f"[SCHEMA] ❌ Erro no backfill: {e}")
+        return
+    finally:
+        session.close()
+
+    try:
+        created = create_indexes()
+        print(f"[SCHEMA] ✅ {created} índice(s) criado(s)")
+    except Exception as e:
+        print(f"[SCHEMA] ❌ Erro ao criar índices: {e}")
+
+
+if __name__ == '__main__':
+    migrate(int(sys.argv[1]) if len(sys.argv) > 1 else BATCH_SIZE)
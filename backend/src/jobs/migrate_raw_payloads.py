@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Move os JSONs brutos das tabelas quentes para raw_payloads (comprimidos)
+Executar uma vez após o deploy: python migrate_raw_payloads.py [tamanho_do_lote]
+Pode ser interrompido e executado de novo: só processa linhas ainda não migradas.
+"""
+import sys
+import os
+from datetime import datetime
+
+# Adicionar path do backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, update
+from models import SessionLocal, FitnessData, FitbitActivity, ChallengeParticipation, store_payload
+
+BATCH_SIZE = 500
+
+# (modelo, campo do payload = nome da coluna legada)
+TARGETS = [
+    (FitnessData, 'raw_data'),
+    (FitnessData, 'device_info'),
+    (FitbitActivity, 'raw_data'),
+    (ChallengeParticipation, 'validation_data'),
+]
+
+
+def migrate_column(session, model, field, batch_size=BATCH_SIZE):
+    """Migra uma coluna em lotes; cada lote é commitado junto com a limpeza da coluna legada"""
+    table = model.__table__
+    legacy = table.c[field]
+    moved = raw_bytes = stored_bytes = 0
+
+    while True:
+        rows = session.execute(
+            select(table.c.id, legacy).where(legacy.isnot(None)).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        for row_id, text in rows:
+            payload = store_payload(session, table.name, row_id, field, text)
+            raw_bytes += payload.raw_size
+            stored_bytes += payload.stored_size
+
+        session.flush()
+        session.execute(
+            update(table).where(table.c.id.in_([row_id for row_id, _ in rows])).values({field: None})
+        )
+        session.commit()
+        session.expunge_all()
+        moved += len(rows)
+        print(f"[PAYLOADS] {table.name}.{field}: {moved} linha(s) migrada(s)...")
+
+    return moved, raw_bytes, stored_bytes
+
+
+def migrate(batch_size=BATCH_SIZE):
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [PAYLOADS] Migrando payloads brutos...")
+
+    session = SessionLocal()
+    try:
+        for model, field in TARGETS:
+            try:
+                moved, raw_bytes, stored_bytes = migrate_column(session, model, field, batch_size)
+            except Exception as e:
+                session.rollback()
+                print(f"[PAYLOADS] ❌ Erro em {model.__tablename__}.{field}: {e}")
+                continue
+
+            ratio = f"{stored_bytes / raw_bytes:.1%}" if raw_bytes else "-"
+            print(f"[PAYLOADS] ✅ {model.__tablename__}.{field}: {moved} linha(s), "
+                  f"{raw_bytes} → {stored_bytes} bytes ({ratio})")
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    migrate(int(sys.argv[1]) if len(sys.argv) > 1 else BATCH_SIZE)
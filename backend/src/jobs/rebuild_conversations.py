@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Backfill da tabela conversations (resumo da caixa de entrada do chat)
+Executar uma vez após o deploy: python rebuild_conversations.py
+"""
+import sys
+import os
+from datetime import datetime
+
+# Adicionar path do backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import SessionLocal
+from chat_conversations import rebuild_conversations
+
+
+def rebuild():
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [CHAT] Reconstruindo conversations...")
+
+    session = SessionLocal()
+    try:
+        total = rebuild_conversations(session)
+        session.commit()
+        print(f"[CHAT] ✅ {total} conversa(s) reconstruída(s)")
+    except Exception as e:
+        session.rollback()
+        print(f"[CHAT] ❌ Erro ao reconstruir conversations: {e}")
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    rebuild()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Backfill do rollup diário de fitness (tabela fitness_daily)
+Executar uma vez após o deploy: python rebuild_fitness_daily.py [user_id ...]
+"""
+import sys
+import os
+from datetime import datetime
+
+# Adicionar path do backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import SessionLocal, User
+from fitness_rollup import rebuild_user_rollup
+
+
+def rebuild(user_ids=None):
+    """Recalcula o rollup dos usuários informados (ou de todos)"""
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [ROLLUP] Reconstruindo fitness_daily...")
+
+    session = SessionLocal()
+    try:
+        if not user_ids:
+            user_ids = [row.id for row in session.query(User.id).all()]
+
+        rebuilt = 0
+        for user_id in user_ids:
+            try:
+                rebuild_user_rollup(session, user_id)
+                session.commit()
+                rebuilt += 1
+            except Exception as e:
+                session.rollback()
+                print(f"[ROLLUP] ❌ Erro ao reconstruir {user_id}: {e}")
+
+        print(f"[ROLLUP] ✅ {rebuilt}/{len(user_ids)} usuário(s) reconstruído(s)")
+
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    rebuild(sys.argv[1:])
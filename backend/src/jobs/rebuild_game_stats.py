@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Backfill de user_game_stats e activity_calendars (contadores e sequências da gamificação)
+Usuários sem linha são preenchidos sob demanda; este script recalcula todos,
+ex.: após correções manuais em participações ou prêmios.
+Executar: python rebuild_game_stats.py
+"""
+import sys
+import os
+from datetime import datetime
+
+# Adicionar path do backend
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import SessionLocal
+from gamification import rebuild_game_stats
+
+
+def rebuild():
+    print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] [GAMIFICATION] Reconstruindo user_game_stats...")
+
+    session = SessionLocal()
+    try:
+        total = rebuild_game_stats(session)
+        session.commit()
+        print(f"[GAMIFICATION] ✅ Contadores de {total} usuário(s) reconstruídos")
+    except Exception as e:
+        session.rollback()
+        print(f"[GAMIFICATION] ❌ Erro ao reconstruir user_game_stats: {e}")
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    rebuild()
@@ -0,0 +1,300 @@
+# ==================== LEADERBOARD AO VIVO POR DESAFIO ====================
+# Ranking em memória de cada desafio, mantido ordenado (bisect) e atualizado
+# pelos eventos de progresso da ingestão. As mudanças são acumuladas e
+# enviadas à sala `challenge_{id}` no máximo a cada LEADERBOARD_FLUSH_MS.
+# Quem entra depois busca o snapshot via REST e aplica os diffs seguintes.
+# Só desafios em andamento ficam em memória: id inexistente é 404 e desafio
+# encerrado tem o ranking montado a cada consulta, sem cache.
+
+import os
+import time
+import logging
+import threading
+from bisect import bisect_left, insort
+from datetime import datetime
+from flask import request, jsonify
+from models import SessionLocal, User, Challenge, ChallengeParticipation, ParticipationProgress
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = int(os.getenv('LEADERBOARD_FLUSH_MS', '500')) / 1000.0
+TOP_N = int(os.getenv('LEADERBOARD_TOP_N', '50'))
+IDLE_SECONDS = int(os.getenv('LEADERBOARD_IDLE_SECONDS', '1800'))
+MAX_PAGE = 500
+
+RANKED_STATUSES = ('active', 'completed', 'winner')
+LIVE_CHALLENGE_STATUSES = ('active',)
+
+
+def _timestamp(value):
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            pass
+    return time.time()
+
+
+class ChallengeLeaderboard:
+    """
+    Ranking de um desafio
+
+    Chave de ordenação: (-valor, momento em que atingiu o valor, user_id).
+    Empate no valor: quem chegou antes fica na frente. Inserção/remoção em
+    lista ordenada é O(log n) na busca + memmove, suficiente para dezenas
+    de milhares de participantes.
+    """
+
+    def __init__(self, challenge_id):
+        self.challenge_id = challenge_id
+        self.version = 0
+        self.last_access = time.time()
+        self._keys = []
+        self._entries = {}  # user_id -> chave de ordenação
+        self._names = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, user_id, value, reached_at=None, name=None):
+        """Insere ou reposiciona um participante; retorna True se mudou"""
+        with self._lock:
+            old = self._entries.get(user_id)
+            if old is not None and -old[0] == value:
+                return False
+
+            key = (-float(value or 0.0), _timestamp(reached_at), user_id)
+            if old is not None:
+                del self._keys[bisect_left(self._keys, old)]
+            insort(self._keys, key)
+            self._entries[user_id] = key
+            if name:
+                self._names[user_id] = name
+            self._dirty.add(user_id)
+            return True
+
+    def remove(self, user_id):
+        with self._lock:
+            old = self._entries.pop(user_id, None)
+            if old is not None:
+                del self._keys[bisect_left(self._keys, old)]
+                self._dirty.add(user_id)
+
+    def _entry(self, key, rank):
+        user_id = key[2]
+        return {
+            'rank': rank,
+            'user_id': user_id,
+            'name': self._names.get(user_id),
+            'value': -key[0]
+        }
+
+    def rank_of(self, user_id):
+        with self._lock:
+            key = self._entries.get(user_id)
+            if key is None:
+                return None
+            return self._entry(key, bisect_left(self._keys, key) + 1)
+
+    def page(self, offset=0, limit=TOP_N):
+        with self._lock:
+            self.last_access = time.time()
+            return [
+                self._entry(key, offset + idx + 1)
+                for idx, key in enumerate(self._keys[offset:offset + limit])
+            ]
+
+    def missing_names(self):
+        with self._lock:
+            return [user_id for user_id in self._dirty if user_id not in self._names]
+
+    def set_names(self, names):
+        with self._lock:
+            self._names.update(names)
+
+    def drain(self):
+        """Retorna o diff acumulado desde o último envio (ou None)"""
+        with self._lock:
+            if not self._dirty:
+                return None
+
+            self.version += 1
+            changes = []
+            top_changed = False
+            for user_id in self._dirty:
+                key = self._entries.get(user_id)
+                if key is None:
+                    changes.append({'user_id': user_id, 'removed': True})
+                    top_changed = True
+                    continue
+                entry = self._entry(key, bisect_left(self._keys, key) + 1)
+                top_changed = top_changed or entry['rank'] <= TOP_N
+                changes.append(entry)
+            self._dirty.clear()
+
+            diff = {
+                'challenge_id': self.challenge_id,
+                'version': self.version,
+                'participant_count': len(self._keys),
+                'changes': sorted(changes, key=lambda c: c.get('rank', 0))
+            }
+            # O top muda para todos quando alguém entra nele
+            if top_changed:
+                diff['top'] = [self._entry(key, idx + 1) for idx, key in enumerate(self._keys[:TOP_N])]
+            return diff
+
+
+class LiveLeaderboardManager:
+    """Mantém os rankings carregados e envia os diffs via Socket.IO"""
+
+    def __init__(self, socketio):
+        self.socketio = socketio
+        self._boards = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def get(self, challenge_id, load=True):
+        """Ranking do desafio (None se o desafio não existe, ou se não carregado e load=False)"""
+        with self._lock:
+            board = self._boards.get(challenge_id)
+        if board is not None or not load:
+            return board
+
+        board, live = self._load(challenge_id)
+        if board is None or not live:
+            return board  # Desafio encerrado: snapshot avulso, não ocupa memória
+        with self._lock:
+            # Outro request pode ter carregado em paralelo
+            return self._boards.setdefault(challenge_id, board)
+
+    def _load(self, challenge_id):
+        """
+        Carrega o ranking do banco na primeira consulta
+
+        Returns:
+            (ranking ou None se o desafio não existe, desafio em andamento?)
+        """
+        session = SessionLocal()
+        try:
+            status = session.query(Challenge.status).filter(Challenge.id == challenge_id).scalar()
+            if status is None:
+                return None, False
+
+            board = ChallengeLeaderboard(challenge_id)
+            rows = session.query(
+                ChallengeParticipation.user_id,
+                ChallengeParticipation.result_value,
+                ChallengeParticipation.completed_at,
+                ChallengeParticipation.joined_at,
+                ParticipationProgress.current_value,
+                ParticipationProgress.last_activity_at,
+                User.name
+            ).outerjoin(
+                ParticipationProgress, ParticipationProgress.participation_id == ChallengeParticipation.id
+            ).outerjoin(
+                User, User.id == ChallengeParticipation.user_id
+            ).filter(
+                ChallengeParticipation.challenge_id == challenge_id,
+                ChallengeParticipation.status.in_(RANKED_STATUSES)
+            ).all()
+
+            for row in rows:
+                value = row.current_value if row.current_value is not None else (row.result_value or 0.0)
+                reached_at = row.last_activity_at or row.completed_at or row.joined_at
+                board.update(row.user_id, value, reached_at, row.name)
+            board._dirty.clear()
+
+            logger.info(f"[LEADERBOARD] Desafio {challenge_id} carregado com {len(board)} participantes")
+            return board, status in LIVE_CHALLENGE_STATUSES
+        finally:
+            session.close()
+
+    def discard(self, challenge_id):
+        with self._lock:
+            self._boards.pop(challenge_id, None)
+
+    def handle_progress(self, event):
+        """Listener de challenge_progress: atualiza apenas rankings já carregados"""
+        board = self.get(event['challenge_id'], load=False)
+        if board is not None:
+            board.update(event['user_id'], event['value'], event.get('timestamp'))
+
+    # ==================== ENVIO DOS DIFFS ====================
+
+    def flush(self):
+        with self._lock:
+            boards = list(self._boards.values())
+
+        now = time.time()
+        for board in boards:
+            missing = board.missing_names()
+            if missing:
+                board.set_names(self._lookup_names(missing))
+
+            diff = board.drain()
+            if diff:
+                self.socketio.emit('leaderboard_update', diff, room=f"challenge_{board.challenge_id}")
+            elif now - board.last_access > IDLE_SECONDS:
+                self.discard(board.challenge_id)
+
+    def _lookup_names(self, user_ids):
+        session = SessionLocal()
+        try:
+            return dict(session.query(User.id, User.name).filter(User.id.in_(user_ids)).all())
+        except Exception as e:
+            logger.error(f"[LEADERBOARD] Erro ao buscar nomes: {e}")
+            return {}
+        finally:
+            session.close()
+
+    def _run(self):
+        while True:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[LEADERBOARD] Erro no flush: {e}")
+            time.sleep(FLUSH_INTERVAL)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+
+def init_live_leaderboard(socketio):
+    """Cria o gerenciador de rankings e inicia o envio periódico de diffs"""
+    manager = LiveLeaderboardManager(socketio)
+    manager.start()
+    return manager
+
+
+def register_live_leaderboard_routes(app, manager):
+    """Registra a rota de snapshot do ranking ao vivo"""
+
+    @app.route('/api/challenges/<challenge_id>/leaderboard', methods=['GET'])
+    def challenge_leaderboard(challenge_id):
+        """GET /api/challenges/<id>/leaderboard - Snapshot para quem entra depois"""
+        try:
+            limit = min(int(request.args.get('limit', TOP_N)), MAX_PAGE)
+            offset = max(int(request.args.get('offset', 0)), 0)
+            user_id = request.args.get('user_id')
+
+            board = manager.get(challenge_id)
+            if board is None:
+                return jsonify({'success': False, 'error': 'Desafio não encontrado'}), 404
+
+            return jsonify({
+                'success': True,
+                'challenge_id': challenge_id,
+                'version': board.version,
+                'participant_count': len(board),
+                'leaderboard': board.page(offset, limit),
+                'me': board.rank_of(user_id) if user_id else None
+            })
+
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
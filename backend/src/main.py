@@ -48,8 +48,16 @@ from werkzeug.utils import secure_filename
 from models import (
     User, Wallet, Transaction, Challenge,
     ChallengeParticipation, FitnessConnection, FitnessData,
-    Message, SessionLocal
+    ChallengeWinner, Message, SessionLocal
 )
+from fitness_rollup import record_fitness_data, get_activity_breakdown
+from challenge_progress import track_fitness_data, dispatch_progress_events
+from antifraud import score_fitness_records, is_trusted, REJECT_THRESHOLD
+from strava_streams import verify_strava_activity
+from strava_sync import sync_strava_connection, map_strava_type, StravaSyncError
+from token_manager import init_token_manager, TokenRefreshError
+from fitbit_webhook_queue import init_fitbit_webhook_queue
+from winner_selection import select_winners, count_qualified, min_score_for, max_winners_for, selection_type_for
 
 import sys
 sys.path.append(os.path.dirname(__file__))
@@ -63,11 +71,45 @@ except ImportError as e:
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 
 app = Flask(__name__)
-app.secret_key = os.getenv('SECRET_KEY', '1657victOr@')
+# Sem SECRET_KEY no ambiente, chave aleatória por processo (nunca uma chave fixa do repositório)
+app.secret_key = os.getenv('SECRET_KEY') or secrets.token_hex(32)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Tokens assinados e g.user resolvido uma vez por requisição (cache por token)
+from auth_context import init_auth_context, issue_token, authenticated_user, request_user, uses_token_auth, user_cache
+
+init_auth_context(app)
+
+# Compressão (br/gzip) e ETag/304 nas respostas
+from response_middleware import init_response_middleware, not_modified
+
+init_response_middleware(app)
+
+# JSON com orjson e serializers compilados por modelo (?fields= nas listas)
+from serializers import init_serializers, challenge_serializer, requested_fields
+
+init_serializers(app)
+
 # Configurar SocketIO para WebSocket do chat
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
+# Multi-nó: SOCKETIO_MESSAGE_QUEUE=redis://... | postgresql://... | local:///diretorio
+from socketio_backend import create_client_manager
+
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet',
+                    client_manager=create_client_manager())
+
+# Limite de requisições por usuário/IP (token bucket, consumo dividido entre nós)
+from rate_limit import init_rate_limiter, rate_limit, ip_only
+
+init_rate_limiter(socketio)
+
+# Atrás do proxy (Render): só os últimos TRUSTED_PROXY_HOPS saltos do X-Forwarded-For
+# são confiáveis; o ProxyFix põe o IP real em request.remote_addr (envolve também o Socket.IO)
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv('TRUSTED_PROXY_HOPS', '1')))
+
+# Invalidação do cache de tokens (bloqueio, troca de senha/email) em todos os nós
+user_cache.attach(getattr(socketio.server, 'manager', None))
 
 # Imports do MercadoPago
 import mercadopago
@@ -141,17 +183,30 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # ==================== INTEGRAÇÃO DO CHAT (REST + WEBSOCKET) ====================
 from chat_endpoints import register_chat_routes, setup_socketio_events
 
-# Registrar rotas REST do chat
-register_chat_routes(app)
+# Configurar eventos WebSocket (mensagens gravadas em lote pelo write-behind,
+# presença das salas sincronizada entre nós, digitação agregada por sala e
+# histórico recente enviado no join)
+from chat_write_buffer import init_chat_write_buffer
+from presence_service import init_presence_service, register_presence_routes
+from typing_service import init_typing_service
+from room_history import init_room_history
 
-# Configurar eventos WebSocket
-setup_socketio_events(socketio)
+room_history = init_room_history(socketio)
+chat_write_buffer = init_chat_write_buffer(socketio, history=room_history)
+presence_service = init_presence_service(socketio)
+typing_service = init_typing_service(socketio)
+register_presence_routes(app, presence_service)
+
+# Registrar rotas REST do chat (o envio REST também alimenta o histórico das salas)
+register_chat_routes(app, history=room_history)
+setup_socketio_events(socketio, chat_write_buffer, presence_service, typing_service, room_history)
 
 # ==================== INTEGRAÇÃO NOTIFICAÇÕES, LEADERBOARD, GAMIFICAÇÃO, ANALYTICS ====================
 from notification_service import init_notification_service, register_notification_routes
 from leaderboard_endpoints import register_leaderboard_routes
-from gamification import register_gamification_routes
+from gamification import register_gamification_routes, profile_cache
 from analytics_endpoints import register_analytics_routes
+from metrics import register_metrics_routes
 import threading
 
 # Inicializar serviço de notificações
@@ -159,12 +214,65 @@ notification_service = init_notification_service(socketio)
 register_notification_routes(app, notification_service)
 
 # Registrar outras rotas
+register_metrics_routes(app)
 register_leaderboard_routes(app)
 register_gamification_routes(app)
 register_analytics_routes(app)
 
+# Perfis de gamificação em cache: invalidação após commit vale para todos os nós
+profile_cache.attach(getattr(socketio.server, 'manager', None))
+
 print("[OK] Notificações, Leaderboard, Gamificação e Analytics integrados!")
 
+# ==================== PROGRESSO INCREMENTAL DE DESAFIOS ====================
+from challenge_progress import on_progress, get_challenge_progress
+
+@on_progress
+def emit_progress_event(event):
+    """Envia o progresso ao usuário em tempo real e notifica conclusões"""
+    socketio.emit('challenge_progress', event, room=f"user_{event['user_id']}")
+    if event['type'] == 'completed':
+        notification_service.notify_challenge_completed(event['user_id'], event['challenge_title'])
+
+# Level-ups e badges novos (gamificação dirigida por eventos de domínio)
+from gamification import on_gamification
+
+@on_gamification
+def emit_gamification_event(event):
+    """Avisa o usuário em tempo real sobre level-up e badges conquistados"""
+    socketio.emit('gamification', event, room=f"user_{event['user_id']}")
+    for badge in event['new_badges']:
+        notification_service.send_notification(
+            event['user_id'], 'badge_earned', 'Novo badge!', badge['name'], {'badge': badge['key']}
+        )
+    if event['level_up']:
+        notification_service.send_notification(
+            event['user_id'], 'level_up', 'Subiu de nível!', f"Você agora é {event['level']['name']}",
+            {'level': event['level']['key'], 'total_xp': event['total_xp']}
+        )
+
+# Ranking ao vivo por desafio, alimentado pelos mesmos eventos de progresso
+from live_leaderboard import init_live_leaderboard, register_live_leaderboard_routes
+
+live_leaderboard = init_live_leaderboard(socketio)
+register_live_leaderboard_routes(app, live_leaderboard)
+on_progress(live_leaderboard.handle_progress)
+
+@app.route('/api/challenges/<challenge_id>/progress', methods=['GET'])
+def challenge_progress(challenge_id):
+    """Progresso acumulado de todos os participantes de um desafio"""
+    session = SessionLocal()
+    try:
+        return jsonify({
+            'success': True,
+            'challenge_id': challenge_id,
+            'progress': get_challenge_progress(session, challenge_id)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        session.close()
+
 # Worker de notificações (cronjob)
 def notification_worker():
     """Verifica alertas de tempo a cada 1 minuto"""
@@ -613,16 +721,18 @@ def strava_callback():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/fitness/strava/sync', methods=['POST'])
+@rate_limit('strava_sync', 5, 900)
 def sync_strava_activities():
     """Sincronizar atividades do Strava e verificar desafios"""
     session = SessionLocal()
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         user_email = data.get('user_email')
         
-        user = session.query(User).filter_by(email=user_email).first()
-        if not user:
-            return jsonify({'error': 'Usu�rio n�o encontrado'}), 404
+        # Usu�rio do token (g.user); sem consulta a users por requisi��o
+        user, error = authenticated_user(user_email)
+        if error:
+            return error
         
         # Buscar conex�o Strava
         connection = session.query(FitnessConnection).filter_by(
@@ -634,77 +744,47 @@ def sync_strava_activities():
         if not connection:
             return jsonify({'error': 'Conex�o Strava n�o encontrada'}), 404
         
-        # Buscar atividades recentes do Strava
-        headers = {'Authorization': f'Bearer {connection.access_token}'}
-        strava_response = requests.get(
-            'https://www.strava.com/api/v3/athlete/activities',
-            headers=headers,
-            params={'per_page': 10}
-        )
-        
-        if strava_response.status_code != 200:
-            return jsonify({'error': 'Falha ao buscar atividades do Strava'}), 400
-        
-        activities = strava_response.json()
-        challenge_completions = []
-        
-        # Processar cada atividade
-        for activity in activities:
-            # Verificar se atividade j� foi processada
-            existing_data = session.query(FitnessData).filter_by(
-                user_id=user.id,
-                external_id=str(activity['id'])
+        # Importar tudo que veio depois do cursor da conex�o, p�gina a p�gina
+        def check_legacy_completions(session, records):
+            has_active = session.query(ChallengeParticipation.id).filter_by(
+                user_id=user.id, status='active'
             ).first()
-            
-            if existing_data:
-                continue
-            
-            # Criar registro de dados fitness
-            fitness_data = FitnessData(
-                id=str(uuid.uuid4()),
-                user_id=user.id,
-                connection_id=connection.id,
-                external_id=str(activity['id']),
-                data_type=map_strava_type(activity['type']),
-                value=activity['distance'] / 1000,  # Converter para km
-                unit='km',
-                start_time=datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00')),
-                end_time=datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00')) + 
-                        timedelta(seconds=activity['elapsed_time']),
-                source_app='strava',
-                raw_data=json.dumps(activity)
-            )
-            
-            session.add(fitness_data)
-            
-            # Verificar se completa algum desafio
-            completed_challenges = check_challenge_completion(session, user.id, fitness_data)
-            challenge_completions.extend(completed_challenges)
+            if not has_active:
+                return []
+            # Registros em revis�o pelo anti-fraude n�o completam desafios nem pagam pr�mios
+            return [
+                completion
+                for record in records if is_trusted(record)
+                for completion in check_challenge_completion(session, user.id, record)
+            ]
         
-        session.commit()
+        result = sync_strava_connection(
+            session, connection,
+            access_token=token_manager.get_access_token(connection),
+            on_new_records=check_legacy_completions
+        )
         
         return jsonify({
             'success': True,
-            'activities_processed': len([a for a in activities]),
-            'challenge_completions': challenge_completions
+            'activities_processed': result['new_activities'],
+            'pages': result['pages'],
+            'sync_cursor': result['cursor'],
+            'complete': result['complete'],
+            'challenge_completions': result['callback_results']
         })
         
+    except TokenRefreshError as e:
+        session.rollback()
+        return jsonify({'error': 'Token do Strava expirado, reconecte a conta', 'details': str(e)}), 401
+    except StravaSyncError as e:
+        session.rollback()
+        return jsonify({'error': 'Falha ao buscar atividades do Strava', 'details': str(e)}), 400
     except Exception as e:
         session.rollback()
         return jsonify({'error': str(e)}), 500
     finally:
         session.close()
 
-def map_strava_type(strava_type):
-    """Mapear tipos de atividade do Strava para tipos internos"""
-    mapping = {
-        'Run': 'running',
-        'Ride': 'cycling',
-        'Walk': 'walking',
-        'Swim': 'swimming',
-        'Workout': 'fitness'
-    }
-    return mapping.get(strava_type, 'fitness')
 
 def check_challenge_completion(session, user_id, fitness_data):
     """Verificar se uma atividade completa algum desafio"""
@@ -760,7 +840,9 @@ def get_fitness_connections(user_email):
         print(f"[SIGNAL] [GET_CONNECTIONS] Buscando para: {user_email}")
         
         # [OK] Buscar user_id primeiro
-        user = session_db.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session_db, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'success': False, 'error': 'Usu�rio n�o encontrado'}), 404
         
@@ -863,13 +945,11 @@ def process_strava_activity_webhook(athlete_id, activity_id):
         
         print(f"[OK] [WEBHOOK] Conex�o encontrada! Usu�rio: {connection.user_id}")
         
-        # Buscar detalhes da atividade espec�fica no Strava
-        headers = {'Authorization': f'Bearer {connection.access_token}'}
+        # Buscar detalhes da atividade espec�fica no Strava (token renovado se preciso)
         print(f"[WEB] [WEBHOOK] Buscando detalhes da atividade {activity_id}...")
         
-        activity_response = requests.get(
-            f'https://www.strava.com/api/v3/activities/{activity_id}',
-            headers=headers
+        activity_response = token_manager.authorized_get(
+            connection, f'https://www.strava.com/api/v3/activities/{activity_id}'
         )
         
         if activity_response.status_code != 200:
@@ -889,7 +969,7 @@ def process_strava_activity_webhook(athlete_id, activity_id):
         
         # Verificar se j� foi processada
         existing_data = session.query(FitnessData).filter_by(
-            user_id=connection.user_id,
+            connection_id=connection.id,
             external_id=str(activity_id)
         ).first()
         
@@ -914,13 +994,25 @@ def process_strava_activity_webhook(athlete_id, activity_id):
         )
         
         session.add(fitness_data)
-        print(f"[DB] [WEBHOOK] Dados de fitness salvos")
+        score_fitness_records(session, connection.user_id, [fitness_data])
+        
+        # Verifica��o opcional pelos streams GPS (corrige a dist�ncia e o score se necess�rio)
+        verify_strava_activity(session, fitness_data, token_manager.get_access_token(connection), activity_id)
+        record_fitness_data(session, [fitness_data])
+        print(f"[DB] [WEBHOOK] Dados de fitness salvos (confian�a {fitness_data.trust_score})")
         
         # [FAST] VERIFICAR DESAFIOS IMEDIATAMENTE [FAST]
         print(f"[TROPHY] [WEBHOOK] Verificando desafios para usu�rio {connection.user_id}...")
-        completed_challenges = check_challenge_completion_webhook(session, connection.user_id, fitness_data)
+        # Atividade em revis�o (anti-fraude ou streams GPS) n�o completa desafios nem paga pr�mios
+        if is_trusted(fitness_data):
+            completed_challenges = check_challenge_completion_webhook(session, connection.user_id, fitness_data)
+            progress_events = track_fitness_data(session, [fitness_data])
+        else:
+            print(f"[WARNING] [WEBHOOK] Atividade {activity_id} em revis�o: desafios n�o verificados")
+            completed_challenges, progress_events = [], []
         
         session.commit()
+        dispatch_progress_events(progress_events)
         
         # Notificar se completou algum desafio
         if completed_challenges:
@@ -1219,6 +1311,7 @@ def get_payments_config():
         }), 500
 
 @app.route('/api/payments/pix', methods=['POST', 'OPTIONS'])
+@rate_limit('payments', 10, 60)
 def create_pix_payment():
     """Criar pagamento PIX via MercadoPago Real"""
     if request.method == 'OPTIONS':
@@ -1250,8 +1343,13 @@ def create_pix_payment():
         # CORRE��O: Buscar usu�rio de forma mais flex�vel
         user = None
         
+        # Com token, o pagador � o usu�rio autenticado (user_id/user_email do corpo n�o valem)
+        if uses_token_auth():
+            user, error = request_user(session, user_email)
+            if error:
+                return error
         # Se user_id for 'current_user' ou similar, tentar buscar por email
-        if user_id == 'current_user' or str(user_id).startswith('temp_user_') or not user_id:
+        elif user_id == 'current_user' or str(user_id).startswith('temp_user_') or not user_id:
             if user_email:
                 user = session.query(User).filter_by(email=user_email).first()
                 print(f"[SEARCH] [PIX] Buscando por email: {user_email}, encontrado: {user is not None}")
@@ -1356,6 +1454,7 @@ def create_pix_payment():
 
 
 @app.route('/api/payments/card', methods=['POST', 'OPTIONS'])
+@rate_limit('payments', 10, 60)
 def create_card_payment():
     """Criar pagamento com Cart�o via MercadoPago - VERS�O DEBUG"""
     if request.method == 'OPTIONS':
@@ -1400,7 +1499,12 @@ def create_card_payment():
         user = None
         print(f"[SEARCH] [CARD] Iniciando busca do usu�rio...")
         
-        if user_id == 'current_user' or str(user_id).startswith('temp_user_') or not user_id:
+        # Com token, o pagador � o usu�rio autenticado (user_id/user_email do corpo n�o valem)
+        if uses_token_auth():
+            user, error = request_user(session, user_email)
+            if error:
+                return error
+        elif user_id == 'current_user' or str(user_id).startswith('temp_user_') or not user_id:
             print(f"[SEARCH] [CARD] Buscando usu�rio por email: {user_email}")
             if user_email:
                 try:
@@ -1945,6 +2049,7 @@ def complete_challenge_options(challenge_id):
 
 # <<< ATEN��O: A rota foi alterada para aceitar IDs de texto, como 'challenge_001' >>>
 @app.route('/api/challenges/<challenge_id>/join', methods=['POST'])
+@rate_limit('challenge_join', 10, 60)
 def join_challenge(challenge_id):
     """
     Endpoint para participar de um desafio - COM TAXA DIN�MICA
@@ -1961,7 +2066,9 @@ def join_challenge(challenge_id):
             return jsonify({'success': False, 'error': 'Email e valor da aposta v�lidos s�o obrigat�rios'}), 400
 
         # 1. Buscar usu�rio e carteira com SQLAlchemy
-        user = session.query(User).filter(User.email == user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'success': False, 'error': 'Usu�rio n�o encontrado'}), 404
         
@@ -2280,6 +2387,7 @@ def seed_database():
 # ==================== AUTHENTICATION ENDPOINTS ====================
 
 @app.route('/api/auth/register', methods=['POST'])
+@rate_limit('register', 5, 300, key=ip_only)
 def register():
     """Registro de usu�rio com persist�ncia real no banco"""
     session = SessionLocal()
@@ -2347,8 +2455,8 @@ def register():
         session.commit()
         print(f"[OK] [REGISTRO] Transa��o de b�nus adicionada")
         
-        # Gerar token de acesso
-        access_token = secrets.token_hex(16)
+        # Gerar token de acesso (assinado; validado pelo auth_context)
+        access_token = issue_token(user)
         
         # Resposta sem senha
         user_response = {
@@ -2388,6 +2496,7 @@ def register():
         session.close()
 
 @app.route('/api/auth/login', methods=['POST'])
+@rate_limit('login', 10, 60, key=ip_only)
 def login():
     """Login de usu�rio"""
     session = SessionLocal()
@@ -2422,8 +2531,8 @@ def login():
         user.last_login = datetime.utcnow()
         session.commit()
 
-        # Gerar token de acesso
-        access_token = secrets.token_hex(16)
+        # Gerar token de acesso (assinado; validado pelo auth_context)
+        access_token = issue_token(user)
 
         # Obter carteira
         wallet = session.query(Wallet).filter_by(user_id=user.id).first()
@@ -2476,11 +2585,11 @@ def get_wallet_by_email(email):
     try:
         print(f"[MONEY] [WALLET] Buscando carteira para: {email}")
         
-        # Buscar usu�rio por email
-        user = session.query(User).filter_by(email=email).first()
-        if not user:
-            print(f"[ERROR] [WALLET] Usu�rio n�o encontrado: {email}")
-            return jsonify({"error": "Usu�rio n�o encontrado"}), 404
+        # Usu�rio do token (g.user); o email da URL s� precisa conferir
+        user, error = authenticated_user(email)
+        if error:
+            print(f"[ERROR] [WALLET] Acesso negado para: {email}")
+            return error
         
         # Buscar carteira do usu�rio
         wallet = session.query(Wallet).filter_by(user_id=user.id).first()
@@ -2560,7 +2669,9 @@ def get_wallet_balance():
         print(f"[MONEY] [BALANCE] Buscando saldo para: {email}")
         
         # Buscar usu�rio
-        user = session.query(User).filter_by(email=email).first()
+        user, error = request_user(session, email)
+        if error:
+            return error
         if not user:
             return jsonify({"error": "Usu�rio n�o encontrado"}), 404
         
@@ -2597,13 +2708,14 @@ def get_user_profile():
     session = SessionLocal()
     try:
         email = request.args.get('email')
-        if not email:
-            return jsonify({"error": "Email � obrigat�rio"}), 400
-            
+
         print(f"[USER] [PROFILE] Buscando perfil para: {email}")
         
-        # Buscar usu�rio
-        user = session.query(User).filter_by(email=email).first()
+        # Usu�rio do token (g.user); email s� � usado sem token (modo legado)
+        auth_user, error = authenticated_user(email)
+        if error:
+            return error
+        user = session.get(User, auth_user.id)
         if not user:
             print(f"[ERROR] [PROFILE] Usu�rio n�o encontrado: {email}")
             return jsonify({"error": "Usu�rio n�o encontrado"}), 404
@@ -2659,7 +2771,9 @@ def test_user_api(email):
         print(f"[FIST] [TEST] Test User API para: {email}")
         
         # Buscar usu�rio real
-        user = session.query(User).filter_by(email=email).first()
+        user, error = request_user(session, email)
+        if error:
+            return error
         if not user:
             print(f"[ERROR] [TEST] Usu�rio n�o encontrado: {email}")
             return jsonify({"error": "Usu�rio n�o encontrado"}), 404
@@ -2745,7 +2859,9 @@ def connect_test_device():
         print(f"[FIST] [FITNESS-TEST] Conectando dispositivo teste para: {user_email}")
         
         # Verificar se usu�rio existe
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usu�rio n�o encontrado'}), 404
         
@@ -2821,7 +2937,9 @@ def register_mock_activity():
         
         print(f"[RUN] [FITNESS-MOCK] Registrando atividade mock para: {user_email}")
         
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usu�rio n�o encontrado'}), 404
         
@@ -2846,6 +2964,7 @@ def register_mock_activity():
             raw_data=json.dumps(data)
         )
         session.add(fitness_data)
+        record_fitness_data(session, [fitness_data])
         
         connection.last_sync = datetime.utcnow()
         print(f"[OK] [FITNESS-MOCK] Atividade registrada: {activity_type} - {distance}km em {duration}min")
@@ -2913,8 +3032,12 @@ def register_mock_activity():
                 else:
                     print(f"[WARNING] [WALLET] Carteira n�o encontrada para {user_email}. Pr�mio n�o atribu�do.")
 
+        # Progresso incremental dos desafios cumulativos
+        progress_events = track_fitness_data(session, [fitness_data])
+
         # 7. Fazer commit de todas as altera��es no final
         session.commit()
+        dispatch_progress_events(progress_events)
         
         return jsonify({
             'success': True,
@@ -2956,7 +3079,9 @@ def disconnect_fitness_device():
         print(f"[PLUG] [FITNESS-DISCONNECT] Desconectando {platform} para: {user_email}")
         
         # Verificar se usu�rio existe
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usu�rio n�o encontrado'}), 404
         
@@ -3001,17 +3126,14 @@ def get_fitness_stats(user_email):
         print(f"[CHART] [FITNESS-STATS] Buscando estat�sticas para: {user_email}")
         
         # Verificar se usu�rio existe
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usu�rio n�o encontrado'}), 404
         
-        # Contar atividades por tipo
-        from sqlalchemy import func
-        activity_stats = session.query(
-            FitnessData.data_type,
-            func.count(FitnessData.id).label('count'),
-            func.sum(FitnessData.value).label('total_distance')
-        ).filter_by(user_id=user.id).group_by(FitnessData.data_type).all()
+        # Contar atividades por tipo (rollup di�rio, O(dias))
+        activity_breakdown = get_activity_breakdown(session, user.id)
         
         # Contar conex�es ativas
         active_connections = session.query(FitnessConnection).filter_by(
@@ -3019,15 +3141,6 @@ def get_fitness_stats(user_email):
             is_active=True
         ).count()
         
-        # Converter resultados
-        activity_breakdown = []
-        for stat in activity_stats:
-            activity_breakdown.append({
-                'activity_type': stat.data_type,
-                'count': stat.count,
-                'total_distance': float(stat.total_distance or 0.0)
-            })
-        
         stats_data = {
             'success': True,
             'stats': {
@@ -3066,7 +3179,9 @@ def connect_fitness_app():
             return jsonify({'error': 'user_email e platform s�o obrigat�rios'}), 400
 
         print(f"[PHONE] [FITNESS] App m�vel solicitando conex�o para {user_email} via {platform}")
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usu�rio n�o encontrado'}), 404
 
@@ -3114,7 +3229,9 @@ def link_healthkit():
             return jsonify({'error': 'user_email � obrigat�rio'}), 400
         
         # Verificar se usu�rio existe
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usu�rio n�o encontrado'}), 404
         
@@ -3302,6 +3419,7 @@ def complete_challenge_automatically(session, challenge, participation, fitness_
         raise e
 
 @app.route('/api/fitness/data', methods=['POST'])
+@rate_limit('fitness_data', 120, 60)
 def receive_fitness_data():
     """
     Endpoint para o APLICATIVO M�VEL enviar os dados coletados do HealthKit,
@@ -3316,7 +3434,9 @@ def receive_fitness_data():
         if not user_email or not fitness_data_list:
             return jsonify({'error': 'user_email e uma lista de dados s�o obrigat�rios'}), 400
 
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usu�rio n�o encontrado'}), 404
 
@@ -3324,18 +3444,10 @@ def receive_fitness_data():
         if not connection:
             return jsonify({'error': 'Nenhuma conex�o ativa com apple_health encontrada para este usu�rio'}), 404
         
-        processed_count = 0
+        candidates = []
         for item in fitness_data_list:
             # O app m�vel deve enviar os metadados dentro de 'raw_data'
-            raw_data_str = json.dumps(item.get('raw_data', {}))
-            trust_score = calculate_trust_score(raw_data_str)
-            
-            # Voc� pode decidir n�o salvar dados com score muito baixo
-            if trust_score < 0.2:
-                print(f"[WARNING] [ANTI-FRAUDE] Dado descartado para {user_email} por baixo score de confian�a ({trust_score}). Fonte manual.")
-                continue
-
-            fitness_record = FitnessData(
+            candidates.append(FitnessData(
                 user_id=user.id,
                 connection_id=connection.id,
                 data_type=item.get('type'),
@@ -3345,14 +3457,29 @@ def receive_fitness_data():
                 end_time=datetime.fromisoformat(item.get('end_time')),
                 source_app=item.get('source_app'),
                 device_info=json.dumps(item.get('device_info', {})),
-                raw_data=raw_data_str
-            )
+                raw_data=json.dumps(item.get('raw_data', {}))
+            ))
+        
+        # Score anti-fraude do lote inteiro de uma vez
+        score_fitness_records(session, user.id, candidates)
+        
+        new_records = []
+        for fitness_record in candidates:
+            # Descartar dados com score muito baixo
+            if fitness_record.trust_score < REJECT_THRESHOLD:
+                print(f"[WARNING] [ANTI-FRAUDE] Dado descartado para {user_email} por baixo score de confian�a ({fitness_record.trust_score}): {fitness_record.fraud_reasons}")
+                continue
             session.add(fitness_record)
-            processed_count += 1
+            new_records.append(fitness_record)
+        processed_count = len(new_records)
         
         # Atualiza a data da �ltima sincroniza��o
         connection.last_sync = datetime.utcnow()
+        record_fitness_data(session, new_records)
+        # Registros em revis�o n�o contam para desafios
+        progress_events = track_fitness_data(session, [r for r in new_records if is_trusted(r)])
         session.commit()
+        dispatch_progress_events(progress_events)
         
         print(f"[OK] [FITNESS] {processed_count} registros de dados de fitness salvos para {user_email}")
         
@@ -3410,26 +3537,34 @@ def validate_activity():
         if not activity:
             return jsonify({'error': 'Atividade não encontrada'}), 404
 
+        # Registros antigos ainda sem score anti-fraude
+        if activity.trust_score is None:
+            score_fitness_records(session, user_id, [activity])
+
         # Validar critérios do desafio
         target_value = float(challenge.target_value or 0)
         achieved_value = float(activity.value or 0)
-
-        # Calcular score de validação
-        score = min(100, int((achieved_value / target_value) * 100)) if target_value > 0 else 0
-        is_valid = achieved_value >= target_value
+        fraud_reasons = activity.fraud_reasons.split(',') if activity.fraud_reasons else []
 
         # Critérios detalhados
         criteria_met = {
             'distance': achieved_value >= target_value if challenge.target_metric == 'distance' else True,
             'time_window': True,  # Verificar se atividade está no período do desafio
-            'device_verified': activity.source_app != 'manual_entry'
+            'device_verified': 'manual_entry' not in fraud_reasons,
+            'trusted': is_trusted(activity)
         }
 
+        # Calcular score de validação
+        score = min(100, int((achieved_value / target_value) * 100)) if target_value > 0 else 0
+        is_valid = achieved_value >= target_value and criteria_met['trusted']
+
         validation_result = {
             'valid': is_valid,
             'score': score,
             'message': f'Meta {"atingida" if is_valid else "não atingida"}! {achieved_value:.1f}/{target_value} {challenge.target_unit}',
             'criteria_met': criteria_met,
+            'trust_score': activity.trust_score,
+            'fraud_reasons': fraud_reasons,
             'achieved_value': achieved_value,
             'target_value': target_value
         }
@@ -3438,12 +3573,13 @@ def validate_activity():
         if is_valid:
             participation.result_value = achieved_value
             participation.status = 'completed'
-            participation.completed_at = datetime.datetime.utcnow()
+            participation.completed_at = datetime.utcnow()
             participation.validation_status = 'validated'
-            session.commit()
-
             print(f"[OK] [VALIDATION] Desafio {challenge_id} completado por {user_id}")
 
+        # Grava a participação e o score anti-fraude calculado acima
+        session.commit()
+
         return jsonify({
             'success': True,
             'validation': validation_result
@@ -3506,7 +3642,9 @@ def get_fitness_connections(user_email):
     session = SessionLocal()
     try:
         # Buscar usuário
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usuário não encontrado'}), 404
 
@@ -3546,7 +3684,8 @@ def get_fitness_connections(user_email):
 def finalize_challenge(challenge_id):
     """
     Finaliza um desafio e distribui prêmios para os vencedores.
-    Calcula vencedores baseado em winner_type (top_n, all_qualifiers, equal_split).
+    Vencedores selecionados no banco conforme winner_selection_type
+    (first_to_complete, top_performers, all_qualifiers).
     """
     session = SessionLocal()
     try:
@@ -3558,13 +3697,7 @@ def finalize_challenge(challenge_id):
         if challenge.status == 'completed':
             return jsonify({'error': 'Desafio já foi finalizado'}), 400
 
-        # Buscar todas as participações completadas
-        completed_participations = session.query(ChallengeParticipation).filter_by(
-            challenge_id=challenge_id,
-            status='completed'
-        ).order_by(ChallengeParticipation.result_value.desc()).all()
-
-        if not completed_participations:
+        if count_qualified(session, challenge) == 0:
             return jsonify({'error': 'Nenhum participante completou este desafio'}), 400
 
         # Calcular pool de prêmios (total apostado - taxa da plataforma)
@@ -3573,96 +3706,22 @@ def finalize_challenge(challenge_id):
         platform_fee_amount = total_pool * (platform_fee_percent / 100)
         prize_pool = total_pool - platform_fee_amount
 
-        # Determinar vencedores baseado no winner_type
-        winner_type = challenge.winner_type or 'top_n'
-        winners = []
-
-        if winner_type == 'top_n':
-            # Top N vencedores (ex: Top 3)
-            top_n = int(challenge.winner_count or 1)
-            winners = completed_participations[:top_n]
-
-            # Distribuição: 1º lugar 50%, 2º lugar 30%, 3º lugar 20%
-            prize_distribution = [0.5, 0.3, 0.2]
-
-            for idx, participation in enumerate(winners):
-                if idx < len(prize_distribution):
-                    prize_amount = prize_pool * prize_distribution[idx]
-                else:
-                    prize_amount = 0
-
-                # Adicionar prêmio à carteira do usuário
-                user_wallet = session.query(Wallet).filter_by(user_id=participation.user_id).first()
-                if user_wallet:
-                    user_wallet.balance += prize_amount
-
-                    # Criar transação de prêmio
-                    transaction = Transaction(
-                        user_id=participation.user_id,
-                        wallet_id=user_wallet.id,
-                        type='prize',
-                        amount=prize_amount,
-                        status='completed',
-                        description=f'Prêmio do desafio: {challenge.title} (Posição {idx + 1})'
-                    )
-                    session.add(transaction)
-
-                    print(f"[OK] [PRIZE] R$ {prize_amount:.2f} creditado para usuário {participation.user_id} (Posição {idx + 1})")
-
-        elif winner_type == 'all_qualifiers':
-            # Todos que completaram dividem o prêmio
-            winners = completed_participations
-            prize_per_winner = prize_pool / len(winners)
-
-            for participation in winners:
-                user_wallet = session.query(Wallet).filter_by(user_id=participation.user_id).first()
-                if user_wallet:
-                    user_wallet.balance += prize_per_winner
-
-                    transaction = Transaction(
-                        user_id=participation.user_id,
-                        wallet_id=user_wallet.id,
-                        type='prize',
-                        amount=prize_per_winner,
-                        status='completed',
-                        description=f'Prêmio do desafio: {challenge.title} (Divisão igual)'
-                    )
-                    session.add(transaction)
-
-                    print(f"[OK] [PRIZE] R$ {prize_per_winner:.2f} creditado para usuário {participation.user_id}")
-
-        elif winner_type == 'equal_split':
-            # Dividir igualmente entre todos os vencedores
-            winners = completed_participations
-            prize_per_winner = prize_pool / len(winners)
-
-            for participation in winners:
-                user_wallet = session.query(Wallet).filter_by(user_id=participation.user_id).first()
-                if user_wallet:
-                    user_wallet.balance += prize_per_winner
-
-                    transaction = Transaction(
-                        user_id=participation.user_id,
-                        wallet_id=user_wallet.id,
-                        type='prize',
-                        amount=prize_per_winner,
-                        status='completed',
-                        description=f'Prêmio do desafio: {challenge.title}'
-                    )
-                    session.add(transaction)
+        # Determinar vencedores e distribuir prêmios
+        distribution = award_challenge_prizes(session, challenge, prize_pool)
 
         # Atualizar status do desafio
         challenge.status = 'completed'
-        challenge.updated_at = datetime.datetime.utcnow()
+        challenge.updated_at = datetime.utcnow()
 
         session.commit()
 
-        print(f"[OK] [FINALIZE] Desafio {challenge_id} finalizado com {len(winners)} vencedores")
+        print(f"[OK] [FINALIZE] Desafio {challenge_id} finalizado com {len(distribution)} vencedores")
 
         return jsonify({
             'success': True,
             'message': f'Desafio finalizado com sucesso',
-            'winners_count': len(winners),
+            'winners_count': len(distribution),
+            'selection_type': selection_type_for(challenge),
             'prize_pool': prize_pool,
             'platform_fee': platform_fee_amount
         }), 200
@@ -3715,10 +3774,23 @@ def get_challenges():
 
         print(f"[LINK] [CHALLENGES] Mapeamento din�mico: {category_string_to_id}")
 
+        # Carimbo de versão: se o cliente já tem esta lista, 304 sem carregar os desafios
+        listed = Challenge.status.in_(['active', 'pending'])
+        total, last_update = session.query(func.count(Challenge.id), func.max(Challenge.updated_at)).filter(listed).one()
+        cached = not_modified(f"{total}|{last_update}|{sorted(categories_data.items())}")
+        if cached:
+            return cached
+
         # 3. BUSCAR DESAFIOS ATIVOS E PENDENTES (MUDAN�A PRINCIPAL)
-        all_challenges = session.query(Challenge).filter(
-            Challenge.status.in_(['active', 'pending'])
-        ).order_by(Challenge.created_at.desc()).all()
+        # ?fields=a,b,c: s� as colunas pedidas (mais as usadas nos campos de categoria/status)
+        fields = requested_fields()
+        query = session.query(Challenge).filter(listed)
+        load = challenge_serializer.load_options(
+            fields, always=('id', 'category', 'status', 'current_participants', 'created_at')
+        )
+        if load is not None:
+            query = query.options(load)
+        all_challenges = query.order_by(Challenge.created_at.desc()).all()
 
         if not all_challenges:
             print("[WARNING] [CHALLENGES] Nenhum desafio encontrado no banco de dados.")
@@ -3729,17 +3801,17 @@ def get_challenges():
             })
 
         # 4. PROCESSAR DESAFIOS COM CATEGORIAS DIN�MICAS
-        challenges_data = []
-        for challenge in all_challenges:
-            challenge_dict = challenge.to_dict()
-            
+        challenges_data = challenge_serializer.dump_many(all_challenges, fields)
+        for challenge, challenge_dict in zip(all_challenges, challenges_data):
+            extra = {}
+
             # Mapear categoria string para dados reais da categoria
-            original_category = challenge_dict.get('category', 'fitness')
+            original_category = challenge.category or 'fitness'
             category_id = category_string_to_id.get(original_category)
             
             if category_id and category_id in categories_data:
                 category_info = categories_data[category_id]
-                challenge_dict.update({
+                extra.update({
                     'category_name': category_info['name'],
                     'category_color': category_info['color'],
                     'category_icon': category_info['icon'],
@@ -3747,7 +3819,7 @@ def get_challenges():
                 })
             else:
                 # Fallback se n�o encontrar mapeamento
-                challenge_dict.update({
+                extra.update({
                     'category_name': original_category.title(),
                     'category_color': '#3b82f6',
                     'category_icon': 'trophy',
@@ -3755,25 +3827,27 @@ def get_challenges():
                 })
             
             # Adicionar campos de compatibilidade
-            challenge_dict['participant_count'] = challenge_dict.get('current_participants', 0)
+            extra['participant_count'] = challenge.current_participants
             
             # NOVOS CAMPOS PARA DESAFIOS PENDENTES
-            status = challenge_dict.get('status', 'active')
-            challenge_dict.update({
+            status = challenge.status
+            extra.update({
                 'is_scheduled': status == 'pending',
                 'can_join': status == 'active', 
                 'status_label': 'Agendado' if status == 'pending' else 'Ativo',
                 'is_pending': status == 'pending',
                 'is_active': status == 'active'
             })
-            
-            challenges_data.append(challenge_dict)
+
+            if fields:
+                extra = {key: value for key, value in extra.items() if key in fields}
+            challenge_dict.update(extra)
 
         # Debug do mapeamento
         print("[BUILDING] [CHALLENGES DEBUG] Mapeamento din�mico aplicado:")
         for challenge in challenges_data[:3]:
             status_info = f"({challenge.get('status_label', 'N/A')})"
-            print(f"   - {challenge['title']}: {challenge['category']} -> {challenge.get('category_name', 'N/A')} {status_info}")
+            print(f"   - {challenge.get('title')}: {challenge.get('category')} -> {challenge.get('category_name', 'N/A')} {status_info}")
 
         print(f"[OK] [CHALLENGES] {len(challenges_data)} desafios processados com categorias din�micas.")
         return jsonify({
@@ -4002,7 +4076,9 @@ def get_user_participations():
         print(f"[TARGET] [PARTICIPATIONS] Buscando participa��es para: {user_email}")
         
         # Buscar usu�rio por email
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             print(f"[ERROR] [PARTICIPATIONS] Usu�rio n�o encontrado: {user_email}")
             return jsonify({
@@ -4194,65 +4270,69 @@ def calculate_prize_distribution(total_prize_pool, winners_data, distribution_ty
     
     return distribution
 
-# 4. FUN��O PARA DETERMINAR VENCEDORES
-def determine_challenge_winners(challenge, completed_participations):
-    """Determina quem s�o os vencedores baseado na configura��o do desafio"""
-    max_winners = getattr(challenge, 'max_winners', 1) or 1
-    selection_type = getattr(challenge, 'winner_selection_type', 'first_to_complete') or 'first_to_complete'
-    
-    min_score_required = 80
-    qualified_participations = [
-        p for p in completed_participations 
-        if (p.result_value or 0) >= min_score_required
-    ]
-    
-    if not qualified_participations:
+# 4. FUN��O PARA PREMIAR VENCEDORES (compartilhada por complete e finalize)
+def award_challenge_prizes(session, challenge, prize_pool):
+    """Seleciona os vencedores no banco, credita os pr�mios e registra em challenge_winners"""
+    winners = select_winners(session, challenge)
+    if not winners or prize_pool <= 0:
         return []
-    
-    winners = []
-    
-    if selection_type == 'first_to_complete':
-        sorted_by_completion = sorted(
-            qualified_participations, 
-            key=lambda x: x.completed_at or datetime.utcnow()
-        )
-        
-        for i, participation in enumerate(sorted_by_completion[:max_winners]):
-            winners.append({
-                'user_id': participation.user_id,
-                'participation_id': participation.id,
-                'position': i + 1,
-                'result_value': participation.result_value or 0,
-                'completed_at': participation.completed_at
-            })
-    
-    elif selection_type == 'top_performers':
-        sorted_by_performance = sorted(
-            qualified_participations,
-            key=lambda x: x.result_value or 0,
-            reverse=True
-        )
-        
-        for i, participation in enumerate(sorted_by_performance[:max_winners]):
-            winners.append({
-                'user_id': participation.user_id,
-                'participation_id': participation.id,
-                'position': i + 1,
-                'result_value': participation.result_value or 0,
-                'completed_at': participation.completed_at
-            })
-    
-    elif selection_type == 'all_qualifiers':
-        for i, participation in enumerate(qualified_participations[:max_winners]):
-            winners.append({
-                'user_id': participation.user_id,
-                'participation_id': participation.id,
-                'position': i + 1,
-                'result_value': participation.result_value or 0,
-                'completed_at': participation.completed_at
-            })
-    
-    return winners
+
+    distribution_type = getattr(challenge, 'prize_distribution_type', 'equal') or 'equal'
+    distribution = calculate_prize_distribution(prize_pool, winners, distribution_type)
+    winners_by_user = {w['user_id']: w for w in winners}
+
+    print(f"[TROPHY] [PRIZES] {len(winners)} vencedores, distribui��o: {distribution_type}")
+
+    wallets = {
+        w.user_id: w for w in session.query(Wallet).filter(Wallet.user_id.in_(list(winners_by_user))).all()
+    }
+    participations = {
+        p.id: p for p in session.query(ChallengeParticipation).filter(
+            ChallengeParticipation.id.in_([w['participation_id'] for w in winners])
+        ).all()
+    }
+
+    for dist in distribution:
+        winner = winners_by_user[dist['user_id']]
+        prize_amount = dist['prize_amount']
+
+        winner_wallet = wallets.get(dist['user_id'])
+        if not winner_wallet:
+            print(f"[WARNING] [PRIZES] Carteira n�o encontrada para {dist['user_id']}. Pr�mio n�o atribu�do.")
+            continue
+
+        winner_wallet.balance = float(winner_wallet.balance or 0.0) + prize_amount
+        winner_wallet.available = float(winner_wallet.available or 0.0) + prize_amount
+        winner_wallet.updated_at = datetime.utcnow()
+
+        session.add(Transaction(
+            id=str(uuid.uuid4()),
+            user_id=dist['user_id'],
+            type='prize',
+            amount=prize_amount,
+            description=f'Pr�mio - Posi��o {dist["position"]}o - {challenge.title} ({dist["prize_percentage"]}% do pool)',
+            status='completed'
+        ))
+
+        session.add(ChallengeWinner(
+            challenge_id=challenge.id,
+            user_id=dist['user_id'],
+            participation_id=winner['participation_id'],
+            position=dist['position'],
+            result_value=dist['result_value'],
+            prize_amount=prize_amount,
+            prize_percentage=dist['prize_percentage'],
+            completed_at=winner['completed_at'] or datetime.utcnow()
+        ))
+
+        winner_participation = participations.get(winner['participation_id'])
+        if winner_participation:
+            winner_participation.final_position = dist['position']
+            winner_participation.is_winner = True
+
+        print(f"[MONEY] [PRIZES] Vencedor {dist['position']}o: R$ {prize_amount:.2f}")
+
+    return distribution
 
 
 # 5. SUBSTITUIR FUN��O complete_challenge EXISTENTE
@@ -4272,7 +4352,9 @@ def complete_challenge(challenge_id):
         if not user_email:
             return jsonify({'error': 'Email do usu�rio � obrigat�rio'}), 400
         
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usu�rio n�o encontrado'}), 404
         
@@ -4298,8 +4380,7 @@ def complete_challenge(challenge_id):
         participation.result_value = result_value
         participation.completed_at = datetime.utcnow()
         
-        min_score_required = 80
-        is_qualified = result_value >= min_score_required
+        is_qualified = result_value >= min_score_for(challenge)
         
         if hasattr(participation, 'is_winner'):
             participation.is_winner = is_qualified
@@ -4314,23 +4395,18 @@ def complete_challenge(challenge_id):
             status='active'
         ).count()
         
-        completed_participations = session.query(ChallengeParticipation).filter_by(
-            challenge_id=challenge_id,
-            status='completed'
-        ).all()
-        
-        max_winners = getattr(challenge, 'max_winners', 1) or 1
-        selection_type = getattr(challenge, 'winner_selection_type', 'first_to_complete') or 'first_to_complete'
-        qualified_completed = [p for p in completed_participations if (p.result_value or 0) >= min_score_required]
+        max_winners = max_winners_for(challenge)
+        selection_type = selection_type_for(challenge)
+        qualified_count = count_qualified(session, challenge)
         
-        print(f"[CHART] [COMPLETE-MULTI] Status: {remaining_active} ativas, {len(qualified_completed)} qualificadas, max {max_winners}")
+        print(f"[CHART] [COMPLETE-MULTI] Status: {remaining_active} ativas, {qualified_count} qualificadas, max {max_winners}")
         
         # CONDI��ES PARA FINALIZAR
         should_finalize = False
         finalize_reason = ""
         
         if selection_type == 'first_to_complete':
-            if len(qualified_completed) >= max_winners:
+            if qualified_count >= max_winners:
                 should_finalize = True
                 finalize_reason = f"Atingiu {max_winners} vencedores qualificados"
         else:
@@ -4358,77 +4434,10 @@ def complete_challenge(challenge_id):
             
             print(f"[MONEY] [COMPLETE-MULTI] Pool: R$ {total_pool:.2f}, Taxa: {house_percentage}%, Pr�mios: R$ {prize_pool:.2f}")
             
-            # DETERMINAR VENCEDORES
-            winners = determine_challenge_winners(challenge, completed_participations)
-            
-            if winners and prize_pool > 0:
-                distribution_type = getattr(challenge, 'prize_distribution_type', 'equal') or 'equal'
-                distribution = calculate_prize_distribution(prize_pool, winners, distribution_type)
-                
-                print(f"[TROPHY] [COMPLETE-MULTI] {len(winners)} vencedores, distribui��o: {distribution_type}")
-                
-                # DISTRIBUIR PR�MIOS
-                for dist in distribution:
-                    winner_user_id = dist['user_id']
-                    prize_amount = dist['prize_amount']
-                    
-                    winner_wallet = session.query(Wallet).filter_by(user_id=winner_user_id).first()
-                    if winner_wallet:
-                        winner_wallet.balance = float(winner_wallet.balance or 0.0) + prize_amount
-                        winner_wallet.available = float(winner_wallet.available or 0.0) + prize_amount
-                        winner_wallet.updated_at = datetime.utcnow()
-                        
-                        prize_transaction = Transaction(
-                            id=str(uuid.uuid4()),
-                            user_id=winner_user_id,
-                            type='prize',
-                            amount=prize_amount,
-                            description=f'Pr�mio - Posi��o {dist["position"]}o - {challenge.title} ({dist["prize_percentage"]}% do pool)',
-                            status='completed'
-                        )
-                        session.add(prize_transaction)
-                        
-                        # REGISTRAR VENCEDOR NA TABELA challenge_winners
-                        try:
-                            challenge_winner = {
-                                'id': str(uuid.uuid4()),
-                                'challenge_id': challenge_id,
-                                'user_id': winner_user_id,
-                                'participation_id': next(w['participation_id'] for w in winners if w['user_id'] == winner_user_id),
-                                'position': dist['position'],
-                                'result_value': dist['result_value'],
-                                'prize_amount': prize_amount,
-                                'prize_percentage': dist['prize_percentage'],
-                                'completed_at': datetime.utcnow().isoformat()
-                            }
-                            
-                            session.execute(text("""
-                                INSERT INTO challenge_winners 
-                                (id, challenge_id, user_id, participation_id, position, result_value, prize_amount, prize_percentage, completed_at)
-                                VALUES 
-                                (:id, :challenge_id, :user_id, :participation_id, :position, :result_value, :prize_amount, :prize_percentage, :completed_at)
-                            """), challenge_winner)
-                            
-                        except Exception as e:
-                            print(f"[WARNING] [COMPLETE-MULTI] Erro ao registrar vencedor na tabela: {e}")
-                        
-                        # ATUALIZAR PARTICIPA��O
-                        winner_participation = session.query(ChallengeParticipation).filter_by(
-                            challenge_id=challenge_id,
-                            user_id=winner_user_id
-                        ).first()
-                        if winner_participation and hasattr(winner_participation, 'final_position'):
-                            winner_participation.final_position = dist['position']
-                            winner_participation.is_winner = True
-                        
-                        total_prize_awarded += prize_amount
-                        
-                        if winner_user_id == user.id:
-                            user_prize = prize_amount
-                        
-                        print(f"[MONEY] [COMPLETE-MULTI] Vencedor {dist['position']}o: R$ {prize_amount:.2f}")
-                
-                distribution_result = distribution
+            # DETERMINAR VENCEDORES E DISTRIBUIR PR�MIOS
+            distribution_result = award_challenge_prizes(session, challenge, prize_pool)
+            total_prize_awarded = sum(d['prize_amount'] for d in distribution_result)
+            user_prize = next((d['prize_amount'] for d in distribution_result if d['user_id'] == user.id), 0)
             
             # REGISTRAR TAXA DA CASA
             if house_fee > 0:
@@ -4437,7 +4446,7 @@ def complete_challenge(challenge_id):
                     user_id=None,
                     type='house_revenue',
                     amount=house_fee,
-                    description=f'Taxa da casa ({house_percentage}%) - {challenge.title} - {len(winners)} vencedores',
+                    description=f'Taxa da casa ({house_percentage}%) - {challenge.title} - {len(distribution_result)} vencedores',
                     status='completed',
                     admin_id='system'
                 )
@@ -4590,13 +4599,14 @@ def get_user_bets():
     session = SessionLocal()
     try:
         user_email = request.args.get('email')
-        if not user_email:
-            return jsonify({'error': 'Email � obrigat�rio'}), 400
         
         print(f"[CHART] [BETS] Buscando hist�rico de apostas para: {user_email}")
         
-        # Buscar usu�rio
-        user = session.query(User).filter_by(email=user_email).first()
+        # Usu�rio do token (g.user); email s� � usado sem token (modo legado)
+        auth_user, error = authenticated_user(user_email)
+        if error:
+            return error
+        user = session.get(User, auth_user.id)
         if not user:
             return jsonify({'error': 'Usu�rio n�o encontrado'}), 404
         
@@ -6809,6 +6819,15 @@ if not FITBIT_REDIRECT_URI.startswith('https://'):
     print(f"   URI atual: {FITBIT_REDIRECT_URI}")
 
 FITBIT_WEBHOOK_VERIFY_CODE = os.getenv('FITBIT_WEBHOOK_VERIFY_CODE', 'betfit_secret_2025')
+
+# Renova��o autom�tica dos tokens Strava/Fitbit (worker em background + cache em mem�ria)
+token_manager = init_token_manager(fitbit_credentials=(FITBIT_CLIENT_ID, FITBIT_CLIENT_SECRET))
+print("[OK] [TOKENS] Gerenciador de tokens OAuth iniciado")
+
+# Notifica��es do webhook Fitbit agrupadas por (ownerId, data) com debounce
+fitbit_queue = init_fitbit_webhook_queue(token_manager)
+print("[OK] [FITBIT] Fila de notifica��es do webhook iniciada")
+
 @app.route('/api/fitbit/connect', methods=['GET'])
 def fitbit_connect():
     """Gera URL de autoriza��o Fitbit"""
@@ -6917,7 +6936,6 @@ def fitbit_webhook():
         return '', 404
     
     elif request.method == 'POST':
-        session_db = SessionLocal()
         try:
             # Verificar assinatura
             signature = request.headers.get('X-Fitbit-Signature')
@@ -6936,28 +6954,9 @@ def fitbit_webhook():
             notifications = request.json
             print(f"[MAILBOX] [FITBIT] {len(notifications)} notifica��es recebidas")
             
-            for notification in notifications:
-                owner_id = notification['ownerId']
-                collection_type = notification['collectionType']
-                date = notification['date']
-                
-                print(f"[BELL] [FITBIT] Notifica��o: {owner_id} - {collection_type} - {date}")
-                
-                # Buscar usu�rio Fitbit
-                fitbit_user = session_db.query(FitbitUser).filter_by(
-                    fitbit_user_id=owner_id
-                ).first()
-                
-                if not fitbit_user:
-                    print(f"[WARNING] [FITBIT] Usu�rio Fitbit n�o encontrado: {owner_id}")
-                    continue
-                
-                # Processar atividades
-                if collection_type == 'activities':
-                    fetch_and_save_fitbit_activities(fitbit_user, date, session_db)
-                    
-                    # Verificar desafios
-                    check_fitbit_challenges(session_db, fitbit_user.user_id)
+            # Apenas enfileira: as notifica��es s�o agrupadas por (ownerId, data) e
+            # processadas em lote pelo worker ap�s a janela de debounce
+            fitbit_queue.enqueue(notifications)
             
             return '', 204
             
@@ -6966,15 +6965,13 @@ def fitbit_webhook():
             import traceback
             traceback.print_exc()
             return jsonify({'error': str(e)}), 500
-        finally:
-            session_db.close()
 
 # Fun��es auxiliares Fitbit
 def create_fitbit_subscription(fitbit_user, session_db):
     """Cria subscription para receber webhooks"""
     try:
         url = f'https://api.fitbit.com/1/user/-/activities/apiSubscriptions/{fitbit_user.fitbit_user_id}.json'
-        headers = {'Authorization': f'Bearer {fitbit_user.access_token}'}
+        headers = {'Authorization': f'Bearer {token_manager.get_access_token(fitbit_user)}'}
         
         response = requests.post(url, headers=headers)
         
@@ -6998,160 +6995,6 @@ def create_fitbit_subscription(fitbit_user, session_db):
     except Exception as e:
         print(f"[ERROR] [FITBIT] Erro ao criar subscription: {e}")
 
-def fetch_and_save_fitbit_activities(fitbit_user, date, session_db):
-    """Busca atividades do dia no Fitbit"""
-    try:
-        url = f'https://api.fitbit.com/1/user/-/activities/date/{date}.json'
-        headers = {'Authorization': f'Bearer {fitbit_user.access_token}'}
-        
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code != 200:
-            print(f"[ERROR] [FITBIT] Erro ao buscar atividades: {response.status_code}")
-            return
-        
-        data = response.json()
-        
-        for activity in data.get('activities', []):
-            existing = session_db.query(FitbitActivity).filter_by(
-                activity_id=str(activity['logId'])
-            ).first()
-            
-            if not existing:
-                new_activity = FitbitActivity(
-                    id=str(uuid.uuid4()),
-                    fitbit_user_id=fitbit_user.id,
-                    activity_id=str(activity['logId']),
-                    activity_type=activity.get('activityName'),
-                    start_time=datetime.strptime(
-                        f"{date} {activity['startTime']}", 
-                        '%Y-%m-%d %H:%M:%S'
-                    ),
-                    duration=activity.get('duration'),
-                    distance=activity.get('distance', 0),
-                    calories=activity.get('calories', 0),
-                    steps=activity.get('steps', 0),
-                    raw_data=json.dumps(activity)
-                )
-                session_db.add(new_activity)
-                print(f"[OK] [FITBIT] Atividade salva: {activity.get('activityName')}")
-        
-        session_db.commit()
-        
-    except Exception as e:
-        print(f"[ERROR] [FITBIT] Erro ao buscar/salvar atividades: {e}")
-
-def check_fitbit_challenges(session_db, user_id):
-    """Verifica se atividades completaram desafios"""
-    try:
-        participations = session_db.query(ChallengeParticipation).filter_by(
-            user_id=user_id,
-            status='active'
-        ).all()
-
-        print(f"[TARGET] [FITBIT] Verificando {len(participations)} desafios ativos")
-
-        for participation in participations:
-            challenge = session_db.query(Challenge).filter_by(id=participation.challenge_id).first()
-            if not challenge:
-                continue
-
-            # Buscar atividades do Fitbit do usuario
-            today = datetime.now().date()
-            activities = session_db.query(FitbitActivity).filter(
-                FitbitActivity.user_id == user_id,
-                func.date(FitbitActivity.start_time) >= challenge.start_date,
-                func.date(FitbitActivity.start_time) <= challenge.end_date
-            ).all()
-
-            # Calcular progresso baseado no tipo de desafio
-            total_progress = 0
-            if challenge.goal_type == 'distance':
-                total_progress = sum(a.distance or 0 for a in activities)
-            elif challenge.goal_type == 'steps':
-                total_progress = sum(a.steps or 0 for a in activities)
-            elif challenge.goal_type == 'duration':
-                total_progress = sum(a.duration or 0 for a in activities)
-            elif challenge.goal_type == 'calories':
-                total_progress = sum(a.calories or 0 for a in activities)
-
-            # Atualizar progresso
-            participation.current_progress = total_progress
-
-            # Verificar se completou a meta
-            if total_progress >= challenge.goal_value:
-                participation.status = 'completed'
-                participation.completed_at = datetime.now()
-                print(f"[TROPHY] [FITBIT] Desafio {challenge.id} completado por {user_id}!")
-
-                # Marcar como vencedor automaticamente
-                mark_challenge_winner(session_db, challenge, participation)
-
-        session_db.commit()
-
-    except Exception as e:
-        print(f"[ERROR] [FITBIT] Erro ao verificar desafios: {e}")
-        session_db.rollback()
-
-def mark_challenge_winner(session_db, challenge, participation):
-    """Marca participante como vencedor e distribui premio"""
-    try:
-        # Verificar se ja e vencedor
-        existing_winner = session_db.query(ChallengeWinner).filter_by(
-            challenge_id=challenge.id,
-            user_id=participation.user_id
-        ).first()
-
-        if existing_winner:
-            return
-
-        # Calcular premio
-        total_pool = challenge.prize_pool or challenge.entry_fee * challenge.participant_count
-        platform_fee_rate = float(os.getenv('PLATFORM_FEE_RATE', '0.05'))
-        platform_fee = total_pool * platform_fee_rate
-        net_pool = total_pool - platform_fee
-
-        # Criar registro de vencedor
-        winner = ChallengeWinner(
-            id=str(uuid.uuid4()),
-            challenge_id=challenge.id,
-            user_id=participation.user_id,
-            ranking_position=1,
-            prize_amount=net_pool,
-            completed_at=participation.completed_at,
-            paid_out=False
-        )
-        session_db.add(winner)
-
-        # Creditar premio na carteira
-        user = session_db.query(User).filter_by(id=participation.user_id).first()
-        wallet = session_db.query(Wallet).filter_by(user_id=user.id).first()
-
-        if wallet:
-            wallet.balance += net_pool
-
-            # Criar transacao
-            transaction = Transaction(
-                id=str(uuid.uuid4()),
-                user_id=user.id,
-                wallet_id=wallet.id,
-                type='prize',
-                amount=net_pool,
-                description=f'Premio do desafio: {challenge.title}',
-                status='completed'
-            )
-            session_db.add(transaction)
-
-        # Atualizar status do desafio
-        challenge.status = 'completed'
-
-        session_db.commit()
-        print(f"[TROPHY] [WINNER] Usuario {user.name} ganhou R$ {net_pool:.2f}!")
-
-    except Exception as e:
-        print(f"[ERROR] [WINNER] Erro ao marcar vencedor: {e}")
-        session_db.rollback()
-
 @app.route('/api/fitbit/status', methods=['GET'])
 def fitbit_status():
     """Verifica status da conex�o Fitbit"""
@@ -7161,7 +7004,9 @@ def fitbit_status():
         if not user_email:
             return jsonify({'error': 'user_email obrigat�rio'}), 400
         
-        user = session_db.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session_db, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'connected': False}), 200
         
@@ -7613,7 +7458,9 @@ def update_user_profile():
             return jsonify({'error': 'user_email é obrigatório'}), 400
 
         # Buscar usuário
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usuário não encontrado'}), 404
 
@@ -7683,7 +7530,9 @@ def upload_avatar():
             return jsonify({'error': 'Arquivo muito grande. Máximo: 5MB'}), 400
 
         # Buscar usuário
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usuário não encontrado'}), 404
 
@@ -7723,6 +7572,7 @@ def upload_avatar():
 # ==================== ENDPOINTS DE DEPÓSITO ====================
 
 @app.route('/api/wallet/deposit/pix', methods=['POST'])
+@rate_limit('payments', 10, 60)
 def deposit_pix():
     """Criar depósito via PIX"""
     session = SessionLocal()
@@ -7738,7 +7588,9 @@ def deposit_pix():
             return jsonify({'error': 'Valor mínimo para depósito: R$10'}), 400
 
         # Buscar usuário
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usuário não encontrado'}), 404
 
@@ -7811,6 +7663,7 @@ def deposit_pix():
 
 
 @app.route('/api/wallet/deposit/credit-card', methods=['POST'])
+@rate_limit('payments', 10, 60)
 def deposit_credit_card():
     """Depósito via cartão de crédito"""
     session = SessionLocal()
@@ -7827,7 +7680,9 @@ def deposit_credit_card():
             return jsonify({'error': 'Valor mínimo para depósito: R$10'}), 400
 
         # Buscar usuário e carteira
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usuário não encontrado'}), 404
 
@@ -7897,6 +7752,7 @@ def deposit_credit_card():
 # ==================== ENDPOINTS DE SAQUE ====================
 
 @app.route('/api/wallet/withdraw/pix', methods=['POST'])
+@rate_limit('withdraw', 5, 300)
 def withdraw_pix():
     """Saque via PIX"""
     session = SessionLocal()
@@ -7913,7 +7769,9 @@ def withdraw_pix():
             return jsonify({'error': f'Valor mínimo para saque: R${os.getenv("WITHDRAWAL_MIN_AMOUNT", 20)}'}), 400
 
         # Buscar usuário e carteira
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usuário não encontrado'}), 404
 
@@ -7992,7 +7850,9 @@ def withdraw_history():
         if not user_email:
             return jsonify({'error': 'user_email é obrigatório'}), 400
 
-        user = session.query(User).filter_by(email=user_email).first()
+        user, error = request_user(session, user_email)
+        if error:
+            return error
         if not user:
             return jsonify({'error': 'Usuário não encontrado'}), 404
 
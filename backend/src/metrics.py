@@ -0,0 +1,100 @@
+# ==================== MÉTRICAS INTERNAS ====================
+# Registro em memória de contadores, gauges e tempos (por processo),
+# exposto em GET /api/metrics (JSON ou formato texto do Prometheus).
+
+import time
+import threading
+from contextlib import contextmanager
+from flask import request, jsonify, Response
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_timings = {}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted((labels or {}).items())))
+
+
+def increment(name, value=1, labels=None):
+    """Soma `value` ao contador"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, labels=None):
+    """Define o valor atual de um gauge"""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, seconds, labels=None):
+    """Registra uma duração (em segundos)"""
+    key = _key(name, labels)
+    with _lock:
+        stats = _timings.get(key)
+        if stats is None:
+            stats = _timings[key] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'last': 0.0}
+        stats['count'] += 1
+        stats['sum'] += seconds
+        stats['max'] = max(stats['max'], seconds)
+        stats['last'] = seconds
+
+
+@contextmanager
+def timed(name, labels=None):
+    """Mede o bloco e registra em observe()"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, labels)
+
+
+def snapshot():
+    """Cópia de todas as métricas em formato serializável"""
+    def rows(store, fmt):
+        return [dict(name=name, labels=dict(labels), **fmt(value)) for (name, labels), value in sorted(store.items())]
+
+    with _lock:
+        return {
+            'counters': rows(_counters, lambda v: {'value': v}),
+            'gauges': rows(_gauges, lambda v: {'value': v}),
+            'timings': rows(_timings, lambda v: {
+                'count': v['count'],
+                'avg_ms': round(v['sum'] / v['count'] * 1000, 3) if v['count'] else 0.0,
+                'max_ms': round(v['max'] * 1000, 3),
+                'last_ms': round(v['last'] * 1000, 3)
+            })
+        }
+
+
+def _prometheus_text():
+    def fmt(name, labels, suffix=''):
+        if not labels:
+            return f'betfit_{name}{suffix}'
+        inner = ','.join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+        return f'betfit_{name}{suffix}{{{inner}}}'
+
+    data = snapshot()
+    lines = []
+    for row in data['counters'] + data['gauges']:
+        lines.append(f"{fmt(row['name'], row['labels'])} {row['value']}")
+    for row in data['timings']:
+        lines.append(f"{fmt(row['name'], row['labels'], '_count')} {row['count']}")
+        lines.append(f"{fmt(row['name'], row['labels'], '_avg_ms')} {row['avg_ms']}")
+        lines.append(f"{fmt(row['name'], row['labels'], '_max_ms')} {row['max_ms']}")
+    return '\n'.join(lines) + '\n'
+
+
+def register_metrics_routes(app):
+    """Registra GET /api/metrics"""
+
+    @app.route('/api/metrics', methods=['GET'])
+    def get_metrics():
+        """GET /api/metrics?format=prometheus - Métricas do processo"""
+        if request.args.get('format') == 'prometheus':
+            return Response(_prometheus_text(), mimetype='text/plain')
+        return jsonify({'success': True, 'metrics': snapshot()})
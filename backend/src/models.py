@@ -1,16 +1,166 @@
 # MODELOS ATUALIZADOS COM INTEGRAÇÃO FITNESS - HealthKit e Health Connect + MÚLTIPLOS VENCEDORES
 # CORREÇÃO: is_active agora é Boolean
 
-from sqlalchemy import create_engine, Column, String, Float, Integer, DateTime, Text, ForeignKey, Boolean
+from sqlalchemy import create_engine, Column, String, Float, Integer, DateTime, Date, Text, ForeignKey, Boolean, UniqueConstraint, Index, LargeBinary, event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, deferred, object_session, Session
+from sqlalchemy.orm.attributes import flag_dirty
+from sqlalchemy.dialects import postgresql, sqlite
 import datetime
 import uuid
 import json
 import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd é opcional; sem ele os payloads usam zlib
+    zstandard = None
 
 Base = declarative_base()
 
+
+# ==================== PAYLOADS BRUTOS (JSON COMPRIMIDO) ====================
+# JSONs grandes (atividade completa do Strava, dados do dispositivo...) ficam
+# comprimidos na tabela raw_payloads, fora das linhas quentes. Nos modelos o
+# atributo (ex.: FitnessData.raw_data) é um PayloadField: só é lido e
+# descomprimido quando acessado, e a gravação acontece no flush da sessão.
+
+PAYLOAD_CODEC = os.getenv('PAYLOAD_CODEC', 'zstd' if zstandard else 'zlib')
+PAYLOAD_LEVEL = int(os.getenv('PAYLOAD_COMPRESSION_LEVEL', '6'))
+
+
+def compress_payload(text):
+    """Comprime um texto; retorna (codec, bytes)"""
+    raw = text.encode('utf-8')
+    if PAYLOAD_CODEC == 'zstd' and zstandard:
+        return 'zstd', zstandard.ZstdCompressor(level=PAYLOAD_LEVEL).compress(raw)
+    return 'zlib', zlib.compress(raw, PAYLOAD_LEVEL)
+
+
+def decompress_payload(codec, data):
+    """Inverso de compress_payload"""
+    if codec == 'zstd':
+        if not zstandard:
+            raise RuntimeError('Payload em zstd, mas o pacote zstandard não está instalado')
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    return zlib.decompress(data).decode('utf-8')
+
+
+class RawPayload(Base):
+    """Payload JSON comprimido de uma linha de outra tabela"""
+    __tablename__ = 'raw_payloads'
+
+    owner_table = Column(String(50), primary_key=True)
+    owner_id = Column(String, primary_key=True)
+    field = Column(String(50), primary_key=True)
+    codec = Column(String(10), nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    raw_size = Column(Integer, nullable=False)
+    stored_size = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    def text(self):
+        return decompress_payload(self.codec, self.data)
+
+
+def store_payload(session, owner_table, owner_id, field, text):
+    """Grava (ou remove, se text for None) o payload de uma linha"""
+    row = session.get(RawPayload, (owner_table, owner_id, field))
+    if text is None:
+        if row is not None:
+            session.delete(row)
+        return None
+    codec, data = compress_payload(text)
+    if row is None:
+        row = RawPayload(owner_table=owner_table, owner_id=owner_id, field=field)
+        session.add(row)
+    row.codec = codec
+    row.data = data
+    row.raw_size = len(text.encode('utf-8'))
+    row.stored_size = len(data)
+    return row
+
+
+def insert_ignore(session, model, rows):
+    """
+    INSERT ... ON CONFLICT DO NOTHING (PostgreSQL/SQLite), executado na hora
+
+    Para linhas criadas sob demanda (PK = user_id): se outra transação inserir
+    a mesma chave ao mesmo tempo, prevalece a dela em vez de IntegrityError.
+    """
+    if not rows:
+        return
+    dialect = postgresql if session.get_bind().dialect.name == 'postgresql' else sqlite
+    session.execute(dialect.insert(model.__table__).values(rows).on_conflict_do_nothing())
+
+
+def delete_payloads(session, owner_table, owner_ids):
+    """Remove os payloads das linhas informadas (ao apagar as linhas donas)"""
+    if not owner_ids:
+        return 0
+    return session.query(RawPayload).filter(
+        RawPayload.owner_table == owner_table,
+        RawPayload.owner_id.in_(list(owner_ids))
+    ).delete(synchronize_session=False)
+
+
+class PayloadField:
+    """
+    Atributo de payload guardado em raw_payloads
+
+    A leitura descomprime sob demanda (com cache na instância); linhas ainda
+    não migradas caem na coluna legada, que é deferred e só é carregada aqui.
+    """
+
+    def __init__(self, field, legacy_attr):
+        self.field = field
+        self.legacy_attr = legacy_attr
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self
+        pending = obj.__dict__.get('_payload_pending', {})
+        if self.field in pending:
+            return pending[self.field]
+        cache = obj.__dict__.setdefault('_payload_cache', {})
+        if self.field not in cache:
+            cache[self.field] = self._load(obj)
+        return cache[self.field]
+
+    def __set__(self, obj, value):
+        obj.__dict__.setdefault('_payload_pending', {})[self.field] = value
+        obj.__dict__.get('_payload_cache', {}).pop(self.field, None)
+        if object_session(obj) is not None:
+            flag_dirty(obj)  # Garante que o objeto passe pelo before_flush
+
+    def _load(self, obj):
+        session = object_session(obj)
+        if session is None or obj.id is None:
+            return None
+        row = session.get(RawPayload, (obj.__tablename__, obj.id, self.field))
+        if row is not None:
+            return row.text()
+        return getattr(obj, self.legacy_attr)
+
+
+@event.listens_for(Session, 'before_flush')
+def _flush_payloads(session, flush_context, instances):
+    owners = [obj for obj in list(session.new) + list(session.dirty) if '_payload_pending' in obj.__dict__]
+    if not owners:
+        return
+    with session.no_autoflush:
+        for obj in owners:
+            pending = obj.__dict__.pop('_payload_pending', None)
+            if not pending:
+                continue
+            if obj.id is None:
+                obj.id = str(uuid.uuid4())
+            cache = obj.__dict__.setdefault('_payload_cache', {})
+            for field, value in pending.items():
+                store_payload(session, obj.__tablename__, obj.id, field, value)
+                cache[field] = value
+
 # MODELO EXISTENTE - User (sem alterações)
 class User(Base):
     __tablename__ = 'users'
@@ -89,6 +239,7 @@ class FitnessConnection(Base):
     permissions = Column(Text, nullable=True)  # Permissões concedidas em JSON
     is_active = Column(Boolean, default=True)
     last_sync = Column(DateTime, nullable=True)
+    sync_cursor = Column(Integer, nullable=True)  # Epoch (s) da última atividade importada ('after' do Strava); ver jobs/migrate_fitness_columns.py
     sync_status = Column(String, default='connected')  # connected, error, disconnected
     error_message = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -115,21 +266,35 @@ class FitnessConnection(Base):
 class FitnessData(Base):
     """Modelo para armazenar dados de fitness recebidos dos apps"""
     __tablename__ = 'fitness_data'
+    __table_args__ = (
+        # Dedupe da sincronização: uma atividade externa por conexão
+        # (bancos existentes: jobs/migrate_fitness_columns.py cria colunas e índice)
+        Index('ix_fitness_data_connection_external', 'connection_id', 'external_id', unique=True),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = Column(String, ForeignKey('users.id'), nullable=False, index=True)
     connection_id = Column(String, ForeignKey('fitness_connections.id'), nullable=False)
+    external_id = Column(String, nullable=True)  # ID da atividade no provedor (Strava...)
     data_type = Column(String, nullable=False)  # 'steps', 'distance', 'calories', 'workout', etc.
     value = Column(Float, nullable=False)  # Valor numérico do dado
     unit = Column(String, nullable=True)  # Unidade (steps, meters, calories, minutes, etc.)
     start_time = Column(DateTime, nullable=False)  # Início da atividade
     end_time = Column(DateTime, nullable=True)  # Fim da atividade
     source_app = Column(String, nullable=True)  # App que gerou o dado (Apple Watch, Strava, etc.)
-    device_info = Column(Text, nullable=True)  # Informações do dispositivo em JSON
-    raw_data = Column(Text, nullable=True)  # Dados brutos em JSON para auditoria
+    # JSONs de dispositivo e dados brutos (auditoria) ficam comprimidos em raw_payloads;
+    # as colunas legadas só guardam linhas ainda não migradas (jobs/migrate_raw_payloads.py)
+    _device_info_legacy = deferred(Column('device_info', Text, nullable=True))
+    _raw_data_legacy = deferred(Column('raw_data', Text, nullable=True))
+    device_info = PayloadField('device_info', '_device_info_legacy')
+    raw_data = PayloadField('raw_data', '_raw_data_legacy')
     processed_at = Column(DateTime, default=datetime.datetime.utcnow)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     
+    # NOVOS CAMPOS ANTI-FRAUDE (preenchidos pelo antifraud.score_fitness_records)
+    trust_score = Column(Float, nullable=True)  # 0.0 (fraude provável) a 1.0 (confiável)
+    fraud_reasons = Column(Text, nullable=True)  # Motivos separados por vírgula
+    
     # Relacionamentos
     user = relationship("User", back_populates="fitness_data")
     connection = relationship("FitnessConnection")
@@ -139,6 +304,7 @@ class FitnessData(Base):
             'id': self.id,
             'user_id': self.user_id,
             'connection_id': self.connection_id,
+            'external_id': self.external_id,
             'data_type': self.data_type,
             'value': float(self.value),
             'unit': self.unit,
@@ -146,12 +312,116 @@ class FitnessData(Base):
             'end_time': self.end_time.isoformat() if self.end_time else None,
             'source_app': self.source_app,
             'device_info': json.loads(self.device_info) if self.device_info else {},
+            'trust_score': float(self.trust_score) if self.trust_score is not None else None,
+            'fraud_reasons': self.fraud_reasons.split(',') if self.fraud_reasons else [],
             'processed_at': self.processed_at.isoformat() if self.processed_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
     
 
 
+class StravaStreamMetrics(Base):
+    """Métricas recalculadas a partir dos streams GPS de uma atividade Strava"""
+    __tablename__ = 'strava_stream_metrics'
+
+    fitness_data_id = Column(String, ForeignKey('fitness_data.id'), primary_key=True)
+    strava_activity_id = Column(String, nullable=False, index=True)
+    points = Column(Integer, default=0)
+    reported_distance_km = Column(Float, nullable=True)  # Distância informada pelo Strava
+    distance_km = Column(Float, nullable=True)  # Distância recalculada (haversine)
+    valid_distance_km = Column(Float, nullable=True)  # Sem trechos de teleporte/veículo
+    moving_time_s = Column(Float, nullable=True)
+    max_speed_kmh = Column(Float, nullable=True)
+    teleport_count = Column(Integer, default=0)
+    vehicle_seconds = Column(Float, default=0.0)
+    vehicle_distance_km = Column(Float, default=0.0)
+    verified = Column(Boolean, default=False)
+    flags = Column(Text, nullable=True)  # Motivos separados por vírgula
+    computed_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'fitness_data_id': self.fitness_data_id,
+            'strava_activity_id': self.strava_activity_id,
+            'points': self.points,
+            'reported_distance_km': self.reported_distance_km,
+            'distance_km': self.distance_km,
+            'valid_distance_km': self.valid_distance_km,
+            'moving_time_s': self.moving_time_s,
+            'max_speed_kmh': self.max_speed_kmh,
+            'teleport_count': self.teleport_count,
+            'vehicle_seconds': self.vehicle_seconds,
+            'vehicle_distance_km': self.vehicle_distance_km,
+            'verified': self.verified,
+            'flags': self.flags.split(',') if self.flags else [],
+            'computed_at': self.computed_at.isoformat() if self.computed_at else None
+        }
+
+
+class FitnessDaily(Base):
+    """Agregado diário por usuário/métrica, mantido na ingestão de cada fonte"""
+    __tablename__ = 'fitness_daily'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'day', 'metric', name='uq_fitness_daily_user_day_metric'),
+        Index('ix_fitness_daily_user_metric_day', 'user_id', 'metric', 'day'),
+    )
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey('users.id'), nullable=False)
+    day = Column(Date, nullable=False)
+    metric = Column(String, nullable=False)  # 'steps', 'distance' (km), 'calories', 'duration' (min) ou 'activity:<tipo>'
+    total = Column(Float, default=0.0)  # Soma dos valores do dia
+    count = Column(Integer, default=0)  # Quantidade de amostras
+    max_value = Column(Float, default=0.0)  # Maior amostra do dia
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'day': self.day.isoformat() if self.day else None,
+            'metric': self.metric,
+            'total': float(self.total or 0.0),
+            'count': self.count or 0,
+            'max_value': float(self.max_value or 0.0)
+        }
+
+
+
+class FitnessHourly(Base):
+    """Agregado por hora das amostras FitnessData já compactadas (ver fitness_compaction)"""
+    __tablename__ = 'fitness_hourly'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'hour', 'data_type', 'unit', 'source_app', name='uq_fitness_hourly_bucket'),
+        Index('ix_fitness_hourly_user_hour', 'user_id', 'hour'),
+    )
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey('users.id'), nullable=False)
+    hour = Column(DateTime, nullable=False)  # Início da hora (UTC)
+    data_type = Column(String, nullable=False)
+    unit = Column(String, nullable=False, default='')
+    source_app = Column(String, nullable=False, default='')
+    total = Column(Float, default=0.0)  # Soma dos valores
+    count = Column(Integer, default=0)  # Amostras compactadas
+    min_value = Column(Float, nullable=True)
+    max_value = Column(Float, nullable=True)
+    duration_minutes = Column(Float, default=0.0)  # Soma de end_time - start_time
+    compacted_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'hour': self.hour.isoformat() if self.hour else None,
+            'data_type': self.data_type,
+            'unit': self.unit or None,
+            'source_app': self.source_app or None,
+            'total': float(self.total or 0.0),
+            'count': self.count or 0,
+            'min_value': self.min_value,
+            'max_value': self.max_value,
+            'duration_minutes': float(self.duration_minutes or 0.0)
+        }
+
 # ==================== MODELOS FITBIT ====================
 
 class FitbitUser(Base):
@@ -194,7 +464,8 @@ class FitbitActivity(Base):
     calories = Column(Integer)
     steps = Column(Integer)
     received_at = Column(DateTime, default=datetime.datetime.utcnow)
-    raw_data = Column(Text)  # JSON completo
+    _raw_data_legacy = deferred(Column('raw_data', Text))
+    raw_data = PayloadField('raw_data', '_raw_data_legacy')  # JSON completo (raw_payloads)
     
     # Relacionamento
     fitbit_user = relationship('FitbitUser', backref='activities')
@@ -320,7 +591,8 @@ class ChallengeParticipation(Base):
     result_value = Column(Float, nullable=True)
     result_submitted_at = Column(DateTime, nullable=True)
     validation_status = Column(String, default='pending')
-    validation_data = Column(Text, nullable=True)
+    _validation_data_legacy = deferred(Column('validation_data', Text, nullable=True))
+    validation_data = PayloadField('validation_data', '_validation_data_legacy')  # raw_payloads
     joined_at = Column(DateTime, default=datetime.datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -425,6 +697,52 @@ class Challenge(Base):
             'multiple_winners_enabled': self.max_winners > 1 if self.max_winners else False
         }
 
+# ==================== PROGRESSO DE DESAFIOS CUMULATIVOS ====================
+class ParticipationProgress(Base):
+    """Total acumulado de cada participação (atualizado por delta a cada atividade)"""
+    __tablename__ = 'participation_progress'
+
+    participation_id = Column(String, ForeignKey('challenge_participations.id'), primary_key=True)
+    challenge_id = Column(String, nullable=False, index=True)
+    user_id = Column(String, ForeignKey('users.id'), nullable=False, index=True)
+    metric = Column(String, nullable=False)  # steps, distance, calories, duration
+    current_value = Column(Float, default=0.0)
+    target_value = Column(Float, nullable=True)
+    contributions_count = Column(Integer, default=0)
+    last_activity_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    def to_dict(self):
+        target = float(self.target_value) if self.target_value else None
+        return {
+            'participation_id': self.participation_id,
+            'challenge_id': self.challenge_id,
+            'user_id': self.user_id,
+            'metric': self.metric,
+            'current_value': float(self.current_value or 0.0),
+            'target_value': target,
+            'percentage': round(min(100.0, (self.current_value or 0.0) / target * 100), 2) if target else None,
+            'contributions_count': self.contributions_count or 0,
+            'last_activity_at': self.last_activity_at.isoformat() if self.last_activity_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class ProgressContribution(Base):
+    """Contribuição de uma atividade (de qualquer provedor) para uma participação"""
+    __tablename__ = 'progress_contributions'
+    __table_args__ = (
+        UniqueConstraint('participation_id', 'source', 'source_id', name='uq_progress_contribution_source'),
+    )
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    participation_id = Column(String, ForeignKey('challenge_participations.id'), nullable=False)
+    source = Column(String, nullable=False)  # 'fitness_data' ou 'fitbit'
+    source_id = Column(String, nullable=False)  # FitnessData.id ou FitbitActivity.activity_id
+    value = Column(Float, nullable=False)
+    occurred_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
 # NOVO MODELO PARA REGISTRAR VENCEDORES
 class ChallengeWinner(Base):
     """Modelo para registrar os vencedores de cada desafio"""
@@ -581,6 +899,11 @@ class GlobalActivity(Base):
 # ==================== MODELO DE CHAT ====================
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # Histórico paginado por cursor (created_at, id) no chat do desafio e no 1-on-1
+        Index('ix_messages_challenge_created', 'challenge_id', 'created_at', 'id'),
+        Index('ix_messages_pair_created', 'sender_id', 'receiver_id', 'created_at', 'id'),
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     sender_id = Column(String, ForeignKey('users.id'), nullable=False)
@@ -613,6 +936,77 @@ class Message(Base):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
+class Conversation(Base):
+    """Resumo de uma conversa na caixa de entrada de um usuário (1-on-1 ou desafio)"""
+    __tablename__ = 'conversations'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'conversation_key', name='uq_conversations_user_key'),
+        Index('ix_conversations_user_last', 'user_id', 'last_message_at'),
+        Index('ix_conversations_key', 'conversation_key'),
+    )
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey('users.id'), nullable=False)  # Dono da caixa de entrada
+    conversation_key = Column(String, nullable=False)  # 'user_<peer_id>' ou 'challenge_<challenge_id>'
+    peer_id = Column(String, ForeignKey('users.id'), nullable=True)
+    challenge_id = Column(String, ForeignKey('challenges.id'), nullable=True)
+    last_message_id = Column(String, nullable=True)
+    last_sender_id = Column(String, nullable=True)
+    last_preview = Column(Text, nullable=True)  # Início do conteúdo da última mensagem
+    last_message_type = Column(String, default='text')
+    last_message_at = Column(DateTime, nullable=True)
+    unread_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'conversation_id': self.id,
+            'conversation_key': self.conversation_key,
+            'peer_id': self.peer_id,
+            'challenge_id': self.challenge_id,
+            'last_message_id': self.last_message_id,
+            'last_sender_id': self.last_sender_id,
+            'last_preview': self.last_preview,
+            'last_message_type': self.last_message_type,
+            'last_message_at': self.last_message_at.isoformat() if self.last_message_at else None,
+            'unread_count': self.unread_count or 0
+        }
+
+
+class UserGameStats(Base):
+    """Contadores de gamificação por usuário, mantidos por evento (badges avaliados em O(1))"""
+    __tablename__ = 'user_game_stats'
+
+    user_id = Column(String, ForeignKey('users.id'), primary_key=True)
+    challenges_completed = Column(Integer, default=0, nullable=False)
+    challenges_won = Column(Integer, default=0, nullable=False)
+    first_places = Column(Integer, default=0, nullable=False)
+    total_earned = Column(Float, default=0.0, nullable=False)
+    activities_ingested = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'challenges_completed': self.challenges_completed or 0,
+            'challenges_won': self.challenges_won or 0,
+            'first_places': self.first_places or 0,
+            'total_earned': float(self.total_earned or 0.0),
+            'activities_ingested': self.activities_ingested or 0
+        }
+
+
+class ActivityCalendar(Base):
+    """Dias com atividade do usuário como bitmap (bit i = start_day + i dias, UTC)"""
+    __tablename__ = 'activity_calendars'
+
+    user_id = Column(String, ForeignKey('users.id'), primary_key=True)
+    start_day = Column(Date, nullable=True)  # Dia do bit 0
+    bits = Column(LargeBinary, nullable=False, default=b'')  # Bytes little-endian
+    last_active_day = Column(Date, nullable=True)
+    longest_streak = Column(Integer, default=0, nullable=False)  # Maior sequência já registrada
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
 # Configuração do banco - PostgreSQL em produção, SQLite em desenvolvimento
 DATABASE_URL = os.getenv('DATABASE_URL', '')
 
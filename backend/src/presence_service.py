@@ -0,0 +1,272 @@
+# ==================== PRESENÇA NAS SALAS DO CHAT ====================
+# Quem está em cada sala (desafio ou conversa), em memória. Cada sala guarda
+# {user_id: conexões}, então o total online é len() — O(1) — e várias abas do
+# mesmo usuário contam uma vez. Entre nós, as entradas/saídas viajam pelo
+# canal interno do socketio_backend e cada nó reenvia periodicamente um
+# snapshot da sua parte (corrige deltas perdidos; nós mudos expiram).
+# Conexões sem heartbeat por PRESENCE_TIMEOUT_SECONDS saem das salas.
+# O evento 'presence' é agregado e enviado no máximo a cada PRESENCE_THROTTLE_MS.
+# A consulta REST exige o usuário autenticado e, em conversas privadas, que ele
+# seja um dos participantes (mesma regra do 'join').
+
+import os
+import time
+import logging
+import threading
+from flask import jsonify, request
+import metrics
+from auth_context import authenticated_user
+from room_history import can_access
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_MS = int(os.getenv('PRESENCE_THROTTLE_MS', '1000'))
+CLIENT_TIMEOUT_SECONDS = int(os.getenv('PRESENCE_TIMEOUT_SECONDS', '90'))
+NODE_SYNC_SECONDS = int(os.getenv('PRESENCE_NODE_SYNC_SECONDS', '10'))
+NODE_TIMEOUT_SECONDS = NODE_SYNC_SECONDS * 3 + 5
+MAX_LISTED_USERS = 50  # Acima disso o evento 'presence' leva só a contagem
+
+
+class PresenceService:
+    def __init__(self, socketio=None, manager=None):
+        self.socketio = socketio
+        self.manager = manager
+        self.node_id = getattr(manager, 'node_id', 'local')
+        self._lock = threading.RLock()
+        self._sessions = {}  # sid -> {'user_id', 'username', 'rooms', 'last_seen'}
+        self._rooms = {}  # sala -> {user_id: conexões} (todos os nós)
+        self._names = {}  # user_id -> nome exibido
+        self._remote = {}  # node_id -> {'rooms': {sala: {user_id: conexões}}, 'seen': monotonic}
+        self._dirty = set()
+        self._thread = None
+        if manager is not None and hasattr(manager, 'on_internal'):
+            manager.on_internal('presence', self._on_remote)
+
+    # ==================== AGREGADO ====================
+
+    def _add(self, room, user_id, n=1):
+        members = self._rooms.setdefault(room, {})
+        members[user_id] = members.get(user_id, 0) + n
+        self._dirty.add(room)
+
+    def _remove(self, room, user_id, n=1):
+        members = self._rooms.get(room)
+        if not members or user_id not in members:
+            return
+        members[user_id] -= n
+        if members[user_id] <= 0:
+            del members[user_id]
+        if not members:
+            del self._rooms[room]
+        self._dirty.add(room)
+
+    def count(self, room):
+        with self._lock:
+            return len(self._rooms.get(room, ()))
+
+    def members(self, room, limit=MAX_LISTED_USERS):
+        with self._lock:
+            user_ids = list(self._rooms.get(room, ()))[:limit]
+            return [{'user_id': uid, 'username': self._names.get(uid)} for uid in user_ids]
+
+    # ==================== CONEXÕES LOCAIS ====================
+
+    def join(self, sid, room, user_id=None, username=None):
+        """Registra a conexão na sala; retorna False se ela já estava lá"""
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is None:
+                session = self._sessions[sid] = {
+                    'user_id': str(user_id or username or sid), 'username': username,
+                    'rooms': set(), 'last_seen': time.monotonic()
+                }
+            session['last_seen'] = time.monotonic()
+            if room in session['rooms']:
+                return False
+            session['rooms'].add(room)
+            if username:
+                self._names[session['user_id']] = username
+            self._add(room, session['user_id'])
+        self._publish({'op': 'join', 'room': room, 'user_id': session['user_id'], 'username': username})
+        return True
+
+    def leave(self, sid, room):
+        """Tira a conexão da sala; retorna os dados do usuário ou None"""
+        with self._lock:
+            session = self._sessions.get(sid)
+            if not session or room not in session['rooms']:
+                return None
+            session['rooms'].discard(room)
+            self._remove(room, session['user_id'])
+        self._publish({'op': 'leave', 'room': room, 'user_id': session['user_id']})
+        return session
+
+    def disconnect(self, sid):
+        """Remove a conexão de todas as salas; retorna [(sala, sessão)] para avisar as salas"""
+        with self._lock:
+            session = self._sessions.get(sid)
+            rooms = list(session['rooms']) if session else []
+        left = [(room, self.leave(sid, room)) for room in rooms]
+        with self._lock:
+            self._sessions.pop(sid, None)
+        return [(room, session) for room, session in left if session]
+
+    def touch(self, sid):
+        """Heartbeat do cliente (evento 'presence_heartbeat' ou qualquer atividade)"""
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session:
+                session['last_seen'] = time.monotonic()
+
+    # ==================== SINCRONIZAÇÃO ENTRE NÓS ====================
+
+    def _publish(self, payload):
+        if self.manager is not None and hasattr(self.manager, 'publish_internal'):
+            try:
+                self.manager.publish_internal('presence', payload)
+            except Exception as e:
+                logger.warning(f"[PRESENCE] Erro ao publicar presença: {e}")
+
+    def _local_snapshot(self):
+        rooms = {}
+        for session in self._sessions.values():
+            for room in session['rooms']:
+                members = rooms.setdefault(room, {})
+                members[session['user_id']] = members.get(session['user_id'], 0) + 1
+        names = {uid: self._names.get(uid) for members in rooms.values() for uid in members}
+        return {'rooms': rooms, 'names': names}
+
+    def _replace_node(self, node_id, rooms):
+        """Troca a contribuição de um nó no agregado (snapshot ou expiração)"""
+        old = self._remote.get(node_id, {}).get('rooms', {})
+        for room, members in old.items():
+            for user_id, n in members.items():
+                self._remove(room, user_id, n)
+        for room, members in rooms.items():
+            for user_id, n in members.items():
+                self._add(room, user_id, n)
+
+    def _on_remote(self, payload, node_id):
+        if not payload or node_id == self.node_id:
+            return
+        with self._lock:
+            node = self._remote.setdefault(node_id, {'rooms': {}, 'seen': 0.0})
+            node['seen'] = time.monotonic()
+            op = payload.get('op')
+            if op == 'snapshot':
+                self._names.update({k: v for k, v in (payload.get('names') or {}).items() if v})
+                self._replace_node(node_id, payload.get('rooms') or {})
+                node['rooms'] = payload.get('rooms') or {}
+            elif op == 'join':
+                members = node['rooms'].setdefault(payload['room'], {})
+                members[payload['user_id']] = members.get(payload['user_id'], 0) + 1
+                if payload.get('username'):
+                    self._names[payload['user_id']] = payload['username']
+                self._add(payload['room'], payload['user_id'])
+            elif op == 'leave':
+                members = node['rooms'].get(payload['room'], {})
+                if members.get(payload['user_id']):
+                    members[payload['user_id']] -= 1
+                    if not members[payload['user_id']]:
+                        del members[payload['user_id']]
+                    self._remove(payload['room'], payload['user_id'])
+
+    # ==================== MANUTENÇÃO E EVENTO THROTTLED ====================
+
+    def sweep(self):
+        """Expira conexões sem heartbeat e nós que pararam de sincronizar"""
+        now = time.monotonic()
+        with self._lock:
+            stale_sids = [sid for sid, s in self._sessions.items() if now - s['last_seen'] > CLIENT_TIMEOUT_SECONDS]
+            dead_nodes = [nid for nid, n in self._remote.items() if now - n['seen'] > NODE_TIMEOUT_SECONDS]
+            for node_id in dead_nodes:
+                self._replace_node(node_id, {})
+                del self._remote[node_id]
+
+        for sid in stale_sids:
+            for room, session in self.disconnect(sid):
+                self._emit('user_left', {
+                    'message': f"{session.get('username') or 'Anônimo'} saiu do chat",
+                    'room': room
+                }, room)
+        if dead_nodes:
+            logger.warning(f"[PRESENCE] Nó(s) sem sincronizar removido(s): {', '.join(dead_nodes)}")
+        return len(stale_sids)
+
+    def flush(self):
+        """Envia 'presence' para as salas que mudaram desde o último envio"""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            updates = []
+            for room in dirty:
+                count = len(self._rooms.get(room, ()))
+                update = {'room': room, 'online_count': count}
+                if count <= MAX_LISTED_USERS:
+                    update['users'] = [
+                        {'user_id': uid, 'username': self._names.get(uid)} for uid in self._rooms.get(room, ())
+                    ]
+                updates.append(update)
+            metrics.set_gauge('presence_rooms', len(self._rooms))
+            metrics.set_gauge('presence_local_connections', len(self._sessions))
+
+        for update in updates:
+            self._emit('presence', update, update['room'])
+        return len(updates)
+
+    def _emit(self, event, payload, room):
+        if self.socketio is None:
+            return
+        # Cada nó calcula o mesmo agregado e avisa só os seus clientes
+        self.socketio.emit(event, payload, to=room, ignore_queue=True)
+
+    def _run(self):
+        last_sync = 0.0
+        while True:
+            time.sleep(THROTTLE_MS / 1000.0)
+            try:
+                self.flush()
+                if time.monotonic() - last_sync >= NODE_SYNC_SECONDS:
+                    last_sync = time.monotonic()
+                    self.sweep()
+                    with self._lock:
+                        snapshot = self._local_snapshot()
+                    self._publish(dict(snapshot, op='snapshot'))
+            except Exception as e:
+                logger.error(f"[PRESENCE] Erro no worker de presença: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+
+def init_presence_service(socketio, start_worker=True):
+    """Cria o serviço de presença usando o client manager do Socket.IO (multi-nó)"""
+    manager = getattr(getattr(socketio, 'server', None), 'manager', None)
+    service = PresenceService(socketio, manager)
+    if start_worker:
+        service.start()
+    return service
+
+
+def register_presence_routes(app, service):
+    """Registra GET /api/chat/rooms/<room>/presence"""
+
+    @app.route('/api/chat/rooms/<room>/presence', methods=['GET'])
+    def get_room_presence(room):
+        """Contagem online (O(1)) e até `limit` usuários presentes na sala (só para quem pode entrar nela)"""
+        try:
+            user, error = authenticated_user(request.args.get('user_email'))
+            if error:
+                return error
+            if not can_access(room, user.id):
+                return jsonify({'success': False, 'error': 'Sem acesso a esta sala'}), 403
+            limit = max(0, min(int(request.args.get('limit', MAX_LISTED_USERS)), 500))
+            return jsonify({
+                'success': True,
+                'room': room,
+                'online_count': service.count(room),
+                'users': service.members(room, limit)
+            }), 200
+        except Exception as e:
+            return jsonify({'success': False, 'error': str(e)}), 500
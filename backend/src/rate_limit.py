@@ -0,0 +1,205 @@
+# ==================== LIMITE DE REQUISIÇÕES (TOKEN BUCKET) ====================
+# Um balde por (limite, usuário ou IP), em memória: cada requisição gasta uma
+# ficha e as fichas voltam a uma taxa fixa até a capacidade. Sem fichas, a
+# rota responde 429 com Retry-After. Os limites são declarados por rota com
+# @rate_limit(...) e podem ser ajustados por variável de ambiente
+# (RATE_LIMIT_<NOME>="capacidade/segundos"). Em vários nós, cada nó publica
+# periodicamente o que consumiu pelo canal interno do client manager e os
+# outros nós descontam dos seus baldes (limite aproximado, sem ida ao banco).
+
+import os
+import math
+import time
+import logging
+import threading
+from functools import wraps
+from flask import g, request, jsonify, make_response
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SYNC_SECONDS = float(os.getenv('RATE_LIMIT_SYNC_SECONDS', '1'))
+SWEEP_SECONDS = 60
+
+
+def client_ip():
+    """
+    IP do cliente: remote_addr já corrigido pelo ProxyFix (TRUSTED_PROXY_HOPS).
+    O primeiro item do X-Forwarded-For é escolhido pelo cliente e não serve.
+    """
+    return request.remote_addr or 'unknown'
+
+
+def user_or_ip():
+    """Usuário autenticado (g.user) ou, sem token, o IP"""
+    user = getattr(g, 'user', None)
+    if user is not None:
+        return f"user:{user.id}"
+    return f"ip:{client_ip()}"
+
+
+def ip_only():
+    return f"ip:{client_ip()}"
+
+
+class Rule:
+    def __init__(self, name, capacity, period):
+        override = os.getenv(f"RATE_LIMIT_{name.upper()}")
+        if override:
+            try:
+                capacity, period = override.split('/')
+            except ValueError:
+                logger.warning(f"[RATE] RATE_LIMIT_{name.upper()} inválido: {override}")
+        self.name = name
+        self.capacity = max(1, int(capacity))
+        self.period = float(period)
+        self.rate = self.capacity / self.period  # fichas por segundo
+
+
+class RateLimiter:
+    def __init__(self, manager=None):
+        self._lock = threading.Lock()
+        self._rules = {}
+        self._buckets = {}  # (limite, chave) -> [fichas, último ajuste]
+        self._pending = {}  # (limite, chave) -> consumo local ainda não publicado
+        self._last_sweep = time.monotonic()
+        self._thread = None
+        self.manager = None
+        self.attach(manager)
+
+    def attach(self, manager):
+        """Liga o limitador ao client manager do Socket.IO para dividir o consumo entre nós"""
+        if manager is not None and manager is not self.manager and hasattr(manager, 'on_internal'):
+            self.manager = manager
+            manager.on_internal('rate_limit', self._on_remote)
+
+    def rule(self, name, capacity, period):
+        rule = self._rules.get(name)
+        if rule is None:
+            rule = self._rules[name] = Rule(name, capacity, period)
+        return rule
+
+    def _refill(self, rule, key, now):
+        bucket = self._buckets.get((rule.name, key))
+        if bucket is None:
+            bucket = self._buckets[(rule.name, key)] = [float(rule.capacity), now]
+        else:
+            bucket[0] = min(rule.capacity, bucket[0] + (now - bucket[1]) * rule.rate)
+            bucket[1] = now
+        return bucket
+
+    def hit(self, rule, key, cost=1):
+        """
+        Gasta `cost` fichas do balde
+
+        Returns:
+            (permitido, fichas restantes, segundos até haver fichas)
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._refill(rule, key, now)
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                self._pending[(rule.name, key)] = self._pending.get((rule.name, key), 0) + cost
+                return True, int(bucket[0]), 0.0
+            return False, 0, (cost - bucket[0]) / rule.rate
+
+    def _on_remote(self, payload, node_id):
+        """Desconta o consumo publicado por outro nó (o saldo pode ficar negativo)"""
+        now = time.monotonic()
+        with self._lock:
+            for name, key, used in (payload or {}).get('hits', []):
+                rule = self._rules.get(name)
+                if rule is None:
+                    continue
+                bucket = self._refill(rule, key, now)
+                bucket[0] = max(-rule.capacity, bucket[0] - used)
+
+    def _sweep(self, now):
+        # Baldes cheios equivalem a não ter balde
+        full = [k for k, (tokens, last) in self._buckets.items()
+                if k[0] in self._rules
+                and tokens + (now - last) * self._rules[k[0]].rate >= self._rules[k[0]].capacity]
+        for k in full:
+            del self._buckets[k]
+        metrics.set_gauge('rate_limit_buckets', len(self._buckets))
+
+    def sync(self):
+        """Publica o consumo local para os outros nós e limpa baldes ociosos"""
+        now = time.monotonic()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if now - self._last_sweep >= SWEEP_SECONDS:
+                self._last_sweep = now
+                self._sweep(now)
+        if pending and self.manager is not None and hasattr(self.manager, 'publish_internal'):
+            try:
+                self.manager.publish_internal('rate_limit', {
+                    'hits': [[name, key, used] for (name, key), used in pending.items()]
+                })
+            except Exception as e:
+                logger.warning(f"[RATE] Erro ao publicar consumo: {e}")
+
+    def _run(self):
+        while True:
+            time.sleep(SYNC_SECONDS)
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"[RATE] Erro na sincronização: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+
+limiter = RateLimiter()
+
+
+def rate_limit(name, capacity, period, key=user_or_ip):
+    """
+    Limita a rota a `capacity` requisições por `period` segundos por chave
+
+    Args:
+        name: nome do limite (métricas e RATE_LIMIT_<NOME>)
+        key: função que identifica o cliente (padrão: usuário ou IP)
+    """
+    rule = limiter.rule(name, capacity, period)
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED or request.method == 'OPTIONS':
+                return fn(*args, **kwargs)
+
+            allowed, remaining, retry_after = limiter.hit(rule, key())
+            if not allowed:
+                metrics.increment('rate_limit_rejected', labels={'limit': name})
+                response = jsonify({
+                    'success': False,
+                    'error': 'Muitas requisições. Tente novamente em instantes.',
+                    'retry_after': math.ceil(retry_after)
+                })
+                response.status_code = 429
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                response.headers['X-RateLimit-Limit'] = str(rule.capacity)
+                response.headers['X-RateLimit-Remaining'] = '0'
+                return response
+
+            response = make_response(fn(*args, **kwargs))
+            response.headers['X-RateLimit-Limit'] = str(rule.capacity)
+            response.headers['X-RateLimit-Remaining'] = str(remaining)
+            return response
+        return wrapper
+    return decorator
+
+
+def init_rate_limiter(socketio, start_worker=True):
+    """Liga o limitador ao client manager do Socket.IO (multi-nó) e inicia a sincronização"""
+    limiter.attach(getattr(getattr(socketio, 'server', None), 'manager', None))
+    if start_worker:
+        limiter.start()
+    print(f"[OK] [RATE] Limite de requisições {'ativo' if ENABLED else 'desligado'}")
+    return limiter
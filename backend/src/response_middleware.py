@@ -0,0 +1,149 @@
+# ==================== COMPRESSÃO E GET CONDICIONAL ====================
+# after_request que (1) gera um ETag fraco para respostas GET 200 — a partir
+# do corpo ou de um carimbo de versão informado pelo handler — e responde 304
+# quando bate com o If-None-Match, e (2) comprime com brotli (se instalado)
+# ou gzip respostas de texto/JSON acima de COMPRESS_MIN_SIZE bytes. O ETag é
+# calculado sobre o corpo original, então vale para qualquer codificação.
+#
+# Handlers com um carimbo barato (ex.: contagem + maior updated_at) podem
+# evitar montar a resposta:
+#
+#     cached = not_modified(version)
+#     if cached:
+#         return cached
+
+import os
+import gzip
+import hashlib
+import logging
+from flask import g, request, current_app
+import metrics
+
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele só gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv('COMPRESS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4'))
+COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript', 'image/svg+xml')
+
+
+def _etag_for(value):
+    return hashlib.blake2b(value, digest_size=12).hexdigest()
+
+
+def _version_etag(version):
+    # Mesmo carimbo em URLs/parâmetros diferentes gera ETags diferentes
+    return _etag_for(f"{request.full_path}|{version}".encode('utf-8'))
+
+
+def not_modified(version):
+    """
+    Registra o carimbo de versão da resposta e, se o cliente já tem essa
+    versão (If-None-Match), devolve a resposta 304 para retornar direto
+
+    Returns:
+        Resposta 304 ou None
+    """
+    etag = _version_etag(version)
+    g.response_etag = etag
+    if request.method in ('GET', 'HEAD') and request.if_none_match.contains_weak(etag):
+        metrics.increment('http_not_modified', labels={'source': 'version'})
+        return _not_modified_response(etag)
+    return None
+
+
+def _not_modified_response(etag):
+    response = current_app.response_class(status=304)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def _to_not_modified(response):
+    """
+    Transforma a própria resposta em 304: mantém os headers dos after_request
+    que já rodaram (CORS do main.py, flask_cors); o Werkzeug remove os headers
+    de corpo (Content-Length, Content-Type) ao enviar um 304
+    """
+    response.status_code = 304
+    response.set_data(b'')
+    return response
+
+
+def _apply_etag(response):
+    if response.status_code == 304:
+        return response
+    if request.method not in ('GET', 'HEAD') or response.status_code != 200:
+        return response
+    if response.direct_passthrough or response.is_streamed or 'ETag' in response.headers:
+        return response
+
+    etag = getattr(g, 'response_etag', None) or _etag_for(response.get_data())
+    response.set_etag(etag, weak=True)
+    response.headers.setdefault('Cache-Control', 'no-cache')  # Sempre revalida; 304 sai barato
+    if request.if_none_match.contains_weak(etag):
+        metrics.increment('http_not_modified', labels={'source': 'body'})
+        return _to_not_modified(response)
+    return response
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _apply_compression(response):
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+        return response
+    if not (response.mimetype or '').startswith(COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+
+    if encoding == 'br':
+        compressed = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    if len(compressed) >= len(data):
+        return response
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    metrics.increment('http_compressed_responses', labels={'encoding': encoding})
+    metrics.increment('http_compressed_bytes_saved', len(data) - len(compressed))
+    return response
+
+
+def compress_and_validate(response):
+    """after_request: ETag/304 primeiro (sobre o corpo original), depois compressão"""
+    try:
+        response = _apply_etag(response)
+        if ENABLED:
+            response = _apply_compression(response)
+    except Exception as e:
+        logger.warning(f"[HTTP] Erro ao compactar/validar resposta de {request.path}: {e}")
+    return response
+
+
+def init_response_middleware(app):
+    """Registra a compressão e o GET condicional em todas as rotas"""
+    app.after_request(compress_and_validate)
+    encodings = 'br, gzip' if brotli is not None else 'gzip'
+    print(f"[OK] [HTTP] Compressão ({encodings} acima de {MIN_SIZE} bytes) e ETag/304 ativos")
@@ -0,0 +1,149 @@
+# ==================== HISTÓRICO RECENTE DAS SALAS DO CHAT ====================
+# Ring buffer em memória com as últimas CHAT_HISTORY_SIZE mensagens de cada
+# sala ativa, enviado junto com a confirmação do 'join'. A sala é carregada do
+# banco uma vez (no primeiro join) e depois é mantida pelo caminho de envio,
+# então entrar numa sala movimentada não lê o banco. As salas menos usadas
+# saem por LRU acima de CHAT_HISTORY_MAX_ROOMS. Em vários nós, as mensagens
+# enviadas em outro nó chegam pelo canal interno do client manager.
+
+import os
+import logging
+import threading
+from collections import OrderedDict, deque
+from sqlalchemy import or_, and_
+from sqlalchemy.orm import joinedload
+import metrics
+from models import SessionLocal, Message
+
+logger = logging.getLogger(__name__)
+
+HISTORY_SIZE = int(os.getenv('CHAT_HISTORY_SIZE', '50'))
+MAX_ROOMS = int(os.getenv('CHAT_HISTORY_MAX_ROOMS', '1000'))
+
+
+def _room_filter(room):
+    """Filtro de Message para a sala ('challenge_<id>' ou 'user_<a>_<b>'); None se desconhecida"""
+    if room.startswith('challenge_'):
+        return Message.challenge_id == room[len('challenge_'):]
+    if room.startswith('user_'):
+        parts = room.split('_')
+        if len(parts) == 3:
+            a, b = parts[1], parts[2]
+            return or_(
+                and_(Message.sender_id == a, Message.receiver_id == b),
+                and_(Message.sender_id == b, Message.receiver_id == a)
+            )
+    return None
+
+
+def room_for(sender_id, receiver_id=None, challenge_id=None):
+    """Sala de uma mensagem, no formato do cliente ('challenge_<id>' ou 'user_<menor>_<maior>')"""
+    if challenge_id:
+        return f'challenge_{challenge_id}'
+    if sender_id and receiver_id:
+        a, b = sorted((sender_id, receiver_id))
+        return f'user_{a}_{b}'
+    return None
+
+
+def room_members(room):
+    """Os dois usuários de uma sala privada 'user_<a>_<b>' (vazio se malformada); None se não é privada"""
+    if room.startswith('user_'):
+        parts = room.split('_')
+        return (parts[1], parts[2]) if len(parts) == 3 else ()
+    return None
+
+
+def can_access(room, user_id):
+    """Se o usuário pode entrar na sala e ler o histórico: conversas privadas só para os dois participantes"""
+    members = room_members(room)
+    return members is None or (user_id is not None and user_id in members)
+
+
+def load_recent_messages(room, limit=HISTORY_SIZE):
+    """Últimas mensagens da sala no banco, em ordem cronológica"""
+    condition = _room_filter(room)
+    if condition is None:
+        return []
+    session = SessionLocal()
+    try:
+        messages = session.query(Message).options(joinedload(Message.sender), joinedload(Message.receiver)) \
+            .filter(condition) \
+            .order_by(Message.created_at.desc(), Message.id.desc()) \
+            .limit(limit).all()
+        return [msg.to_dict() for msg in reversed(messages)]
+    finally:
+        session.close()
+
+
+class RoomHistory:
+    def __init__(self, manager=None, size=HISTORY_SIZE, max_rooms=MAX_ROOMS, loader=load_recent_messages):
+        self.size = size
+        self.max_rooms = max_rooms
+        self.loader = loader
+        self.manager = manager
+        self._rooms = OrderedDict()  # sala -> deque(maxlen=size), mais recente no fim
+        self._lock = threading.Lock()
+        if manager is not None and hasattr(manager, 'on_internal'):
+            manager.on_internal('room_history', self._on_remote)
+
+    def _evict(self):
+        while len(self._rooms) > self.max_rooms:
+            self._rooms.popitem(last=False)
+            metrics.increment('chat_history_evictions')
+
+    def recent(self, room):
+        """Histórico da sala para o join (carrega do banco só se a sala não estiver em memória)"""
+        with self._lock:
+            buffer = self._rooms.get(room)
+            if buffer is not None:
+                self._rooms.move_to_end(room)
+                metrics.increment('chat_history_hits')
+                return list(buffer)
+
+        metrics.increment('chat_history_misses')
+        messages = self.loader(room, self.size)
+        with self._lock:
+            buffer = self._rooms.get(room)
+            if buffer is None:
+                buffer = self._rooms[room] = deque(messages, maxlen=self.size)
+                self._evict()
+            else:
+                # Mensagens chegaram durante a carga: mantém as do buffer e completa com as do banco
+                known = {m.get('id') for m in buffer}
+                older = [m for m in messages if m.get('id') not in known]
+                buffer = self._rooms[room] = deque(older + list(buffer), maxlen=self.size)
+            metrics.set_gauge('chat_history_rooms', len(self._rooms))
+            return list(buffer)
+
+    def append(self, room, message, publish=True):
+        """Registra uma mensagem enviada (só para salas já em memória, para não guardar histórico incompleto)"""
+        with self._lock:
+            buffer = self._rooms.get(room)
+            if buffer is not None:
+                buffer.append(message)
+                self._rooms.move_to_end(room)
+        if publish and self.manager is not None and hasattr(self.manager, 'publish_internal'):
+            try:
+                self.manager.publish_internal('room_history', {'room': room, 'message': message})
+            except Exception as e:
+                logger.warning(f"[CHAT] Erro ao publicar histórico da sala {room}: {e}")
+
+    def discard(self, room, message_id):
+        """Tira do histórico uma mensagem que não pôde ser gravada"""
+        with self._lock:
+            buffer = self._rooms.get(room)
+            if buffer is not None:
+                kept = [m for m in buffer if m.get('id') != message_id]
+                if len(kept) != len(buffer):
+                    self._rooms[room] = deque(kept, maxlen=self.size)
+
+    def _on_remote(self, payload, node_id):
+        if payload and payload.get('room') and payload.get('message'):
+            self.append(payload['room'], payload['message'], publish=False)
+
+
+def init_room_history(socketio):
+    """Cria o histórico recente usando o client manager do Socket.IO (multi-nó)"""
+    manager = getattr(getattr(socketio, 'server', None), 'manager', None)
+    return RoomHistory(manager)
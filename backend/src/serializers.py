@@ -0,0 +1,265 @@
+# ==================== SERIALIZAÇÃO RÁPIDA DOS MODELOS ====================
+# Os to_dict() dos modelos fazem isoformat(), float() e json.loads() campo a
+# campo em cada linha. Aqui cada modelo declara seus campos uma vez e o
+# ModelSerializer compila, por conjunto de campos, um getter único e a
+# lista curta de conversões realmente necessárias. Com orjson instalado o app
+# passa a codificar com ele (init_serializers). Datas dos serializers saem em
+# isoformat(), como nos to_dict(); um datetime cru num jsonify continua no
+# formato HTTP do provider padrão do Flask ("Wed, 21 Oct 2015 07:28:00 GMT"),
+# então nenhuma resposta existente muda de formato com a troca.
+#
+# Listas aceitam ?fields=a,b,c (sparse fieldsets): só os campos pedidos são
+# lidos, convertidos e enviados, e load_only() evita trazê-los do banco.
+
+import json
+import decimal
+import logging
+from datetime import date
+from operator import attrgetter, itemgetter
+from flask import request
+from flask.json.provider import JSONProvider
+from sqlalchemy.orm import load_only
+from werkzeug.http import http_date
+from models import Challenge, Message
+
+try:
+    import orjson
+except ImportError:  # orjson é opcional; sem ele o app segue com o json padrão do Flask
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+MAX_COMPILED_FIELDSETS = 64
+
+
+# ==================== CONVERSÕES ====================
+
+def to_float(default):
+    """float(valor), ou default quando o valor é falso (mesma regra dos to_dict)"""
+    return lambda value: float(value) if value else default
+
+
+def from_json(empty):
+    """JSON guardado em texto; `empty` cria o valor para campo vazio (ex.: dict)"""
+    loads = orjson.loads if orjson else json.loads
+    return lambda value: loads(value) if value else empty()
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+class DateTime:
+    """Marca um campo de data: sai em isoformat() (None se vazio)"""
+
+
+class Computed:
+    """Campo derivado do objeto; `columns` são as colunas que ele lê (para load_only)"""
+
+    def __init__(self, fn, columns=()):
+        self.fn = fn
+        self.columns = tuple(columns)
+
+
+# ==================== SERIALIZADOR ====================
+
+class ModelSerializer:
+    def __init__(self, model, fields):
+        """
+        Args:
+            model: classe do modelo
+            fields: {campo: None | conversão | DateTime | Computed}, na ordem de saída
+        """
+        self.model = model
+        self.fields = dict(fields)
+        self.names = tuple(self.fields)
+        self._plans = {}
+
+    def select(self, requested=None):
+        """Campos pedidos que existem no serializer (todos se nenhum for válido)"""
+        if not requested:
+            return self.names
+        selected = tuple(name for name in self.names if name in requested)
+        return selected or self.names
+
+    def _compile(self, names):
+        plan = self._plans.get(names)
+        if plan is not None:
+            return plan
+
+        attrs, keys, converters, computed = [], [], [], []
+        for name in names:
+            spec = self.fields[name]
+            if isinstance(spec, Computed):
+                computed.append((name, spec.fn))
+                continue
+            if spec is DateTime:
+                spec = _isoformat
+            if spec is not None:
+                converters.append((len(attrs), spec))
+            attrs.append(name)
+            keys.append(name)
+
+        if attrs:
+            # Colunas já carregadas ficam no __dict__ da instância: lê direto de lá,
+            # sem o descriptor do SQLAlchemy; se faltar alguma (expirada/deferred),
+            # o attrgetter normal dispara a carga
+            from_dict = itemgetter(*attrs)
+            from_obj = attrgetter(*attrs)
+            single = len(attrs) == 1
+
+            def getter(obj):
+                try:
+                    values = from_dict(obj.__dict__)
+                except KeyError:
+                    values = from_obj(obj)
+                return (values,) if single else values
+        else:
+            getter = lambda obj: ()
+
+        plan = (tuple(keys), getter, tuple(converters), tuple(computed), tuple(names))
+        if len(self._plans) >= MAX_COMPILED_FIELDSETS:
+            self._plans.clear()
+        self._plans[names] = plan
+        return plan
+
+    def _row(self, plan, obj):
+        keys, getter, converters, computed, order = plan
+        values = getter(obj)
+        if converters:
+            values = list(values)
+            for index, convert in converters:
+                values[index] = convert(values[index])
+        row = dict(zip(keys, values))
+        if computed:
+            for name, fn in computed:
+                row[name] = fn(obj)
+            if len(order) != len(keys):
+                row = {name: row[name] for name in order}  # Mantém a ordem declarada
+        return row
+
+    def dump(self, obj, fields=None):
+        """Um objeto -> dict (mesmo formato do to_dict do modelo)"""
+        plan = self._compile(self.select(fields))
+        return self._row(plan, obj)
+
+    def dump_many(self, objs, fields=None):
+        """Lista de objetos -> lista de dicts, com um plano compilado para todas as linhas"""
+        plan = self._compile(self.select(fields))
+        row = self._row
+        return [row(plan, obj) for obj in objs]
+
+    def load_options(self, fields=None, always=('id',)):
+        """load_only() com as colunas necessárias para os campos pedidos (None = todas)"""
+        if not fields:
+            return None
+        columns = set(always)
+        for name in self.select(fields):
+            spec = self.fields[name]
+            columns.update(spec.columns if isinstance(spec, Computed) else (name,))
+        mapper_columns = self.model.__mapper__.column_attrs.keys()
+        attrs = [getattr(self.model, c) for c in columns if c in mapper_columns]
+        return load_only(*attrs) if attrs else None
+
+
+def requested_fields(param='fields'):
+    """Conjunto de campos de ?fields=a,b,c (None se não informado)"""
+    raw = request.args.get(param, '')
+    fields = {f.strip() for f in raw.split(',') if f.strip()}
+    return fields or None
+
+
+# ==================== SERIALIZADORES DOS MODELOS ====================
+
+challenge_serializer = ModelSerializer(Challenge, {
+    'id': None,
+    'title': None,
+    'description': None,
+    'category': None,
+    'difficulty': None,
+    'entry_fee': to_float(0.0),
+    'total_pool': to_float(0.0),
+    'max_participants': None,
+    'current_participants': None,
+    'start_date': DateTime,
+    'end_date': DateTime,
+    'status': None,
+    'rules': None,
+    'prize_distribution': None,
+    'created_at': DateTime,
+    'updated_at': DateTime,
+    'created_by': None,
+    'auto_validation': None,
+    'target_metric': None,
+    'target_value': to_float(None),
+    'target_unit': None,
+    'validation_rules': from_json(dict),
+    'required_app_category': None,
+    'max_winners': None,
+    'winner_selection_type': None,
+    'prize_distribution_type': None,
+    'multiple_winners_enabled': Computed(
+        lambda c: c.max_winners > 1 if c.max_winners else False, columns=('max_winners',)
+    )
+})
+
+message_serializer = ModelSerializer(Message, {
+    'id': None,
+    'sender_id': None,
+    'sender_name': Computed(lambda m: m.sender.name if m.sender else None, columns=('sender_id',)),
+    'sender_avatar': Computed(lambda m: m.sender.profile_picture if m.sender else None, columns=('sender_id',)),
+    'receiver_id': None,
+    'receiver_name': Computed(lambda m: m.receiver.name if m.receiver else None, columns=('receiver_id',)),
+    'challenge_id': None,
+    'content': None,
+    'message_type': None,
+    'is_read': None,
+    'created_at': DateTime,
+    'updated_at': DateTime
+})
+
+# ==================== CODIFICAÇÃO JSON (ORJSON) ====================
+
+# Datas passam pelo _default: mesmo formato HTTP do provider padrão do Flask
+ORJSON_OPTIONS = (
+    orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+) if orjson else 0
+
+
+def _default(value):
+    # Tipos que o provider padrão do Flask aceitava e o orjson não (ou codifica diferente)
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f"Objeto do tipo {type(value).__name__} não é serializável em JSON")
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON do Flask (jsonify, request.get_json) com orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS),
+            mimetype='application/json'
+        )
+
+
+def init_serializers(app):
+    """Troca o JSON do app por orjson (se instalado)"""
+    if orjson is None:
+        print("[WARNING] [JSON] orjson não instalado, usando o json padrão do Flask")
+        return
+    app.json = OrjsonProvider(app)
+    print("[OK] [JSON] Respostas codificadas com orjson")
@@ -0,0 +1,274 @@
+# ==================== BACKEND MULTI-NÓ DO SOCKET.IO ====================
+# Client managers plugáveis para rodar várias instâncias do backend: eventos
+# emitidos num nó (chat, notificações, ranking) chegam aos clientes
+# conectados em qualquer outro. O backend vem de SOCKETIO_MESSAGE_QUEUE:
+#
+#   (vazio)                      -> um único nó, sem fila
+#   redis://host:6379/0          -> Redis pub/sub
+#   postgresql://user@host/db    -> LISTEN/NOTIFY do próprio Postgres
+#   local:///tmp/betfit-socketio -> sockets Unix no diretório (mesma máquina,
+#                                   sem serviço externo; útil em testes)
+#
+# Todos exportam em /api/metrics as conexões do nó, mensagens publicadas/
+# recebidas e a latência de entrega entre nós.
+
+import os
+import json
+import time
+import atexit
+import glob
+import socket
+import logging
+import select
+import socketio
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = os.getenv('SOCKETIO_CHANNEL', 'betfit_socketio')
+PG_NOTIFY_MAX_BYTES = 7900  # Limite do payload do NOTIFY é 8000 bytes
+PG_OUTBOX_TTL_SECONDS = 60
+LOCAL_MAX_DATAGRAM = 200 * 1024
+
+
+def _run_blocking(server, fn, *args):
+    """Chama I/O bloqueante sem travar o hub do eventlet (roda num thread do SO)"""
+    if server is not None and getattr(server, 'async_mode', None) == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+    return fn(*args)
+
+
+class ConnectionMetricsMixin:
+    """Gauge com as conexões Socket.IO deste nó e canal interno entre nós"""
+
+    @property
+    def node_id(self):
+        return getattr(self, 'host_id', 'local')
+
+    def _node_label(self):
+        return {'node': self.node_id[:8]}
+
+    def _update_connections(self):
+        count = sum(len(rooms.get(None, ())) for rooms in self.rooms.values())
+        metrics.set_gauge('socketio_connections', count, self._node_label())
+
+    def connect(self, eio_sid, namespace):
+        sid = super().connect(eio_sid, namespace)
+        self._update_connections()
+        return sid
+
+    def disconnect(self, sid, namespace=None, **kwargs):
+        result = super().disconnect(sid, namespace, **kwargs)
+        self._update_connections()
+        return result
+
+    # Mensagens internas do backend (presença...), fora dos eventos dos clientes
+    def on_internal(self, kind, handler):
+        """Registra handler(payload, node_id) para mensagens internas de outros nós"""
+        if not hasattr(self, '_internal_handlers'):
+            self._internal_handlers = {}
+        self._internal_handlers.setdefault(kind, []).append(handler)
+
+    def publish_internal(self, kind, payload):
+        """Envia uma mensagem interna aos outros nós (nó único: nada a fazer)"""
+        return None
+
+    def _dispatch_internal(self, message):
+        for handler in getattr(self, '_internal_handlers', {}).get(message.get('kind'), []):
+            try:
+                handler(message.get('payload'), message.get('host_id'))
+            except Exception as e:
+                logger.error(f"[SOCKETIO] Erro no handler interno {message.get('kind')}: {e}")
+
+
+class PubSubMetricsMixin(ConnectionMetricsMixin):
+    """Carimba as mensagens publicadas e mede a latência de entrega entre nós"""
+
+    def _publish(self, data):
+        data = dict(data, sent_at=time.time())
+        metrics.increment('socketio_published', labels={'backend': self.name})
+        return super()._publish(data)
+
+    def publish_internal(self, kind, payload):
+        self._publish({'method': 'internal', 'kind': kind, 'payload': payload, 'host_id': self.host_id})
+
+    def _listen(self):
+        source = super()._listen()
+        while True:
+            message = _run_blocking(self.server, next, source, None)
+            if message is None:
+                return
+            if not isinstance(message, dict):
+                try:
+                    message = json.loads(message)
+                except (TypeError, ValueError):
+                    continue
+            if message.get('host_id') != self.host_id and message.get('sent_at'):
+                metrics.increment('socketio_received', labels={'backend': self.name})
+                metrics.observe('socketio_delivery_latency', max(0.0, time.time() - message['sent_at']),
+                                {'backend': self.name})
+            if message.get('method') == 'internal':
+                if message.get('host_id') != self.host_id:
+                    self._dispatch_internal(message)
+                continue
+            yield message
+
+
+class LocalManager(ConnectionMetricsMixin, socketio.Manager):
+    """Nó único (sem fila), apenas com métricas de conexão"""
+
+
+class RedisManager(PubSubMetricsMixin, socketio.RedisManager):
+    name = 'redis'
+
+
+class PostgresPubSub(socketio.PubSubManager):
+    """
+    Transporte via LISTEN/NOTIFY
+
+    Payloads acima do limite do NOTIFY vão para a tabela socketio_outbox e
+    o NOTIFY leva só o id.
+    """
+    name = 'postgres'
+
+    def __init__(self, url, channel=CHANNEL, write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.url = url
+        self._publisher = None
+
+    def _connect(self):
+        import psycopg2
+        conn = psycopg2.connect(self.url)
+        conn.autocommit = True
+        return conn
+
+    def _ensure_publisher(self):
+        if self._publisher is None or self._publisher.closed:
+            self._publisher = self._connect()
+            with self._publisher.cursor() as cur:
+                cur.execute(
+                    "CREATE TABLE IF NOT EXISTS socketio_outbox ("
+                    "id BIGSERIAL PRIMARY KEY, payload TEXT NOT NULL, "
+                    "created_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+                )
+        return self._publisher
+
+    def _publish(self, data):
+        payload = json.dumps(data)
+        try:
+            with self._ensure_publisher().cursor() as cur:
+                if len(payload.encode('utf-8')) > PG_NOTIFY_MAX_BYTES:
+                    cur.execute("INSERT INTO socketio_outbox (payload) VALUES (%s) RETURNING id", (payload,))
+                    payload = f"@{cur.fetchone()[0]}"
+                    cur.execute("DELETE FROM socketio_outbox WHERE created_at < now() - %s * interval '1 second'",
+                                (PG_OUTBOX_TTL_SECONDS,))
+                cur.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+        except Exception as e:
+            logger.error(f"[SOCKETIO] Erro ao publicar no Postgres: {e}")
+            self._publisher = None
+
+    def _listen(self):
+        retry_sleep = 1
+        while True:
+            try:
+                conn = self._connect()
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.channel}"')
+                retry_sleep = 1
+                while True:
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        payload = conn.notifies.pop(0).payload
+                        if payload.startswith('@'):
+                            with conn.cursor() as cur:
+                                cur.execute("SELECT payload FROM socketio_outbox WHERE id = %s", (int(payload[1:]),))
+                                row = cur.fetchone()
+                            if not row:
+                                continue
+                            payload = row[0]
+                        yield payload
+            except Exception as e:
+                logger.error(f"[SOCKETIO] Erro no LISTEN do Postgres, reconectando em {retry_sleep}s: {e}")
+                time.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 60)
+
+
+class LocalSocketPubSub(socketio.PubSubManager):
+    """
+    Transporte entre processos da mesma máquina via sockets Unix (datagramas)
+
+    Cada nó cria <diretório>/<canal>-<host_id>.sock; publicar é enviar o
+    datagrama para os sockets dos outros nós. Sockets órfãos são removidos.
+    """
+    name = 'local'
+
+    def __init__(self, directory, channel=CHANNEL, write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{channel}-{self.host_id}.sock")
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._receiver = None
+        if not write_only:
+            self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._receiver.bind(self.path)
+
+    def _peers(self):
+        return [p for p in glob.glob(os.path.join(self.directory, f"{self.channel}-*.sock")) if p != self.path]
+
+    def _publish(self, data):
+        payload = json.dumps(data).encode('utf-8')
+        if len(payload) > LOCAL_MAX_DATAGRAM:
+            logger.error(f"[SOCKETIO] Mensagem de {len(payload)} bytes excede o limite do backend local")
+            return
+        for peer in self._peers():
+            try:
+                self._sender.sendto(payload, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Nó encerrado sem remover o socket
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+            except OSError as e:
+                logger.error(f"[SOCKETIO] Erro ao publicar para {peer}: {e}")
+
+    def _listen(self):
+        while True:
+            payload = self._receiver.recv(LOCAL_MAX_DATAGRAM)
+            yield payload.decode('utf-8')
+
+    def close(self):
+        if self._receiver is not None:
+            self._receiver.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+class PostgresNotifyManager(PubSubMetricsMixin, PostgresPubSub):
+    pass
+
+
+class LocalSocketManager(PubSubMetricsMixin, LocalSocketPubSub):
+    pass
+
+
+def create_client_manager(url=None, channel=CHANNEL):
+    """Client manager do Socket.IO para a URL da fila (padrão: SOCKETIO_MESSAGE_QUEUE)"""
+    url = url if url is not None else os.getenv('SOCKETIO_MESSAGE_QUEUE', '')
+    if not url:
+        return LocalManager()
+    if url.startswith(('redis://', 'rediss://', 'redis+sentinel://')):
+        return RedisManager(url, channel=channel)
+    if url.startswith(('postgres://', 'postgresql://')):
+        return PostgresNotifyManager(url, channel=channel)
+    if url.startswith('local://'):
+        manager = LocalSocketManager(url[len('local://'):] or '/tmp/betfit-socketio', channel=channel)
+        atexit.register(manager.close)
+        return manager
+    raise ValueError(f"SOCKETIO_MESSAGE_QUEUE não suportada: {url}")
@@ -0,0 +1,195 @@
+# ==================== VERIFICAÇÃO GPS DE ATIVIDADES STRAVA ====================
+# Etapa opcional (STRAVA_STREAM_VERIFICATION=true) do webhook do Strava:
+# busca os streams latlng/time da atividade, recalcula distância, tempo em
+# movimento e velocidade máxima com haversine vetorizado (NumPy) e marca
+# teleportes e trechos em velocidade de veículo. O resultado fica em
+# strava_stream_metrics, ao lado do registro FitnessData.
+
+import os
+import logging
+import numpy as np
+import requests
+from models import StravaStreamMetrics
+from antifraud import MAX_SPEED_KMH, DEFAULT_MAX_SPEED_KMH
+
+logger = logging.getLogger(__name__)
+
+STREAM_VERIFICATION_ENABLED = os.getenv('STRAVA_STREAM_VERIFICATION', 'false').lower() == 'true'
+STREAMS_URL = 'https://www.strava.com/api/v3/activities/{activity_id}/streams'
+
+EARTH_RADIUS_KM = 6371.0088
+TELEPORT_SPEED_KMH = 300.0  # Salto entre dois pontos acima disso = teleporte
+MOVING_SPEED_KMH = 1.8  # Abaixo disso o atleta está parado
+VEHICLE_MIN_SECONDS = 30.0  # Trecho rápido precisa durar isso para contar como veículo
+MAX_SPEED_WINDOW = 5  # Pontos da janela usada para a velocidade máxima
+DISTANCE_TOLERANCE = 0.10  # Diferença aceita entre distância informada e recalculada
+
+# Penalidades aplicadas ao trust_score do registro
+STREAM_PENALTIES = {
+    'gps_teleport': 0.5,
+    'gps_vehicle_segment': 0.6,
+    'gps_distance_mismatch': 0.4
+}
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distância em km entre arrays de coordenadas (graus)"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def _runs(mask):
+    """Índices [início, fim) das sequências contíguas de True"""
+    padded = np.concatenate(([False], mask, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return edges[0::2], edges[1::2]
+
+
+def compute_stream_metrics(latlng, times, activity_type=None):
+    """
+    Recalcula métricas de uma atividade a partir dos streams
+
+    Args:
+        latlng: Array (N, 2) de [lat, lng] em graus
+        times: Array (N,) de segundos desde o início
+        activity_type: Tipo interno (running, cycling...) para o limite de veículo
+
+    Returns:
+        Dict com distance_km, valid_distance_km, moving_time_s, max_speed_kmh,
+        teleport_count, vehicle_seconds, vehicle_distance_km e points
+    """
+    latlng = np.asarray(latlng, dtype=float).reshape(-1, 2)
+    times = np.asarray(times, dtype=float)
+    points = min(len(latlng), len(times))
+
+    result = {
+        'points': int(points), 'distance_km': 0.0, 'valid_distance_km': 0.0,
+        'moving_time_s': 0.0, 'max_speed_kmh': 0.0, 'teleport_count': 0,
+        'vehicle_seconds': 0.0, 'vehicle_distance_km': 0.0
+    }
+    if points < 2:
+        return result
+
+    latlng, times = latlng[:points], times[:points]
+    seg_km = haversine_km(latlng[:-1, 0], latlng[:-1, 1], latlng[1:, 0], latlng[1:, 1])
+    seg_s = np.diff(times)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        seg_kmh = np.where(seg_s > 0, seg_km / (seg_s / 3600.0), np.inf)
+    seg_kmh[(seg_s <= 0) & (seg_km == 0)] = 0.0
+
+    teleport = seg_kmh > TELEPORT_SPEED_KMH
+
+    # Trechos sustentados acima do limite do tipo de atividade (carro, moto, ônibus)
+    vehicle_limit = MAX_SPEED_KMH.get((activity_type or '').lower(), DEFAULT_MAX_SPEED_KMH)
+    fast = (seg_kmh > vehicle_limit) & ~teleport
+    vehicle = np.zeros_like(fast)
+    starts, ends = _runs(fast)
+    if len(starts):
+        cum_s = np.concatenate(([0.0], np.cumsum(seg_s)))
+        sustained = (cum_s[ends] - cum_s[starts]) >= VEHICLE_MIN_SECONDS
+        for start, end in zip(starts[sustained], ends[sustained]):
+            vehicle[start:end] = True
+
+    moving = (seg_kmh >= MOVING_SPEED_KMH) & ~teleport
+    valid = ~teleport & ~vehicle
+
+    # Velocidade máxima suavizada em janela (evita picos de ruído do GPS)
+    cum_km = np.concatenate(([0.0], np.cumsum(np.where(teleport, 0.0, seg_km))))
+    window = min(MAX_SPEED_WINDOW, points - 1)
+    span_km = cum_km[window:] - cum_km[:-window]
+    span_s = times[window:] - times[:-window]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        window_kmh = np.where(span_s > 0, span_km / (span_s / 3600.0), 0.0)
+
+    result.update({
+        'distance_km': round(float(seg_km[~teleport].sum()), 4),
+        'valid_distance_km': round(float(seg_km[valid].sum()), 4),
+        'moving_time_s': round(float(seg_s[moving].sum()), 1),
+        'max_speed_kmh': round(float(window_kmh.max()) if len(window_kmh) else 0.0, 2),
+        'teleport_count': int(teleport.sum()),
+        'vehicle_seconds': round(float(seg_s[vehicle].sum()), 1),
+        'vehicle_distance_km': round(float(seg_km[vehicle].sum()), 4)
+    })
+    return result
+
+
+def stream_flags(metrics, reported_distance_km):
+    """Motivos de suspeita a partir das métricas recalculadas"""
+    flags = []
+    if metrics['teleport_count']:
+        flags.append('gps_teleport')
+    if metrics['vehicle_seconds']:
+        flags.append('gps_vehicle_segment')
+    if reported_distance_km and metrics['distance_km'] > 0:
+        if reported_distance_km > metrics['distance_km'] * (1 + DISTANCE_TOLERANCE):
+            flags.append('gps_distance_mismatch')
+    return flags
+
+
+def fetch_streams(access_token, activity_id):
+    """Busca os streams latlng/time de uma atividade (None se indisponível)"""
+    response = requests.get(
+        STREAMS_URL.format(activity_id=activity_id),
+        headers={'Authorization': f'Bearer {access_token}'},
+        params={'keys': 'latlng,time', 'key_by_type': 'true'},
+        timeout=15
+    )
+    if response.status_code != 200:
+        logger.warning(f"[STRAVA-GPS] Streams indisponíveis para {activity_id}: {response.status_code}")
+        return None
+
+    data = response.json()
+    latlng = (data.get('latlng') or {}).get('data')
+    times = (data.get('time') or {}).get('data')
+    if not latlng or not times:
+        return None
+    return np.asarray(latlng, dtype=float), np.asarray(times, dtype=float)
+
+
+def verify_strava_activity(session, fitness_data, access_token, activity_id):
+    """
+    Recalcula a atividade pelos streams GPS e grava strava_stream_metrics (sem commit)
+
+    Quando há trechos inválidos, o valor do FitnessData passa a ser a distância
+    válida recalculada e o trust_score recebe as penalidades correspondentes.
+    Retorna o registro de métricas ou None se a verificação estiver desligada
+    ou os streams não estiverem disponíveis.
+    """
+    if not STREAM_VERIFICATION_ENABLED:
+        return None
+
+    try:
+        streams = fetch_streams(access_token, activity_id)
+    except requests.RequestException as e:
+        logger.warning(f"[STRAVA-GPS] Erro ao buscar streams de {activity_id}: {e}")
+        return None
+    if streams is None:
+        return None
+
+    reported_km = float(fitness_data.value or 0.0)
+    metrics = compute_stream_metrics(streams[0], streams[1], fitness_data.data_type)
+    flags = stream_flags(metrics, reported_km)
+
+    row = session.get(StravaStreamMetrics, fitness_data.id) or StravaStreamMetrics(fitness_data_id=fitness_data.id)
+    row.strava_activity_id = str(activity_id)
+    row.reported_distance_km = reported_km
+    row.verified = not flags
+    row.flags = ','.join(flags) or None
+    for key, value in metrics.items():
+        setattr(row, key, value)
+    session.add(row)
+
+    if flags:
+        fitness_data.value = min(reported_km, metrics['valid_distance_km'])
+        score = fitness_data.trust_score if fitness_data.trust_score is not None else 1.0
+        for flag in flags:
+            score *= 1.0 - STREAM_PENALTIES[flag]
+        fitness_data.trust_score = round(score, 4)
+        reasons = [r for r in (fitness_data.fraud_reasons or '').split(',') if r]
+        fitness_data.fraud_reasons = ','.join(reasons + flags)
+        print(f"[WARNING] [STRAVA-GPS] Atividade {activity_id}: {', '.join(flags)} "
+              f"({reported_km:.2f} km informados, {metrics['valid_distance_km']:.2f} km válidos)")
+
+    return row
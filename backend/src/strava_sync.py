@@ -0,0 +1,158 @@
+# ==================== SINCRONIZAÇÃO INCREMENTAL DO STRAVA ====================
+# Sincronização por cursor: cada conexão guarda o epoch da última atividade
+# importada (FitnessConnection.sync_cursor) e pede ao Strava só o que veio
+# depois (`after`). Cada página é deduplicada com uma única consulta IN em
+# (connection_id, external_id), inserida em lote e gravada junto com o
+# avanço do cursor na mesma transação.
+
+import os
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+import requests
+from models import FitnessData
+from fitness_rollup import record_fitness_data
+from challenge_progress import track_fitness_data, dispatch_progress_events
+from antifraud import score_fitness_records, is_trusted
+
+STRAVA_ACTIVITIES_URL = 'https://www.strava.com/api/v3/athlete/activities'
+PER_PAGE = 200  # Máximo aceito pelo Strava
+MAX_PAGES = int(os.getenv('STRAVA_SYNC_MAX_PAGES', '50'))
+HISTORY_DAYS = int(os.getenv('STRAVA_SYNC_HISTORY_DAYS', '365'))  # Alcance da primeira sincronização
+
+STRAVA_TYPES = {
+    'Run': 'running',
+    'Ride': 'cycling',
+    'Walk': 'walking',
+    'Swim': 'swimming',
+    'Workout': 'fitness'
+}
+
+
+class StravaSyncError(Exception):
+    """Falha ao buscar atividades no Strava"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def map_strava_type(strava_type):
+    """Mapear tipos de atividade do Strava para tipos internos"""
+    return STRAVA_TYPES.get(strava_type, 'fitness')
+
+
+def _parse_start(activity):
+    return datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00'))
+
+
+def build_fitness_data(connection, activity):
+    """Cria o registro FitnessData de uma atividade do Strava"""
+    start_time = _parse_start(activity)
+    return FitnessData(
+        id=str(uuid.uuid4()),
+        user_id=connection.user_id,
+        connection_id=connection.id,
+        external_id=str(activity['id']),
+        data_type=map_strava_type(activity.get('type')),
+        value=(activity.get('distance') or 0) / 1000,  # Converter para km
+        unit='km',
+        start_time=start_time,
+        end_time=start_time + timedelta(seconds=activity.get('elapsed_time') or 0),
+        source_app='strava',
+        raw_data=json.dumps(activity)
+    )
+
+
+def existing_external_ids(session, connection_id, external_ids):
+    """IDs externos já importados para a conexão (uma consulta IN)"""
+    if not external_ids:
+        return set()
+    return {
+        row.external_id
+        for row in session.query(FitnessData.external_id).filter(
+            FitnessData.connection_id == connection_id,
+            FitnessData.external_id.in_(list(external_ids))
+        ).all()
+    }
+
+
+def fetch_page(access_token, after, per_page=PER_PAGE):
+    """Uma página de atividades iniciadas depois de `after` (ordem crescente)"""
+    response = requests.get(
+        STRAVA_ACTIVITIES_URL,
+        headers={'Authorization': f'Bearer {access_token}'},
+        params={'after': after, 'per_page': per_page, 'page': 1},
+        timeout=30
+    )
+    if response.status_code != 200:
+        raise StravaSyncError(f'Strava respondeu {response.status_code}', response.status_code)
+    return response.json()
+
+
+def sync_strava_connection(session, connection, access_token=None, on_new_records=None, max_pages=MAX_PAGES):
+    """
+    Importa todas as atividades novas de uma conexão Strava
+
+    Args:
+        session: Sessão SQLAlchemy (cada página é commitada)
+        connection: FitnessConnection do Strava
+        access_token: Token a usar (padrão: connection.access_token)
+        on_new_records: Callback (session, registros) chamado antes do commit de cada
+            página; pode retornar uma lista que é acumulada no resultado
+        max_pages: Limite de páginas por execução (o cursor continua na próxima)
+
+    Returns:
+        Dict com new_activities, pages, cursor, complete e callback_results
+    """
+    access_token = access_token or connection.access_token
+    cursor = connection.sync_cursor
+    if cursor is None:
+        cursor = int((datetime.now(timezone.utc) - timedelta(days=HISTORY_DAYS)).timestamp())
+
+    result = {'new_activities': 0, 'pages': 0, 'cursor': cursor, 'complete': False, 'callback_results': []}
+
+    while result['pages'] < max_pages:
+        activities = fetch_page(access_token, cursor)
+        result['pages'] += 1
+        if not activities:
+            result['complete'] = True
+            break
+
+        known = existing_external_ids(session, connection.id, {str(a['id']) for a in activities})
+        seen = set(known)
+        records = []
+        for activity in activities:
+            external_id = str(activity['id'])
+            if external_id in seen:
+                continue
+            seen.add(external_id)
+            records.append(build_fitness_data(connection, activity))
+
+        # Inserção em lote + rollup/anti-fraude/progresso + cursor na mesma transação
+        progress_events = []
+        if records:
+            session.add_all(records)
+            score_fitness_records(session, connection.user_id, records)
+            record_fitness_data(session, records)
+            progress_events = track_fitness_data(session, [r for r in records if is_trusted(r)])
+            if on_new_records:
+                result['callback_results'].extend(on_new_records(session, records) or [])
+
+        new_cursor = max(int(_parse_start(a).timestamp()) for a in activities)
+        connection.sync_cursor = max(cursor, new_cursor)
+        connection.last_sync = datetime.utcnow()
+        connection.sync_status = 'connected'
+        session.commit()
+        dispatch_progress_events(progress_events)
+
+        result['new_activities'] += len(records)
+        print(f"[SYNC] [STRAVA] Página {result['pages']}: {len(records)} novas de {len(activities)} (cursor {connection.sync_cursor})")
+
+        if len(activities) < PER_PAGE or connection.sync_cursor == cursor:
+            result['complete'] = True
+            break
+        cursor = connection.sync_cursor
+
+    result['cursor'] = connection.sync_cursor
+    return result
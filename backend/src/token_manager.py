@@ -0,0 +1,303 @@
+# ==================== GERENCIADOR DE TOKENS OAUTH ====================
+# Renova tokens do Strava e do Fitbit antes de expirarem (worker em
+# background) e sob demanda nos caminhos de request. Cada conexão tem um
+# lock próprio (single-flight): jobs concorrentes esperam a renovação em
+# andamento em vez de renovar duas vezes. Entre processos/nós, a linha da
+# conexão é lida com SELECT ... FOR UPDATE até o commit do token novo: quem
+# chega depois espera e reaproveita o token gravado (o refresh_token antigo
+# já foi invalidado pelo provedor). Tokens válidos ficam em cache em memória
+# para não reler o banco a cada chamada à API.
+# Falhas de renovação no worker têm backoff exponencial por conexão, e um
+# refresh_token recusado pelo provedor (revogado) não é reenviado até a
+# conexão receber um token novo (reconexão do usuário).
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+import requests
+import metrics
+from models import SessionLocal, FitnessConnection, FitbitUser
+
+logger = logging.getLogger(__name__)
+
+REFRESH_MARGIN = timedelta(seconds=int(os.getenv('TOKEN_REFRESH_MARGIN_SECONDS', '600')))
+REFRESH_INTERVAL = int(os.getenv('TOKEN_REFRESH_INTERVAL_SECONDS', '60'))
+RETRY_MAX_SECONDS = int(os.getenv('TOKEN_REFRESH_RETRY_MAX_SECONDS', '3600'))
+
+STRAVA_TOKEN_URL = 'https://www.strava.com/oauth/token'
+FITBIT_TOKEN_URL = 'https://api.fitbit.com/oauth2/token'
+
+# Tipos de registro que guardam tokens
+KIND_CONNECTION = 'connection'  # FitnessConnection (strava, fitbit)
+KIND_FITBIT_USER = 'fitbit_user'  # FitbitUser
+MODELS = {KIND_CONNECTION: FitnessConnection, KIND_FITBIT_USER: FitbitUser}
+REFRESHABLE_PLATFORMS = ('strava', 'fitbit')
+# Resposta 400/401 com um destes trechos = refresh_token recusado (Fitbit:
+# errorType invalid_grant; Strava: erro no campo refresh_token)
+REVOKED_MARKERS = ('invalid_grant', 'refresh_token')
+
+
+class TokenRefreshError(Exception):
+    """Falha ao renovar o token de uma conexão"""
+
+
+class TokenRevokedError(TokenRefreshError):
+    """refresh_token recusado pelo provedor: só uma nova autorização resolve"""
+
+
+class TokenManager:
+    def __init__(self, fitbit_credentials=None, strava_credentials=None):
+        self.fitbit_credentials = fitbit_credentials
+        self.strava_credentials = strava_credentials or (
+            os.getenv('STRAVA_CLIENT_ID'), os.getenv('STRAVA_CLIENT_SECRET')
+        )
+        self._cache = {}  # (tipo, id) -> (access_token, expires_at)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._failures = {}  # (tipo, id) -> (falhas seguidas, não tentar antes de) no worker
+        self._revoked = {}  # (tipo, id) -> refresh_token recusado pelo provedor
+        self._thread = None
+
+    # ==================== API PARA OS CAMINHOS DE REQUEST ====================
+
+    def get_access_token(self, record, force_refresh=False):
+        """
+        Token válido para um FitnessConnection ou FitbitUser
+
+        Renova (com lock por conexão) se estiver a menos de REFRESH_MARGIN da
+        expiração ou se force_refresh=True (ex.: a API respondeu 401).
+        """
+        key = (self._kind(record), record.id)
+        if not force_refresh:
+            cached = self._fresh(self._cache.get(key))
+            if cached:
+                return cached
+            if not self._needs_refresh(record.token_expires_at):
+                self._cache[key] = (record.access_token, record.token_expires_at)
+                return record.access_token
+
+        return self._refresh_single_flight(key, stale_token=record.access_token if force_refresh else None)
+
+    def authorized_get(self, record, url, **kwargs):
+        """GET autenticado; em 401 renova o token e tenta uma única vez de novo"""
+        headers = dict(kwargs.pop('headers', {}) or {})
+        kwargs.setdefault('timeout', 30)
+
+        headers['Authorization'] = f'Bearer {self.get_access_token(record)}'
+        response = requests.get(url, headers=headers, **kwargs)
+        if response.status_code == 401:
+            metrics.increment('oauth_unauthorized_retries', labels={'provider': self._provider(record)})
+            headers['Authorization'] = f'Bearer {self.get_access_token(record, force_refresh=True)}'
+            response = requests.get(url, headers=headers, **kwargs)
+        return response
+
+    def invalidate(self, record):
+        self._cache.pop((self._kind(record), record.id), None)
+
+    # ==================== RENOVAÇÃO ====================
+
+    @staticmethod
+    def _kind(record):
+        return KIND_FITBIT_USER if isinstance(record, FitbitUser) else KIND_CONNECTION
+
+    @staticmethod
+    def _provider(record):
+        return 'fitbit' if isinstance(record, FitbitUser) else (record.platform or 'unknown')
+
+    @staticmethod
+    def _needs_refresh(expires_at):
+        return expires_at is None or expires_at - REFRESH_MARGIN <= datetime.utcnow()
+
+    def _fresh(self, cached):
+        if cached and not self._needs_refresh(cached[1]):
+            return cached[0]
+        return None
+
+    def _lock_for(self, key):
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def _refresh_single_flight(self, key, stale_token=None):
+        with self._lock_for(key):
+            # Outro job pode ter renovado enquanto esperávamos o lock
+            cached = self._cache.get(key)
+            if cached and cached[0] != stale_token and self._fresh(cached):
+                return cached[0]
+            return self._refresh(key, stale_token)
+
+    def _refresh(self, key, stale_token=None):
+        kind, record_id = key
+        session = SessionLocal()
+        try:
+            # FOR UPDATE: trava a linha até o commit; outro processo que esteja
+            # renovando termina antes e a leitura já traz o token dele
+            record = session.get(MODELS[kind], record_id, with_for_update=True)
+            if record is None:
+                raise TokenRefreshError(f'Conexão {record_id} não encontrada')
+
+            # Outro processo pode ter renovado: usar o que está no banco
+            if record.access_token != stale_token and not self._needs_refresh(record.token_expires_at):
+                self._cache[key] = (record.access_token, record.token_expires_at)
+                return record.access_token
+
+            provider = self._provider(record)
+            if key in self._revoked and self._revoked[key] == record.refresh_token:
+                raise TokenRevokedError(f'refresh_token de {provider} {record_id} revogado: reconecte a conta')
+
+            started = time.perf_counter()
+            try:
+                tokens = self._request_refresh(provider, record.refresh_token)
+            except TokenRefreshError as e:
+                revoked = isinstance(e, TokenRevokedError)
+                metrics.increment('oauth_refresh_total', labels={
+                    'provider': provider, 'result': 'revoked' if revoked else 'failure'
+                })
+                if revoked:
+                    self._revoked[key] = record.refresh_token
+                if kind == KIND_CONNECTION:
+                    record.sync_status = 'error'
+                    record.error_message = str(e)
+                    session.commit()
+                logger.error(f"[TOKENS] Falha ao renovar {provider} {record_id}: {e}")
+                raise
+            finally:
+                metrics.observe('oauth_refresh_latency', time.perf_counter() - started, {'provider': provider})
+
+            record.access_token = tokens['access_token']
+            if tokens.get('refresh_token'):
+                record.refresh_token = tokens['refresh_token']
+            record.token_expires_at = tokens['expires_at']
+            if kind == KIND_CONNECTION and record.sync_status == 'error':
+                record.sync_status = 'connected'
+                record.error_message = None
+            session.commit()
+
+            metrics.increment('oauth_refresh_total', labels={'provider': provider, 'result': 'success'})
+            self._cache[key] = (record.access_token, record.token_expires_at)
+            self._failures.pop(key, None)
+            self._revoked.pop(key, None)
+            logger.info(f"[TOKENS] Token {provider} renovado para {record_id} (expira {record.token_expires_at})")
+            return record.access_token
+        finally:
+            session.close()
+
+    def _request_refresh(self, provider, refresh_token):
+        """Chama o endpoint OAuth do provedor e normaliza a resposta"""
+        if not refresh_token:
+            raise TokenRevokedError('Conexão sem refresh_token')
+
+        try:
+            if provider == 'strava':
+                client_id, client_secret = self.strava_credentials
+                response = requests.post(STRAVA_TOKEN_URL, data={
+                    'client_id': client_id,
+                    'client_secret': client_secret,
+                    'grant_type': 'refresh_token',
+                    'refresh_token': refresh_token
+                }, timeout=15)
+            elif provider == 'fitbit':
+                response = requests.post(FITBIT_TOKEN_URL, auth=self.fitbit_credentials, data={
+                    'grant_type': 'refresh_token',
+                    'refresh_token': refresh_token
+                }, timeout=15)
+            else:
+                raise TokenRefreshError(f'Provedor sem renovação: {provider}')
+        except requests.RequestException as e:
+            raise TokenRefreshError(f'Erro de rede: {e}')
+
+        if response.status_code in (400, 401) and any(m in response.text for m in REVOKED_MARKERS):
+            raise TokenRevokedError(f'HTTP {response.status_code}: {response.text[:200]}')
+        if response.status_code != 200:
+            raise TokenRefreshError(f'HTTP {response.status_code}: {response.text[:200]}')
+
+        data = response.json()
+        if data.get('expires_at'):
+            expires_at = datetime.utcfromtimestamp(data['expires_at'])
+        else:
+            expires_at = datetime.utcnow() + timedelta(seconds=data.get('expires_in', 3600))
+        return {
+            'access_token': data['access_token'],
+            'refresh_token': data.get('refresh_token'),
+            'expires_at': expires_at
+        }
+
+    # ==================== WORKER EM BACKGROUND ====================
+
+    def refresh_expiring(self):
+        """
+        Renova todos os tokens que expiram dentro de REFRESH_MARGIN
+
+        Pula os refresh_tokens já recusados pelo provedor e as conexões em
+        backoff depois de uma falha (REFRESH_INTERVAL * 2^falhas, até RETRY_MAX_SECONDS).
+        """
+        limit = datetime.utcnow() + REFRESH_MARGIN
+        session = SessionLocal()
+        try:
+            candidates = [
+                ((KIND_CONNECTION, row.id), row.refresh_token)
+                for row in session.query(FitnessConnection.id, FitnessConnection.refresh_token).filter(
+                    FitnessConnection.is_active == True,
+                    FitnessConnection.platform.in_(REFRESHABLE_PLATFORMS),
+                    FitnessConnection.refresh_token.isnot(None),
+                    FitnessConnection.token_expires_at <= limit
+                ).all()
+            ] + [
+                ((KIND_FITBIT_USER, row.id), row.refresh_token)
+                for row in session.query(FitbitUser.id, FitbitUser.refresh_token).filter(
+                    FitbitUser.token_expires_at <= limit
+                ).all()
+            ]
+        finally:
+            session.close()
+
+        now = time.monotonic()
+        keys = [
+            key for key, refresh_token in candidates
+            if not (key in self._revoked and self._revoked[key] == refresh_token)
+            and self._failures.get(key, (0, 0.0))[1] <= now
+        ]
+        metrics.set_gauge('oauth_tokens_expiring', len(candidates))
+        metrics.set_gauge('oauth_tokens_revoked', len(self._revoked))
+
+        refreshed = 0
+        for key in keys:
+            try:
+                self._refresh_single_flight(key)
+                refreshed += 1
+            except TokenRevokedError:
+                self._failures.pop(key, None)
+            except TokenRefreshError:
+                attempts = self._failures.get(key, (0, 0.0))[0] + 1
+                delay = min(REFRESH_INTERVAL * 2 ** attempts, RETRY_MAX_SECONDS)
+                self._failures[key] = (attempts, time.monotonic() + delay)
+        return refreshed
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh_expiring()
+            except Exception as e:
+                logger.error(f"[TOKENS] Erro no worker de renovação: {e}")
+            time.sleep(REFRESH_INTERVAL)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+
+token_manager = None
+
+
+def init_token_manager(fitbit_credentials=None, strava_credentials=None, start_worker=True):
+    """Cria o gerenciador global e inicia o worker de renovação"""
+    global token_manager
+    token_manager = TokenManager(fitbit_credentials, strava_credentials)
+    if start_worker:
+        token_manager.start()
+    return token_manager
@@ -0,0 +1,205 @@
+# ==================== INDICADOR DE DIGITAÇÃO AGREGADO ====================
+# O cliente emite 'typing' a cada tecla; repassar cada evento para a sala
+# inteira multiplica o tráfego nos chats de desafio grandes. Aqui o estado
+# "quem está digitando" fica por sala e só as mudanças são enviadas, num único
+# 'user_typing' por sala a cada TYPING_FLUSH_MS. Eventos repetidos do mesmo
+# remetente dentro de TYPING_MIN_INTERVAL_MS só renovam a expiração, e quem
+# para de enviar sai da lista após TYPING_TTL_SECONDS.
+# Em vários nós, cada nó publica pelo canal interno do socketio_backend quem
+# está digitando nas suas conexões (nas salas alteradas e, enquanto houver
+# alguém digitando, a cada TTL/2); cada nó soma as listas dos outros às
+# suas e avisa só os seus clientes (ignore_queue), como o presence_service.
+# A parte de um nó que parou de publicar expira após TYPING_TTL_SECONDS.
+
+import os
+import time
+import logging
+import threading
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FLUSH_MS = int(os.getenv('TYPING_FLUSH_MS', '500'))
+MIN_INTERVAL_MS = int(os.getenv('TYPING_MIN_INTERVAL_MS', '1000'))
+TTL_SECONDS = float(os.getenv('TYPING_TTL_SECONDS', '5'))
+MAX_LISTED_TYPISTS = 5
+
+
+class TypingService:
+    def __init__(self, socketio=None, manager=None):
+        self.socketio = socketio
+        self.manager = manager
+        self.node_id = getattr(manager, 'node_id', 'local')
+        self._lock = threading.Lock()
+        self._rooms = {}  # sala -> {sid: {'username', 'expires_at', 'last_event'}} (conexões deste nó)
+        self._remote = {}  # sala -> {node_id: {'users': [nomes], 'expires_at'}}
+        self._dirty = set()  # Salas com mudança a enviar aos clientes
+        self._unpublished = set()  # Salas com mudança local a publicar aos outros nós
+        self._published_at = 0.0
+        self._thread = None
+        if manager is not None and hasattr(manager, 'on_internal'):
+            manager.on_internal('typing', self._on_remote)
+
+    def update(self, sid, room, username, is_typing=True):
+        """Registra um evento 'typing' do cliente (não emite nada diretamente)"""
+        now = time.monotonic()
+        metrics.increment('typing_events_received')
+        with self._lock:
+            typists = self._rooms.setdefault(room, {})
+            current = typists.get(sid)
+            if not is_typing:
+                if current is not None:
+                    del typists[sid]
+                    self._mark(room)
+                if not typists:
+                    self._rooms.pop(room, None)
+                return
+            if current is not None:
+                # Já está digitando: só renova a expiração (rate limit por remetente)
+                current['expires_at'] = now + TTL_SECONDS
+                if (now - current['last_event']) * 1000 < MIN_INTERVAL_MS:
+                    metrics.increment('typing_events_coalesced')
+                    return
+                current['last_event'] = now
+                if current['username'] == username:
+                    return
+                current['username'] = username
+            else:
+                typists[sid] = {'username': username, 'expires_at': now + TTL_SECONDS, 'last_event': now}
+            self._mark(room)
+
+    def _mark(self, room):
+        self._dirty.add(room)
+        self._unpublished.add(room)
+
+    def clear(self, sid, room=None):
+        """Remove o remetente (mensagem enviada, saída da sala ou desconexão)"""
+        with self._lock:
+            rooms = [room] if room else list(self._rooms)
+            for name in rooms:
+                typists = self._rooms.get(name)
+                if typists and typists.pop(sid, None) is not None:
+                    self._mark(name)
+                    if not typists:
+                        del self._rooms[name]
+
+    def _usernames(self, room):
+        """Quem está digitando na sala em todos os nós (locais primeiro)"""
+        usernames = [t['username'] for t in self._rooms.get(room, {}).values()]
+        for node in self._remote.get(room, {}).values():
+            usernames.extend(node['users'])
+        return usernames
+
+    def typing_users(self, room):
+        with self._lock:
+            return self._usernames(room)
+
+    # ==================== SINCRONIZAÇÃO ENTRE NÓS ====================
+
+    def _publish(self, rooms):
+        if self.manager is not None and hasattr(self.manager, 'publish_internal'):
+            try:
+                self.manager.publish_internal('typing', {'rooms': rooms})
+            except Exception as e:
+                logger.warning(f"[TYPING] Erro ao publicar digitação: {e}")
+
+    def _on_remote(self, payload, node_id):
+        if not payload or node_id == self.node_id:
+            return
+        expires_at = time.monotonic() + TTL_SECONDS
+        with self._lock:
+            for room, users in (payload.get('rooms') or {}).items():
+                nodes = self._remote.setdefault(room, {})
+                previous = nodes.get(node_id)
+                if users:
+                    nodes[node_id] = {'users': list(users), 'expires_at': expires_at}
+                else:
+                    nodes.pop(node_id, None)
+                    if not nodes:
+                        del self._remote[room]
+                if (previous['users'] if previous else []) != list(users or []):
+                    self._dirty.add(room)
+
+    # ==================== ENVIO AGREGADO ====================
+
+    def flush(self):
+        """Expira quem parou de digitar, publica a parte local e envia um 'user_typing' por sala alterada"""
+        now = time.monotonic()
+        with self._lock:
+            for room, typists in list(self._rooms.items()):
+                for sid in [sid for sid, t in typists.items() if t['expires_at'] <= now]:
+                    del typists[sid]
+                    self._mark(room)
+                if not typists:
+                    del self._rooms[room]
+            for room, nodes in list(self._remote.items()):
+                for node_id in [n for n, node in nodes.items() if node['expires_at'] <= now]:
+                    del nodes[node_id]
+                    self._dirty.add(room)
+                if not nodes:
+                    del self._remote[room]
+
+            # Mudanças locais e, enquanto alguém digita, a renovação periódica para os outros nós
+            publish = set(self._unpublished)
+            if self._rooms and now - self._published_at >= TTL_SECONDS / 2:
+                publish.update(self._rooms)
+                self._published_at = now
+            self._unpublished = set()
+            published = {
+                room: [t['username'] for t in self._rooms.get(room, {}).values()] for room in publish
+            }
+
+            dirty, self._dirty = self._dirty, set()
+            updates = []
+            for room in dirty:
+                typists = self._rooms.get(room, {})
+                usernames = self._usernames(room)
+                update = {
+                    'room': room,
+                    'is_typing': bool(usernames),
+                    'username': usernames[0] if len(usernames) == 1 else None,
+                    'users': usernames[:MAX_LISTED_TYPISTS],
+                    'count': len(usernames)
+                }
+                # Um único digitando (neste nó) não recebe o próprio indicador
+                skip_sid = next(iter(typists)) if len(usernames) == 1 and len(typists) == 1 else None
+                updates.append((update, skip_sid))
+
+        if published:
+            self._publish(published)
+        for update, skip_sid in updates:
+            self._emit(update, skip_sid)
+        if updates:
+            metrics.increment('typing_updates_sent', len(updates))
+        return len(updates)
+
+    def _emit(self, update, skip_sid):
+        if self.socketio is None:
+            return
+        try:
+            # Cada nó soma as listas de todos os nós e avisa só os seus clientes
+            self.socketio.emit('user_typing', update, to=update['room'], skip_sid=skip_sid, ignore_queue=True)
+        except Exception as e:
+            logger.warning(f"[TYPING] Erro ao emitir digitação na sala {update['room']}: {e}")
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_MS / 1000.0)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[TYPING] Erro no worker de digitação: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+
+def init_typing_service(socketio, start_worker=True):
+    """Cria o agregador de digitação (sincronizado entre nós pelo client manager) e inicia o worker de envio"""
+    manager = getattr(getattr(socketio, 'server', None), 'manager', None)
+    service = TypingService(socketio, manager)
+    if start_worker:
+        service.start()
+    return service
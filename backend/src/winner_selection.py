@@ -0,0 +1,93 @@
+# ==================== SELEÇÃO DE VENCEDORES ====================
+# Ranking dos vencedores calculado no banco (ROW_NUMBER) com desempate
+# explícito: só as linhas vencedoras são trazidas para o Python, então a
+# memória da finalização não cresce com o número de participantes.
+# Usado por todos os caminhos de finalização (complete e finalize).
+
+import os
+from sqlalchemy import func, case
+from models import ChallengeParticipation
+from challenge_progress import challenge_metric
+
+# Pontuação mínima (score em %) para desafios validados por resultado enviado
+MIN_SCORE_REQUIRED = float(os.getenv('CHALLENGE_MIN_SCORE', '80'))
+
+SELECTION_TYPES = ('first_to_complete', 'top_performers', 'all_qualifiers')
+
+
+def selection_type_for(challenge):
+    selection_type = getattr(challenge, 'winner_selection_type', None) or 'first_to_complete'
+    return selection_type if selection_type in SELECTION_TYPES else 'first_to_complete'
+
+
+def max_winners_for(challenge):
+    return int(getattr(challenge, 'max_winners', 1) or 1)
+
+
+def min_score_for(challenge):
+    """
+    Resultado mínimo para se qualificar: a meta do desafio nos desafios
+    cumulativos (km, passos...), senão o score mínimo configurado
+    """
+    if challenge_metric(challenge) and challenge.target_value:
+        return float(challenge.target_value)
+    return MIN_SCORE_REQUIRED
+
+
+def _ordering(selection_type):
+    """Critério de ordenação + desempate de cada tipo de seleção"""
+    P = ChallengeParticipation
+    # Participações sem data de conclusão vão para o fim (portável entre SQLite e PostgreSQL)
+    completed_last = case((P.completed_at.is_(None), 1), else_=0)
+
+    if selection_type == 'top_performers':
+        # Maior resultado; empate: quem concluiu antes; depois quem entrou antes
+        return [P.result_value.desc(), completed_last, P.completed_at.asc(), P.joined_at.asc(), P.id.asc()]
+    if selection_type == 'all_qualifiers':
+        return [completed_last, P.completed_at.asc(), P.joined_at.asc(), P.id.asc()]
+    # first_to_complete: quem concluiu antes; empate: maior resultado
+    return [completed_last, P.completed_at.asc(), P.result_value.desc(), P.joined_at.asc(), P.id.asc()]
+
+
+def _qualified_filter(query, challenge):
+    P = ChallengeParticipation
+    return query.filter(
+        P.challenge_id == challenge.id,
+        P.status == 'completed',
+        P.result_value >= min_score_for(challenge)
+    )
+
+
+def count_qualified(session, challenge):
+    """Quantidade de participações concluídas e qualificadas (COUNT no banco)"""
+    return _qualified_filter(session.query(func.count(ChallengeParticipation.id)), challenge).scalar() or 0
+
+
+def select_winners(session, challenge, limit=None):
+    """
+    Seleciona os vencedores do desafio
+
+    Returns:
+        Lista de dicts {user_id, participation_id, position, result_value, completed_at}
+        ordenada pela posição (no máximo max_winners)
+    """
+    P = ChallengeParticipation
+    limit = limit or max_winners_for(challenge)
+    position = func.row_number().over(order_by=_ordering(selection_type_for(challenge))).label('position')
+
+    ranked = _qualified_filter(
+        session.query(P.id, P.user_id, P.result_value, P.completed_at, position), challenge
+    ).subquery()
+
+    rows = session.query(ranked).filter(ranked.c.position <= limit).order_by(ranked.c.position).all()
+
+    return [
+        {
+            'user_id': row.user_id,
+            'participation_id': row.id,
+            'position': int(row.position),
+            'result_value': row.result_value or 0,
+            'completed_at': row.completed_at
+        }
+        for row in rows
+    ]
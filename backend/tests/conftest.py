@@ -0,0 +1,9 @@
+# Testes do backend: python -m pytest backend/tests
+import os
+import sys
+import tempfile
+
+# Banco SQLite temporário: importar models não pode criar tabelas no betfit.db do repositório
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='betfit-tests-'), 'test.db'))
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,318 @@
+# Verificação GPS (strava_streams): teleporte, trechos de veículo, distância
+# informada divergente, custo do cálculo vetorizado em atividades longas e a
+# etapa do webhook (verify_strava_activity) sobre o registro FitnessData.
+#
+# fixtures/strava_streams_run.json está no formato da resposta de
+# GET /activities/{id}/streams?keys=latlng,time&key_by_type=true (mais o
+# stream distance do Strava): corrida de ~4.8 km em 4 voltas, amostragem
+# irregular de 1-3 s, deriva lenta do GPS e uma parada de ~40 s.
+import os
+import json
+import time
+import uuid
+from datetime import datetime
+import numpy as np
+import pytest
+import requests
+
+import strava_streams
+from strava_streams import (
+    compute_stream_metrics, stream_flags, haversine_km, verify_strava_activity,
+    EARTH_RADIUS_KM, VEHICLE_MIN_SECONDS
+)
+from models import Base, engine, SessionLocal, FitnessData, StravaStreamMetrics
+from antifraud import is_trusted
+
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180.0
+START = (-23.5505, -46.6333)  # São Paulo
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def track(speeds_kmh, start=START):
+    """
+    Streams latlng/time de uma atividade para o norte, um ponto por segundo
+
+    Args:
+        speeds_kmh: velocidade de cada segmento de 1 s (len + 1 pontos)
+    """
+    step_km = np.asarray(speeds_kmh, dtype=float) / 3600.0
+    lat = start[0] + np.concatenate(([0.0], np.cumsum(step_km))) / KM_PER_DEGREE
+    latlng = np.column_stack((lat, np.full(len(lat), start[1])))
+    times = np.arange(len(lat), dtype=float)
+    return latlng, times
+
+
+def load_streams(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def as_response(latlng, times):
+    """Corpo da API de streams (key_by_type=true) para streams gerados por track()"""
+    return {
+        'latlng': {'data': np.asarray(latlng).tolist(), 'series_type': 'distance'},
+        'time': {'data': np.asarray(times).tolist(), 'series_type': 'distance'}
+    }
+
+
+@pytest.fixture
+def recorded_run():
+    return load_streams('strava_streams_run.json')
+
+
+@pytest.fixture
+def run_5k():
+    """5 km correndo a 12 km/h (1500 s)"""
+    return track(np.full(1500, 12.0))
+
+
+@pytest.fixture
+def run_with_teleport():
+    """Mesma corrida com um salto de 5 km em 1 s no meio"""
+    speeds = np.full(1500, 12.0)
+    speeds[750] = 5.0 * 3600.0
+    return track(speeds)
+
+
+@pytest.fixture
+def run_with_car():
+    """Corrida a 10 km/h com 120 s a 60 km/h (carro) no meio"""
+    return track(np.concatenate((np.full(600, 10.0), np.full(120, 60.0), np.full(600, 10.0))))
+
+
+def test_haversine_one_degree_of_latitude():
+    assert haversine_km(0.0, 0.0, 1.0, 0.0) == pytest.approx(KM_PER_DEGREE, rel=1e-9)
+
+
+def test_clean_run_has_no_flags(run_5k):
+    latlng, times = run_5k
+    metrics = compute_stream_metrics(latlng, times, 'running')
+
+    assert metrics['points'] == 1501
+    assert metrics['distance_km'] == pytest.approx(5.0, abs=0.001)
+    assert metrics['valid_distance_km'] == pytest.approx(5.0, abs=0.001)
+    assert metrics['moving_time_s'] == pytest.approx(1500.0)
+    assert metrics['max_speed_kmh'] == pytest.approx(12.0, abs=0.01)
+    assert metrics['teleport_count'] == 0
+    assert metrics['vehicle_seconds'] == 0.0
+    assert stream_flags(metrics, 5.0) == []
+
+
+def test_teleport_is_counted_and_excluded(run_with_teleport):
+    latlng, times = run_with_teleport
+    metrics = compute_stream_metrics(latlng, times, 'running')
+
+    assert metrics['teleport_count'] == 1
+    # O salto não entra na distância, no tempo em movimento nem na velocidade máxima
+    assert metrics['distance_km'] == pytest.approx(1499 * 12.0 / 3600.0, abs=0.001)
+    assert metrics['moving_time_s'] == pytest.approx(1499.0)
+    assert metrics['max_speed_kmh'] < 25.0
+    assert stream_flags(metrics, metrics['distance_km']) == ['gps_teleport']
+
+
+def test_sustained_vehicle_segment(run_with_car):
+    latlng, times = run_with_car
+    metrics = compute_stream_metrics(latlng, times, 'running')
+
+    assert metrics['teleport_count'] == 0
+    assert metrics['vehicle_seconds'] == pytest.approx(120.0)
+    assert metrics['vehicle_distance_km'] == pytest.approx(2.0, abs=0.001)
+    assert metrics['valid_distance_km'] == pytest.approx(metrics['distance_km'] - 2.0, abs=0.001)
+    assert 'gps_vehicle_segment' in stream_flags(metrics, metrics['distance_km'])
+
+
+def test_short_burst_is_not_a_vehicle():
+    burst = int(VEHICLE_MIN_SECONDS) - 10
+    latlng, times = track(np.concatenate((np.full(300, 10.0), np.full(burst, 40.0), np.full(300, 10.0))))
+    metrics = compute_stream_metrics(latlng, times, 'running')
+
+    assert metrics['vehicle_seconds'] == 0.0
+    assert metrics['valid_distance_km'] == metrics['distance_km']
+
+
+def test_vehicle_limit_depends_on_activity_type(run_with_car):
+    latlng, times = run_with_car
+    # 60 km/h é plausível de bicicleta (limite de 80 km/h)
+    assert compute_stream_metrics(latlng, times, 'cycling')['vehicle_seconds'] == 0.0
+
+
+@pytest.mark.parametrize('reported_km, flagged', [
+    (5.0, False),
+    (5.4, False),  # Dentro da tolerância de 10%
+    (5.6, True),
+    (8.0, True),
+])
+def test_distance_mismatch(run_5k, reported_km, flagged):
+    latlng, times = run_5k
+    metrics = compute_stream_metrics(latlng, times, 'running')
+    assert ('gps_distance_mismatch' in stream_flags(metrics, reported_km)) == flagged
+
+
+def test_streams_with_different_lengths_use_the_shorter(run_5k):
+    latlng, times = run_5k
+    metrics = compute_stream_metrics(latlng, times[:751], 'running')
+    assert metrics['points'] == 751
+    assert metrics['distance_km'] == pytest.approx(2.5, abs=0.001)
+
+
+@pytest.mark.parametrize('latlng, times', [([], []), ([START], [0.0])])
+def test_too_few_points(latlng, times):
+    metrics = compute_stream_metrics(latlng, times, 'running')
+    assert metrics['distance_km'] == 0.0
+    assert stream_flags(metrics, 5.0) == []
+
+
+def test_recorded_run_has_no_flags(recorded_run):
+    latlng, times = recorded_run['latlng']['data'], recorded_run['time']['data']
+    strava_km = recorded_run['distance']['data'][-1] / 1000.0
+    metrics = compute_stream_metrics(latlng, times, 'running')
+
+    assert metrics['points'] == recorded_run['latlng']['original_size']
+    # A deriva do GPS não pode afastar a distância recalculada da do Strava
+    assert metrics['distance_km'] == pytest.approx(strava_km, rel=0.01)
+    assert metrics['valid_distance_km'] == metrics['distance_km']
+    # A parada no meio não conta como tempo em movimento
+    assert metrics['moving_time_s'] < times[-1] - 30
+    assert metrics['max_speed_kmh'] < 15.0
+    assert stream_flags(metrics, strava_km) == []
+
+
+def test_10k_points_is_fast():
+    rng = np.random.default_rng(42)
+    speeds = rng.uniform(8.0, 14.0, 9999)
+    speeds[rng.choice(9999, 5, replace=False)] = 2000.0  # Alguns teleportes
+    speeds[4000:4100] = 50.0  # Um trecho de veículo
+    latlng, times = track(speeds)
+
+    compute_stream_metrics(latlng, times, 'running')  # Aquecimento (imports do NumPy)
+    timings = []
+    for _ in range(5):
+        started = time.perf_counter()
+        metrics = compute_stream_metrics(latlng, times, 'running')
+        timings.append(time.perf_counter() - started)
+    elapsed = min(timings)  # Melhor de 5: ignora pausas do agendador em CI compartilhado
+
+    assert metrics['points'] == 10000
+    assert metrics['teleport_count'] == 5
+    assert metrics['vehicle_seconds'] == pytest.approx(100.0)
+    # ~0.5 ms numa máquina comum; 5 ms mantém a meta de poucos milissegundos com folga
+    assert elapsed < 0.005, f"compute_stream_metrics levou {elapsed * 1000:.2f} ms para 10k pontos"
+
+
+# ==================== verify_strava_activity ====================
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self._body = body or {}
+
+    def json(self):
+        return self._body
+
+
+@pytest.fixture
+def session():
+    Base.metadata.create_all(engine)
+    session = SessionLocal()
+    yield session
+    session.rollback()
+    session.close()
+
+
+@pytest.fixture
+def verification(monkeypatch):
+    """Liga a verificação e troca a chamada à API de streams; retorna as chamadas feitas"""
+    calls = []
+
+    def serve(result):
+        def fake_get(url, **kwargs):
+            calls.append(url)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        monkeypatch.setattr(strava_streams.requests, 'get', fake_get)
+        return calls
+
+    monkeypatch.setattr(strava_streams, 'STREAM_VERIFICATION_ENABLED', True)
+    return serve
+
+
+def activity(session, km, trust_score=None, fraud_reasons=None):
+    record = FitnessData(
+        id=str(uuid.uuid4()), user_id='user-1', connection_id='conn-1', external_id=str(uuid.uuid4()),
+        data_type='running', value=km, unit='km', start_time=datetime(2026, 10, 1, 7, 0),
+        source_app='strava', trust_score=trust_score, fraud_reasons=fraud_reasons
+    )
+    session.add(record)
+    return record
+
+
+def test_verify_recorded_run_keeps_value_and_score(session, verification, recorded_run):
+    calls = verification(FakeResponse(200, recorded_run))
+    strava_km = recorded_run['distance']['data'][-1] / 1000.0
+    record = activity(session, strava_km, trust_score=0.9)
+
+    row = verify_strava_activity(session, record, 'token', 12345)
+    session.flush()
+
+    assert calls == [strava_streams.STREAMS_URL.format(activity_id=12345)]
+    assert row.verified and row.flags is None
+    assert row.strava_activity_id == '12345'
+    assert row.reported_distance_km == pytest.approx(strava_km)
+    assert record.value == pytest.approx(strava_km)
+    assert record.trust_score == 0.9
+    assert record.fraud_reasons is None
+    assert session.get(StravaStreamMetrics, record.id) is row
+
+
+def test_verify_inflated_distance_downgrades_score(session, verification, recorded_run):
+    verification(FakeResponse(200, recorded_run))
+    record = activity(session, 8.0, trust_score=0.9, fraud_reasons='baseline_jump')
+
+    row = verify_strava_activity(session, record, 'token', 1)
+
+    assert not row.verified and row.flags == 'gps_distance_mismatch'
+    # Valor corrigido para a distância recalculada pelos streams
+    assert record.value == pytest.approx(row.valid_distance_km)
+    assert record.value == pytest.approx(4.8, abs=0.05)
+    assert record.trust_score == pytest.approx(0.9 * (1 - strava_streams.STREAM_PENALTIES['gps_distance_mismatch']))
+    assert record.fraud_reasons == 'baseline_jump,gps_distance_mismatch'
+
+
+def test_verify_vehicle_segment_removes_distance_and_blocks_record(session, verification, run_with_car):
+    verification(FakeResponse(200, as_response(*run_with_car)))
+    record = activity(session, 1200 * 10.0 / 3600.0 + 2.0)  # Distância informada inclui o carro
+
+    row = verify_strava_activity(session, record, 'token', 2)
+
+    assert row.flags == 'gps_vehicle_segment'
+    assert record.value == pytest.approx(1200 * 10.0 / 3600.0, abs=0.001)
+    assert record.trust_score == pytest.approx(1 - strava_streams.STREAM_PENALTIES['gps_vehicle_segment'])
+    assert not is_trusted(record)  # Não completa desafios nem paga prêmios
+
+
+@pytest.mark.parametrize('result', [
+    FakeResponse(404),
+    FakeResponse(429),
+    FakeResponse(200, {}),  # Atividade manual/sem GPS: sem streams latlng/time
+    requests.ConnectionError('timeout'),
+])
+def test_verify_fetch_failure_leaves_record_untouched(session, verification, result):
+    calls = verification(result)
+    record = activity(session, 5.0, trust_score=0.8)
+
+    assert verify_strava_activity(session, record, 'token', 3) is None
+    session.flush()
+
+    assert len(calls) == 1
+    assert record.value == 5.0 and record.trust_score == 0.8 and record.fraud_reasons is None
+    assert session.get(StravaStreamMetrics, record.id) is None
+
+
+def test_verify_disabled_does_not_fetch(session, verification, monkeypatch):
+    calls = verification(FakeResponse(200, {}))
+    monkeypatch.setattr(strava_streams, 'STREAM_VERIFICATION_ENABLED', False)
+    record = activity(session, 5.0)
+
+    assert verify_strava_activity(session, record, 'token', 4) is None
+    assert calls == []